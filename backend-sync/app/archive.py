@@ -0,0 +1,303 @@
+"""
+Cold-storage archive tier for old stock events.
+Events older than ARCHIVE_AFTER_DAYS are rarely read but keep growing the
+stock_events indexes. The archiver moves them into compressed columnar files
+on local disk, one directory per tenant and month:
+
+    ARCHIVE_PATH/tenant=<uuid>/month=2025-03/events-<timestamp>.parquet
+
+Parquet (zstd) is written when pyarrow is installed; otherwise gzip-compressed
+column lists (.json.gz). Both are read back. Only events every active device
+has pulled (below the tenant's safe horizon, as for tombstone GC) are moved,
+and the tenant's newest event always stays, so the Lamport clock never
+regresses. Audits and rebuilds read the archive through ArchiveStore.events.
+
+Usage:
+    python -m app.archive [--tenant UUID] [--after-days 365] [--batch-size 10000]
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, get_args
+from uuid import UUID
+import argparse
+import gzip
+import json
+import os
+
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+
+from .database import set_tenant_context
+from .devices import DeviceRegistry
+from .models import StockEvent, SyncDevice
+from .shards import TenantMoving, engine_for_tenant, ensure_placed, shard_engines
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional dependency
+    pyarrow = None
+
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+
+PARQUET = ".parquet"
+JSON_GZ = ".json.gz"
+
+DEFAULT_BATCH_SIZE = 10_000
+
+EVENT_FIELDS = tuple(StockEvent.model_fields)
+
+
+def _fields_of(kind) -> Tuple[str, ...]:
+    return tuple(
+        name for name, info in StockEvent.model_fields.items()
+        if info.annotation is kind or kind in get_args(info.annotation)
+    )
+
+
+UUID_FIELDS = _fields_of(UUID)
+DATETIME_FIELDS = _fields_of(datetime)
+
+
+def month_of(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m")
+
+
+def _encode(events: List[StockEvent], text_dates: bool) -> Dict[str, List]:
+    """Column lists of events (UUIDs as text; datetimes as ISO text for JSON)."""
+    columns = {}
+    for field in EVENT_FIELDS:
+        values = [getattr(event, field) for event in events]
+        if field in UUID_FIELDS:
+            values = [str(v) if v is not None else None for v in values]
+        elif field in DATETIME_FIELDS and text_dates:
+            values = [v.isoformat() if v is not None else None for v in values]
+        columns[field] = values
+    return columns
+
+
+def _decode(row: Dict) -> StockEvent:
+    for field in UUID_FIELDS:
+        if row.get(field) is not None:
+            row[field] = UUID(row[field])
+    for field in DATETIME_FIELDS:
+        if isinstance(row.get(field), str):
+            row[field] = datetime.fromisoformat(row[field])
+    return StockEvent(**row)
+
+
+class ArchiveStore:
+    """Archive files of one root directory."""
+
+    def __init__(self, root: str = ARCHIVE_PATH):
+        self.root = Path(root)
+
+    def exists(self) -> bool:
+        return self.root.is_dir()
+
+    def _tenant_dir(self, tenant_id: UUID) -> Path:
+        return self.root / f"tenant={tenant_id}"
+
+    def write(self, tenant_id: UUID, month: str, events: List[StockEvent]) -> Path:
+        """Write one file of events (atomically: temp file, fsync, rename)."""
+        directory = self._tenant_dir(tenant_id) / f"month={month}"
+        directory.mkdir(parents=True, exist_ok=True)
+
+        extension = PARQUET if pyarrow is not None else JSON_GZ
+        path = directory / f"events-{datetime.utcnow():%Y%m%dT%H%M%S%f}{extension}"
+        temp = path.with_name(path.name + ".tmp")
+
+        if extension == PARQUET:
+            table = pyarrow.Table.from_pydict(_encode(events, text_dates=False))
+            pyarrow.parquet.write_table(table, temp, compression="zstd")
+        else:
+            with gzip.open(temp, "wt") as archive:
+                json.dump(_encode(events, text_dates=True), archive)
+
+        with open(temp, "rb") as written:
+            os.fsync(written.fileno())
+        os.replace(temp, path)
+        return path
+
+    def tenants(self) -> List[UUID]:
+        if not self.exists():
+            return []
+        return [UUID(d.name.split("=", 1)[1]) for d in self.root.glob("tenant=*") if d.is_dir()]
+
+    def _files(self, tenant_id: UUID, since: Optional[datetime], until: Optional[datetime]) -> Iterator[Path]:
+        """Archive files of a tenant, pruned by month."""
+        first = month_of(since) if since else None
+        last = month_of(until) if until else None
+
+        for directory in sorted(self._tenant_dir(tenant_id).glob("month=*")):
+            month = directory.name.split("=", 1)[1]
+            if (first and month < first) or (last and month > last):
+                continue
+            for path in sorted(directory.iterdir()):
+                if path.name.endswith(PARQUET) or path.name.endswith(JSON_GZ):
+                    yield path
+
+    def _rows(
+        self,
+        path: Path,
+        products: Optional[Set[UUID]] = None,
+        columns: Tuple[str, ...] = EVENT_FIELDS
+    ) -> Iterator[Dict]:
+        """Raw rows of one file: only the given columns, only rows of the given products."""
+        wanted = {str(p) for p in products} if products is not None else None
+
+        if path.name.endswith(PARQUET):
+            if pyarrow is None:
+                raise RuntimeError(f"pyarrow is required to read {path}")
+            # Pushed down: row groups without the products are skipped, other columns never decoded
+            filters = [("product_id", "in", sorted(wanted))] if wanted is not None else None
+            yield from pyarrow.parquet.read_table(path, columns=list(columns), filters=filters).to_pylist()
+            return
+
+        with gzip.open(path, "rt") as archive:
+            data = json.load(archive)
+        product_column = data["product_id"]
+        selected = [data[c] for c in columns]
+        for index in range(len(product_column)):
+            if wanted is None or product_column[index] in wanted:
+                yield {c: values[index] for c, values in zip(columns, selected)}
+
+    def events(
+        self,
+        tenant_id: UUID,
+        product_ids: Optional[Iterable[UUID]] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> List[StockEvent]:
+        """
+        Archived events of a tenant (optionally of some products, created in
+        [since, until)), in Lamport order. Rows of other products are dropped
+        while reading. A row archived twice (the job was interrupted between
+        writing and deleting) is returned once.
+        """
+        products = set(product_ids) if product_ids is not None else None
+        seen = {}
+
+        for path in self._files(tenant_id, since, until):
+            for row in self._rows(path, products):
+                event = _decode(row)
+                if (since and event.created_at < since) or (until and event.created_at >= until):
+                    continue
+                seen[event.id] = event
+
+        return sorted(seen.values(), key=lambda e: e.lamport_ts)
+
+    def product_counts(self, tenant_id: UUID, product_ids: Optional[Iterable[UUID]] = None) -> Dict[UUID, int]:
+        """
+        Archived events per product of a tenant, reading only the product_id
+        column. A row archived twice counts twice: the counts size partitions.
+        """
+        products = set(product_ids) if product_ids is not None else None
+        counts: Dict[str, int] = defaultdict(int)
+        for path in self._files(tenant_id, None, None):
+            for row in self._rows(path, products, ("product_id",)):
+                counts[row["product_id"]] += 1
+        return {UUID(product_id): events for product_id, events in counts.items()}
+
+
+class Archiver:
+    """Moves a tenant's cold events from stock_events to the archive."""
+
+    def __init__(
+        self,
+        session: Session,
+        store: ArchiveStore,
+        after_days: int = ARCHIVE_AFTER_DAYS,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ):
+        self.session = session
+        self.store = store
+        self.after_days = after_days
+        self.batch_size = batch_size
+
+    def archive(self, tenant_id: UUID) -> Dict:
+        cutoff = datetime.utcnow() - timedelta(days=self.after_days)
+
+        # Never the newest event: the tenant's Lamport clock is derived from it
+        head = self.session.exec(
+            select(func.max(StockEvent.lamport_ts)).where(StockEvent.tenant_id == tenant_id)
+        ).first() or 0
+        horizon = min(DeviceRegistry(self.session).safe_horizon(tenant_id), head - 1)
+
+        archived, files = 0, 0
+        while True:
+            # A long run must not keep deleting on a shard the tenant is being moved off
+            ensure_placed(tenant_id, self.session.get_bind())
+            events = self.session.exec(
+                select(StockEvent).where(
+                    StockEvent.tenant_id == tenant_id,
+                    StockEvent.created_at < cutoff,
+                    StockEvent.lamport_ts <= horizon
+                ).order_by(StockEvent.lamport_ts).limit(self.batch_size)
+            ).all()
+            if not events:
+                break
+
+            by_month: Dict[str, List[StockEvent]] = defaultdict(list)
+            for event in events:
+                by_month[month_of(event.created_at)].append(event)
+
+            # Files are durable before the rows go
+            for month, month_events in by_month.items():
+                self.store.write(tenant_id, month, month_events)
+                files += 1
+
+            # Devices behind the archived events can no longer pull them: they must resync
+            DeviceRegistry(self.session).record_collected(tenant_id, events[-1].lamport_ts)
+            self.session.exec(delete(StockEvent).where(StockEvent.id.in_([e.id for e in events])))
+            self.session.commit()
+            archived += len(events)
+
+        return {"status": "archived", "events": archived, "files": files, "cutoff": cutoff.isoformat()}
+
+
+def archive_all(
+    tenant_id: Optional[UUID] = None,
+    after_days: int = ARCHIVE_AFTER_DAYS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    root: str = ARCHIVE_PATH
+) -> None:
+    """Run one archival pass over one tenant or every tenant with devices."""
+    store = ArchiveStore(root)
+
+    if tenant_id:
+        tenant_ids = [tenant_id]
+    else:
+        tenant_ids = []
+        for shard_engine in shard_engines().values():
+            with Session(shard_engine) as session:
+                tenant_ids += session.exec(select(SyncDevice.tenant_id).distinct()).all()
+
+    for tid in dict.fromkeys(tenant_ids):
+        try:
+            with Session(engine_for_tenant(tid)) as session:
+                set_tenant_context(session, tid)
+                result = Archiver(session, store, after_days, batch_size).archive(tid)
+        except TenantMoving:
+            # Batches already archived are committed; the next pass continues on the new shard
+            print(f"[INFO] Archive tenant={tid} skipped (moving shards)")
+            continue
+        print(f"[INFO] Archive tenant={tid} {result}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move cold stock events to the archive")
+    parser.add_argument("--tenant", type=UUID, help="Only archive this tenant")
+    parser.add_argument("--after-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--path", default=ARCHIVE_PATH, help="Archive root directory")
+    args = parser.parse_args()
+
+    archive_all(args.tenant, args.after_days, args.batch_size, args.path)
+
+
+if __name__ == "__main__":
+    main()
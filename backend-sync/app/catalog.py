@@ -0,0 +1,164 @@
+"""
+Product lookup by SKU for barcode and QR scanners.
+Checkout counters resolve every scan with GET /products/by-sku/{sku} (or a
+batch of scans with POST /products/lookup). Resolved products are kept in a
+per-tenant in-process LRU. Misses read the (tenant_id, sku) unique index, so
+a scan is a dictionary hit almost always.
+
+The worker that applies a push with product state or stock counters drops
+the tenant's entries once the push is committed. Other workers see the change
+after at most SKU_CACHE_TTL_SECONDS.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+import os
+import threading
+import time
+
+from sqlmodel import Session, select
+
+from .models import Product
+from .schemas import SyncPushRequest
+
+SKU_CACHE_SIZE = int(os.getenv("SKU_CACHE_SIZE", "5000"))  # Per tenant; 0 disables the cache
+SKU_CACHE_TENANTS = int(os.getenv("SKU_CACHE_TENANTS", "256"))
+SKU_CACHE_TTL_SECONDS = float(os.getenv("SKU_CACHE_TTL_SECONDS", "30"))
+
+
+def normalize_sku(sku: str) -> str:
+    """Scanners often send a trailing newline or padding."""
+    return sku.strip()
+
+
+def product_view(product: Product) -> Dict:
+    """What a checkout needs of a scanned product."""
+    return {
+        "id": str(product.id),
+        "sku": product.sku,
+        "name": product.name,
+        "price": product.price,
+        "category": product.category,
+        "current_stock": product.current_stock,
+        "lamport_ts": product.lamport_ts,
+    }
+
+
+class SkuCache:
+    """
+    LRU of product views per tenant, and LRU of tenants. Unknown SKUs are
+    cached too (as None), so a bad label scanned repeatedly stays cheap.
+    """
+
+    def __init__(self, size: int = SKU_CACHE_SIZE, tenants: int = SKU_CACHE_TENANTS, ttl: float = SKU_CACHE_TTL_SECONDS):
+        self.size = size
+        self.tenants = tenants
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[UUID, OrderedDict[str, Tuple[float, Optional[Dict]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, tenant_id: UUID, skus: Iterable[str]) -> Tuple[Dict[str, Optional[Dict]], List[str]]:
+        """(cached views by SKU, SKUs to load)."""
+        now = time.monotonic()
+        found, missing = {}, []
+
+        with self._lock:
+            entries = self._entries.get(tenant_id)
+            if entries is not None:
+                self._entries.move_to_end(tenant_id)
+
+            for sku in skus:
+                cached = entries.get(sku) if entries is not None else None
+                if cached and now - cached[0] < self.ttl:
+                    entries.move_to_end(sku)
+                    found[sku] = cached[1]
+                else:
+                    missing.append(sku)
+
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        return found, missing
+
+    def put_many(self, tenant_id: UUID, views: Dict[str, Optional[Dict]]) -> None:
+        now = time.monotonic()
+
+        with self._lock:
+            entries = self._entries.get(tenant_id)
+            if entries is None:
+                entries = self._entries[tenant_id] = OrderedDict()
+                while len(self._entries) > self.tenants:
+                    self._entries.popitem(last=False)
+            self._entries.move_to_end(tenant_id)
+
+            for sku, view in views.items():
+                entries[sku] = (now, view)
+                entries.move_to_end(sku)
+            while len(entries) > self.size:
+                entries.popitem(last=False)
+
+    def invalidate(self, tenant_id: UUID) -> None:
+        with self._lock:
+            self._entries.pop(tenant_id, None)
+
+
+_cache: Optional[SkuCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_sku_cache() -> Optional[SkuCache]:
+    """Process-wide cache, or None when disabled (SKU_CACHE_SIZE=0)."""
+    global _cache
+
+    if SKU_CACHE_SIZE <= 0:
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = SkuCache()
+
+    return _cache
+
+
+def lookup_skus(session: Session, tenant_id: UUID, skus: Iterable[str]) -> Dict[str, Optional[Dict]]:
+    """Product view of each SKU of the tenant (None when unknown or deleted)."""
+    skus = list(dict.fromkeys(normalize_sku(sku) for sku in skus))
+    cache = get_sku_cache()
+
+    if cache:
+        found, missing = cache.get_many(tenant_id, skus)
+    else:
+        found, missing = {}, skus
+
+    if missing:
+        loaded = dict.fromkeys(missing)
+        for product in session.exec(
+            select(Product).where(
+                Product.tenant_id == tenant_id,
+                Product.sku.in_(missing),
+                Product.is_deleted == False
+            )
+        ).all():
+            loaded[product.sku] = product_view(product)
+
+        if cache:
+            cache.put_many(tenant_id, loaded)
+        found.update(loaded)
+
+    return {sku: found[sku] for sku in skus}
+
+
+def invalidate_after_push(tenant_id: Optional[UUID], request: SyncPushRequest) -> None:
+    """Drop cached products of the tenants a committed push changed products or stock of."""
+    cache = get_sku_cache()
+    if cache is None or not (request.products or request.counters):
+        return
+
+    tenants = {p.tenant_id for p in request.products} | {c.tenant_id for c in request.counters}
+    if tenant_id:
+        tenants.add(tenant_id)
+    for tid in tenants:
+        cache.invalidate(tid)
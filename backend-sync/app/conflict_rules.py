@@ -0,0 +1,382 @@
+"""
+Declarative conflict resolution rules for the Sync Engine.
+The three-tier strategy (hardcoded -> heuristics -> manual) is expressed as an
+ordered rule table, configurable per tenant, and compiled into one generated
+Python function that scores a whole batch of conflicting pairs in one pass.
+
+A rule:
+    {
+        "name": "paid_sale_new",
+        "when": [["new.payment_status", "eq", "PAID"],
+                 ["existing.payment_status", "ne", "PAID"]],
+        "winner": "new",            # "new" | "existing"
+        "method": "HARDCODED",      # "HARDCODED" | "HEURISTIC" | "MANUAL"
+        "reason": "Paid sale has absolute priority",
+        "confidence": 1.0,
+        "requires_approval": false
+    }
+
+The operand of a condition is a literal, or {"field": "existing.lamport_ts"}
+to compare both operations. The first matching rule wins; a rule with an
+empty "when" always matches.
+
+Tables are checked when they are stored, so evaluation never raises at push
+time: "in"/"not_in" take a list (and only they do), ordered operators
+(lt, le, gt, ge) need operands of comparable types and never match a null
+field, and floats must be finite.
+"""
+
+from collections import OrderedDict
+from hashlib import sha256
+from operator import attrgetter, itemgetter
+from typing import Dict, List, Optional, Sequence, Tuple, Union, get_args, get_origin
+from uuid import UUID
+import json
+import math
+import threading
+
+from sqlmodel import Session, select
+
+from .models import ConflictRuleSet, StockEvent
+
+
+class ConflictResolution:
+    """Result of conflict resolution attempt."""
+
+    __slots__ = ("winner_id", "reason", "method", "confidence", "requires_approval")
+
+    def __init__(
+        self,
+        winner_id: UUID,
+        reason: str,
+        method: str,
+        confidence: float = 1.0,
+        requires_approval: bool = False
+    ):
+        self.winner_id = winner_id
+        self.reason = reason
+        self.method = method
+        self.confidence = confidence
+        self.requires_approval = requires_approval
+
+
+class InvalidRuleTable(ValueError):
+    """Raised when a rule table cannot be compiled."""
+
+
+DEFAULT_RULES: List[Dict] = [
+    # TIER 1: HARDCODED RULES (deterministic, highest priority)
+    {
+        "name": "paid_sale_new",
+        "when": [["new.payment_status", "eq", "PAID"], ["existing.payment_status", "ne", "PAID"]],
+        "winner": "new",
+        "method": "HARDCODED",
+        "reason": "Paid sale has absolute priority",
+        "confidence": 1.0
+    },
+    {
+        "name": "paid_sale_existing",
+        "when": [["existing.payment_status", "eq", "PAID"], ["new.payment_status", "ne", "PAID"]],
+        "winner": "existing",
+        "method": "HARDCODED",
+        "reason": "Existing operation is a paid sale",
+        "confidence": 1.0
+    },
+    {
+        "name": "sale_over_restock",
+        "when": [["new.operation", "eq", "DECREMENT"], ["existing.operation", "eq", "INCREMENT"]],
+        "winner": "new",
+        "method": "HARDCODED",
+        "reason": "Sales take priority over restocks",
+        "confidence": 0.95
+    },
+    # TIER 2: HEURISTICS (simple, fast)
+    {
+        "name": "earlier_lamport",
+        "when": [["new.lamport_ts", "lt", {"field": "existing.lamport_ts"}]],
+        "winner": "new",
+        "method": "HEURISTIC",
+        "reason": "Operation occurred first (lower Lamport timestamp)",
+        "confidence": 0.9
+    },
+    # TIER 3: ESCALATE TO MANUAL RESOLUTION
+    {
+        "name": "manual_review",
+        "when": [],
+        "winner": "new",
+        "method": "MANUAL",
+        "reason": "Ambiguous conflict - requires producer decision",
+        "confidence": 0.5,
+        "requires_approval": True
+    },
+]
+
+# Used when no rule of a tenant table matches
+FALLBACK_RULE = DEFAULT_RULES[-1]
+
+_OPERATORS = {
+    "eq": "==", "ne": "!=", "lt": "<", "le": "<=", "gt": ">", "ge": ">=",
+    "in": "in", "not_in": "not in",
+}
+_ORDERED = {"lt", "le", "gt", "ge"}
+_MEMBERSHIP = {"in", "not_in"}
+_SIDES = {"new": "n", "existing": "e"}
+_LITERAL_TYPES = (str, int, float, bool, type(None))
+_NUMBERS = (int, float)
+_get_id = itemgetter("id")
+
+# Compiled forms of the distinct rule tables most recently used
+COMPILED_TABLES_LIMIT = 256
+
+
+def _parse_ref(ref: str) -> Tuple[str, str]:
+    """Split "new.payment_status" into ("new", "payment_status") and validate it."""
+    if not isinstance(ref, str):
+        raise InvalidRuleTable(f"Unknown field reference: {ref!r}")
+    side, _, field = ref.partition(".")
+    if side not in _SIDES or field not in StockEvent.model_fields:
+        raise InvalidRuleTable(f"Unknown field reference: {ref!r}")
+    return side, field
+
+
+def _field_type(field: str) -> Tuple[type, bool]:
+    """(Python type, nullable) of a StockEvent field."""
+    annotation = StockEvent.model_fields[field].annotation
+    args = [arg for arg in get_args(annotation) if arg is not type(None)]
+    if get_origin(annotation) is Union and len(args) == 1:
+        return args[0], True
+    return annotation, False
+
+
+def _comparable(a: type, b: type) -> bool:
+    """Whether values of the two types can be ordered (<, >) against each other."""
+    return (issubclass(a, _NUMBERS) and issubclass(b, _NUMBERS)) or a is b
+
+
+def _literal(value) -> str:
+    """Source for a literal operand; only plain scalars (and lists of them) are allowed."""
+    if isinstance(value, list):
+        if not all(isinstance(v, _LITERAL_TYPES) for v in value):
+            raise InvalidRuleTable(f"Unsupported list operand: {value!r}")
+        for v in value:
+            _literal(v)
+        return repr(tuple(value))
+    if not isinstance(value, _LITERAL_TYPES):
+        raise InvalidRuleTable(f"Unsupported operand: {value!r}")
+    # repr() of NaN and infinity is not valid source
+    if isinstance(value, float) and not math.isfinite(value):
+        raise InvalidRuleTable(f"Unsupported operand: {value!r}")
+    return repr(value)
+
+
+def _compile(rules: Sequence[Dict]):
+    """
+    Generate the evaluators for a rule table.
+    Returns (evaluate, evaluate_one, fields):
+    - evaluate(new_rows, existing_rows) scores a batch of column tuples;
+    - evaluate_one(new, existing) scores a single pair of operations.
+    Both return the index of the first matching rule (-1 when none matched).
+    """
+    fields: List[str] = []
+    parsed: List[List[Tuple]] = []
+
+    def ref(value: str) -> Tuple[str, str]:
+        side, field = _parse_ref(value)
+        if field not in fields:
+            fields.append(field)
+        return side, field
+
+    for index, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            raise InvalidRuleTable(f"Rule {index}: must be an object")
+        if rule.get("winner") not in ("new", "existing"):
+            raise InvalidRuleTable(f"Rule {index}: winner must be 'new' or 'existing'")
+        if not isinstance(rule.get("when", []), list):
+            raise InvalidRuleTable(f"Rule {index}: when must be a list of conditions")
+        confidence = rule.get("confidence", 1.0)
+        if isinstance(confidence, bool) or not isinstance(confidence, (int, float)) or not 0 <= confidence <= 1:
+            raise InvalidRuleTable(f"Rule {index}: confidence must be a number from 0 to 1")
+        if not isinstance(rule.get("requires_approval", False), bool):
+            raise InvalidRuleTable(f"Rule {index}: requires_approval must be true or false")
+
+        conditions = []
+        for condition in rule.get("when", []):
+            try:
+                left, op, operand = condition
+            except (TypeError, ValueError):
+                raise InvalidRuleTable(f"Rule {index}: condition must be [field, op, operand]")
+            if op not in _OPERATORS:
+                raise InvalidRuleTable(f"Rule {index}: unknown operator {op!r}")
+            if (op in _MEMBERSHIP) != isinstance(operand, list):
+                raise InvalidRuleTable(f"Rule {index}: {op!r} needs a list operand" if op in _MEMBERSHIP
+                                       else f"Rule {index}: list operand needs 'in' or 'not_in'")
+
+            left = ref(left)
+            right = ref(operand.get("field", "")) if isinstance(operand, dict) else _literal(operand)
+
+            # Ordered comparisons must not raise TypeError at push time:
+            # operands of comparable types, and null fields never match
+            guards = []
+            if op in _ORDERED:
+                left_type, left_null = _field_type(left[1])
+                if isinstance(right, tuple):
+                    right_type, right_null = _field_type(right[1])
+                else:
+                    right_type, right_null = type(operand), False
+                if not _comparable(left_type, right_type):
+                    raise InvalidRuleTable(
+                        f"Rule {index}: cannot order {left_type.__name__} and {right_type.__name__}"
+                    )
+                guards = [side for side, null in ((left, left_null), (right, right_null)) if null]
+
+            conditions.append((left, _OPERATORS[op], right, guards))
+        parsed.append(conditions)
+
+    if not fields:
+        fields.append("lamport_ts")
+
+    def branches(render, indent: str) -> str:
+        lines = []
+        for index, conditions in enumerate(parsed):
+            test = " and ".join(
+                " and ".join(
+                    [f"{render(*guard)} is not None" for guard in guards]
+                    + [f"{render(*left)} {op} {render(*right) if isinstance(right, tuple) else right}"]
+                )
+                for left, op, right, guards in conditions
+            ) or "True"
+            lines.append(f"{indent}{'if' if index == 0 else 'elif'} {test}:\n{indent}    {{hit}}({index})")
+        if not lines:
+            return f"{indent}{{hit}}(-1)"
+        return "\n".join(lines) + f"\n{indent}else:\n{indent}    {{hit}}(-1)"
+
+    # Batch: unpack column tuples into locals n0.., e0..
+    unpack = ", ".join(f"{{side}}{i}" for i in range(len(fields))) + ("," if len(fields) == 1 else "")
+    batch_source = (
+        "def evaluate(new_rows, existing_rows):\n"
+        "    result = []\n"
+        "    append = result.append\n"
+        "    for n, e in zip(new_rows, existing_rows):\n"
+        f"        {unpack.format(side='n')} = n\n"
+        f"        {unpack.format(side='e')} = e\n"
+        + branches(lambda side, field: f"{_SIDES[side]}{fields.index(field)}", "        ").format(hit="append")
+        + "\n    return result\n"
+    )
+
+    # Single pair: plain attribute access, short-circuiting like a hand-written chain
+    single_source = (
+        "def evaluate_one(new, existing):\n"
+        + branches(lambda side, field: f"{side}.{field}", "    ").format(hit="return ")
+        + "\n"
+    )
+
+    namespace: Dict = {}
+    builtins = {"__builtins__": {"zip": zip}}
+    exec(compile(batch_source + "\n" + single_source, "<conflict_rules>", "exec"), builtins, namespace)
+    return namespace["evaluate"], namespace["evaluate_one"], fields
+
+
+class CompiledRuleTable:
+    """A rule table compiled into a batch evaluator."""
+
+    def __init__(self, rules: Sequence[Dict]):
+        self.rules = list(rules)
+        self._evaluate, self._evaluate_one, fields = _compile(self.rules)
+
+        # Loaded column values live in the instance __dict__; reading them
+        # there skips the ORM descriptors (expired instances fall back to them)
+        single = len(fields) == 1
+        item, attr = itemgetter(*fields), attrgetter(*fields)
+        self._from_dict = (lambda d: (item(d),)) if single else item
+        self._from_attrs = (lambda op: (attr(op),)) if single else attr
+
+        # Resolution template per rule index (-1 is the fallback)
+        self._templates = {
+            index: (
+                rule["winner"] == "new",
+                rule.get("reason", rule.get("name", "")),
+                rule.get("method", "HARDCODED"),
+                rule.get("confidence", 1.0),
+                rule.get("requires_approval", False)
+            )
+            for index, rule in enumerate(self.rules + [FALLBACK_RULE])
+        }
+        self._templates[-1] = self._templates.pop(len(self.rules))
+
+    def _column_rows(self, ops: Sequence[StockEvent]) -> Tuple[List[Tuple], List[UUID]]:
+        """Rule columns and ids of the operations."""
+        try:
+            dicts = list(map(vars, ops))
+            return list(map(self._from_dict, dicts)), list(map(_get_id, dicts))
+        except KeyError:
+            return list(map(self._from_attrs, ops)), [op.id for op in ops]
+
+    def resolve(self, new_op: StockEvent, existing_op: StockEvent) -> ConflictResolution:
+        """Resolve a single conflicting pair."""
+        new_wins, reason, method, confidence, requires_approval = self._templates[
+            self._evaluate_one(new_op, existing_op)
+        ]
+        return ConflictResolution(
+            new_op.id if new_wins else existing_op.id,
+            reason, method, confidence, requires_approval
+        )
+
+    def resolve_batch(
+        self,
+        pairs: Sequence[Tuple[StockEvent, StockEvent]]
+    ) -> List[ConflictResolution]:
+        """Resolve many (new, existing) pairs in one pass over their columns."""
+        new_rows, new_ids = self._column_rows([new_op for new_op, _ in pairs])
+        existing_rows, existing_ids = self._column_rows([existing_op for _, existing_op in pairs])
+        indexes = self._evaluate(new_rows, existing_rows)
+
+        templates = self._templates
+        resolutions = []
+        append = resolutions.append
+        for index, new_id, existing_id in zip(indexes, new_ids, existing_ids):
+            new_wins, reason, method, confidence, requires_approval = templates[index]
+            append(ConflictResolution(
+                new_id if new_wins else existing_id,
+                reason, method, confidence, requires_approval
+            ))
+        return resolutions
+
+
+_compiled_tables: "OrderedDict[str, CompiledRuleTable]" = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def compile_rules(rules: Sequence[Dict]) -> CompiledRuleTable:
+    """Compile a rule table, reusing the compiled form of identical tables."""
+    key = sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+
+    with _compiled_lock:
+        table = _compiled_tables.get(key)
+        if table is not None:
+            _compiled_tables.move_to_end(key)
+            return table
+
+    table = CompiledRuleTable(rules)
+
+    with _compiled_lock:
+        _compiled_tables[key] = table
+        while len(_compiled_tables) > COMPILED_TABLES_LIMIT:
+            _compiled_tables.popitem(last=False)
+
+    return table
+
+
+def load_rule_table(session: Session, tenant_id: UUID) -> CompiledRuleTable:
+    """Compiled rule table of a tenant (the default table unless configured)."""
+    rule_set: Optional[ConflictRuleSet] = session.exec(
+        select(ConflictRuleSet).where(ConflictRuleSet.tenant_id == tenant_id)
+    ).first()
+
+    if rule_set:
+        try:
+            return compile_rules(rule_set.rules)
+        except InvalidRuleTable as e:
+            # Stored before the table checks existed: keep pushes working
+            print(f"[WARN] Invalid conflict rules of tenant {tenant_id}, using the defaults: {e}")
+
+    return compile_rules(DEFAULT_RULES)
@@ -0,0 +1,104 @@
+"""
+PN-counter CRDT for stock.
+INCREMENT/DECREMENT stock changes commute, so instead of detecting and
+resolving conflicts between them, every device keeps its own cumulative
+increments (P) and decrements (N) per product. Merging is a per-device max,
+and the merged counter doubles as the product's stock value.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Sequence, Set, Tuple
+from uuid import UUID, uuid4
+import os
+
+from sqlalchemy import case, func
+from sqlmodel import Session, select
+
+from .database import dialect_insert
+from .models import Product, StockCounter
+from .schemas import StockCounterSync
+
+# "EVENTS": every StockEvent goes through conflict detection (default)
+# "CRDT": INCREMENT/DECREMENT events skip it; stock comes from the counters
+SYNC_STOCK_MODE = os.getenv("SYNC_STOCK_MODE", "EVENTS").upper()
+
+COMMUTATIVE_OPERATIONS = {"INCREMENT", "DECREMENT"}
+
+
+class StockCounterStore:
+    """Merges device counters and derives product stock from them."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def merge(self, counters: Sequence[StockCounterSync]) -> List[Dict]:
+        """
+        Merge a batch of device counter states.
+        Each merge is a single upsert taking the max of both sides, so
+        retransmitted or reordered states are harmless.
+        """
+        insert = dialect_insert(self.session)
+        touched: Set[Tuple[UUID, UUID]] = set()
+
+        for counter in counters:
+            statement = insert(StockCounter).values(
+                id=uuid4(),
+                tenant_id=counter.tenant_id,
+                product_id=counter.product_id,
+                device_id=counter.device_id,
+                increments=counter.increments,
+                decrements=counter.decrements,
+                updated_at=datetime.utcnow()
+            )
+            incoming = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=["tenant_id", "product_id", "device_id"],
+                set_={
+                    "increments": case(
+                        (incoming.increments > StockCounter.increments, incoming.increments),
+                        else_=StockCounter.increments
+                    ),
+                    "decrements": case(
+                        (incoming.decrements > StockCounter.decrements, incoming.decrements),
+                        else_=StockCounter.decrements
+                    ),
+                    "updated_at": incoming.updated_at
+                }
+            )
+            self.session.exec(statement)
+            touched.add((counter.tenant_id, counter.product_id))
+
+        # Project the merged value once per product
+        stocks = {key: self._project(*key) for key in touched}
+        self.session.commit()
+
+        return [
+            {
+                "status": "merged",
+                "product_id": str(counter.product_id),
+                "stock": stocks[(counter.tenant_id, counter.product_id)]
+            }
+            for counter in counters
+        ]
+
+    def stock(self, tenant_id: UUID, product_id: UUID) -> int:
+        """Merged counter value: sum(P) - sum(N) over every device."""
+        value = self.session.exec(
+            select(func.sum(StockCounter.increments - StockCounter.decrements)).where(
+                StockCounter.tenant_id == tenant_id,
+                StockCounter.product_id == product_id
+            )
+        ).first()
+        return value or 0
+
+    def _project(self, tenant_id: UUID, product_id: UUID) -> int:
+        """Write the merged value into Product.current_stock."""
+        value = self.stock(tenant_id, product_id)
+
+        product = self.session.get(Product, product_id)
+        if product and product.tenant_id == tenant_id:
+            product.current_stock = value
+            product.updated_at = datetime.utcnow()
+            self.session.add(product)
+
+        return value
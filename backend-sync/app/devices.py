@@ -0,0 +1,176 @@
+"""
+Device registry for the Sync Engine.
+Tracks what every device of a tenant has pushed and acknowledged, so the
+server knows which tombstones no device still needs and how far behind each
+device is.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID, uuid4
+import os
+
+from sqlalchemy import case, func
+from sqlmodel import Session, select
+
+from .database import dialect_insert
+from .models import StockEvent, SyncDevice, SyncHorizon
+
+# Devices not seen for this long are considered retired and no longer hold
+# back garbage collection (they must do a full resync if they come back: see
+# collected_horizon).
+DEVICE_STALE_DAYS = int(os.getenv("DEVICE_STALE_DAYS", "30"))
+
+
+class DeviceRegistry:
+    """Cheap per-request updates and per-tenant queries over sync_devices."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def _upsert(self, tenant_id: UUID, device_id: UUID, values: Dict, commit: bool = True) -> None:
+        """Single-statement insert-or-update of a device row."""
+        insert = dialect_insert(self.session)
+
+        statement = insert(SyncDevice).values(
+            id=uuid4(),
+            tenant_id=tenant_id,
+            device_id=device_id,
+            **values
+        ).on_conflict_do_update(
+            index_elements=["tenant_id", "device_id"],
+            set_=values
+        )
+
+        self.session.exec(statement)
+        if commit:
+            self.session.commit()
+
+    def record_pull(self, tenant_id: UUID, device_id: UUID, last_lamport: int) -> None:
+        """
+        Record that the device has applied everything up to last_lamport.
+        The latest cursor wins, so a reinstalled device pulling from 0 is
+        tracked correctly.
+        """
+        self._upsert(tenant_id, device_id, {
+            "last_pulled_lamport": last_lamport,
+            "last_seen_at": datetime.utcnow()
+        })
+
+    def record_push(self, tenant_id: UUID, device_id: UUID, server_lamport: int) -> None:
+        """Record the server Lamport reached by the device's last push."""
+        self._upsert(tenant_id, device_id, {
+            "last_pushed_lamport": server_lamport,
+            "last_seen_at": datetime.utcnow()
+        })
+
+    def chain_head(self, tenant_id: UUID, device_id: UUID) -> Tuple[int, Optional[str]]:
+        """(device_seq, operation_hash) of the device's last chained event; (0, None) before the first."""
+        head = self.session.exec(
+            select(SyncDevice.chain_seq, SyncDevice.chain_hash).where(
+                SyncDevice.tenant_id == tenant_id,
+                SyncDevice.device_id == device_id
+            )
+        ).first()
+        return tuple(head) if head else (0, None)
+
+    def advance_chain(self, tenant_id: UUID, device_id: UUID, seq: int, operation_hash: str) -> None:
+        """
+        Move the device's chain head. Does not commit: the caller commits
+        together with the outcome of the event.
+        """
+        self._upsert(tenant_id, device_id, {
+            "chain_seq": seq,
+            "chain_hash": operation_hash,
+            "last_seen_at": datetime.utcnow()
+        }, commit=False)
+
+    def lag_report(self, tenant_id: UUID, server_lamport: int) -> List[Dict]:
+        """
+        Per-device sync lag for a tenant.
+        lag: Lamport distance between the tenant head and the device cursor.
+        backlog: operations from other devices the device has not pulled yet.
+        """
+        backlog = (
+            select(func.count(StockEvent.id))
+            .where(
+                StockEvent.tenant_id == SyncDevice.tenant_id,
+                StockEvent.lamport_ts > SyncDevice.last_pulled_lamport,
+                StockEvent.device_id != SyncDevice.device_id,
+                StockEvent.is_deleted == False
+            )
+            .correlate(SyncDevice)
+            .scalar_subquery()
+        )
+
+        rows = self.session.exec(
+            select(SyncDevice, backlog)
+            .where(SyncDevice.tenant_id == tenant_id)
+            .order_by(SyncDevice.last_pulled_lamport)
+        ).all()
+
+        return [
+            {
+                "device_id": str(device.device_id),
+                "last_pulled_lamport": device.last_pulled_lamport,
+                "last_pushed_lamport": device.last_pushed_lamport,
+                "chain_seq": device.chain_seq,
+                "last_seen_at": device.last_seen_at.isoformat(),
+                "lag": max(server_lamport - device.last_pulled_lamport, 0),
+                "backlog": backlog_count
+            }
+            for device, backlog_count in rows
+        ]
+
+    def safe_horizon(self, tenant_id: UUID) -> int:
+        """
+        Highest Lamport timestamp acknowledged by every active device of the
+        tenant. Returns 0 (nothing is safe) when no active device is known.
+        """
+        active_since = datetime.utcnow() - timedelta(days=DEVICE_STALE_DAYS)
+
+        horizon = self.session.exec(
+            select(func.min(SyncDevice.last_pulled_lamport)).where(
+                SyncDevice.tenant_id == tenant_id,
+                SyncDevice.last_seen_at >= active_since
+            )
+        ).first()
+
+        return horizon or 0
+
+    def record_collected(self, tenant_id: UUID, horizon: int) -> None:
+        """
+        Raise the tenant's collected horizon before rows up to horizon are
+        purged or archived. Does not commit: the caller commits before (or
+        together with) the deletes.
+        """
+        insert = dialect_insert(self.session)
+        statement = insert(SyncHorizon).values(
+            id=uuid4(),
+            tenant_id=tenant_id,
+            collected_lamport=horizon,
+            updated_at=datetime.utcnow()
+        )
+        incoming = statement.excluded
+        self.session.exec(statement.on_conflict_do_update(
+            index_elements=["tenant_id"],
+            set_={
+                # Never lowered: an earlier pass may have collected further
+                "collected_lamport": case(
+                    (incoming.collected_lamport > SyncHorizon.collected_lamport, incoming.collected_lamport),
+                    else_=SyncHorizon.collected_lamport
+                ),
+                "updated_at": incoming.updated_at
+            }
+        ))
+
+    def collected_horizon(self, tenant_id: UUID) -> int:
+        """
+        Lamport timestamp up to which the tenant's tombstones (and archived
+        events) may be gone. A pull from a non-zero cursor below it would
+        silently miss them: the device must drop its data and pull from 0.
+        """
+        horizon = self.session.exec(
+            select(SyncHorizon.collected_lamport).where(SyncHorizon.tenant_id == tenant_id)
+        ).first()
+        return horizon or 0
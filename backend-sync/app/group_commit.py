@@ -0,0 +1,203 @@
+"""
+Group commit for concurrent /sync/push requests.
+Many small pushes from different devices each pay their own commit (and WAL
+fsync). With SYNC_GROUP_COMMIT_MS > 0, pushes are handed to a writer thread
+that gathers the requests arriving within that window (up to
+SYNC_GROUP_COMMIT_MAX_BATCH), applies them in one transaction and answers
+every waiting request after the shared commit.
+
+Each request runs in its own SAVEPOINT with its tenant's RLS context: the
+commits inside the sync engine only release nested savepoints, and a failing
+request is rolled back alone. Cached pull pages are invalidated after the
+shared commit, never before.
+"""
+
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from uuid import UUID
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from .catalog import invalidate_after_push
+from .database import set_tenant_context
+from .pull_cache import get_pull_cache
+from .push_queue import process_push
+from .schemas import SyncPushRequest, SyncPushResponse
+from .shards import engine_for_tenant
+
+# Gathering window in milliseconds (0 disables group commit)
+SYNC_GROUP_COMMIT_MS = float(os.getenv("SYNC_GROUP_COMMIT_MS", "0"))
+SYNC_GROUP_COMMIT_MAX_BATCH = int(os.getenv("SYNC_GROUP_COMMIT_MAX_BATCH", "64"))
+
+
+@dataclass
+class _Job:
+    tenant_id: Optional[UUID]
+    request: SyncPushRequest
+    idempotency_key: Optional[str]
+    future: Future = field(default_factory=Future)
+
+
+class GroupCommitter:
+    """Single writer thread applying concurrent pushes in shared transactions."""
+
+    def __init__(
+        self,
+        bind: Optional[Engine] = None,
+        window_ms: float = SYNC_GROUP_COMMIT_MS,
+        max_batch: int = SYNC_GROUP_COMMIT_MAX_BATCH
+    ):
+        self.bind = bind  # None: each push goes to its tenant's shard
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.groups = 0
+        self.requests = 0
+        self._jobs: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        tenant_id: Optional[UUID],
+        request: SyncPushRequest,
+        idempotency_key: Optional[str] = None
+    ) -> SyncPushResponse:
+        """Apply a push in the next group; blocks until the group is committed."""
+        job = _Job(tenant_id, request, idempotency_key)
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+            self._jobs.put(job)
+
+        return job.future.result()
+
+    def close(self) -> None:
+        """Commit what is queued and stop the writer thread."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._jobs.put(None)
+            thread, self._thread = self._thread, None
+        thread.join()
+
+    def _run(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            group = [job]
+            deadline = time.monotonic() + self.window
+            stop = False
+            while len(group) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    job = self._jobs.get(timeout=remaining) if remaining > 0 else self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                group.append(job)
+
+            self._commit_by_shard(group)
+            if stop:
+                return
+
+    def _commit_by_shard(self, group: List[_Job]) -> None:
+        """One shared transaction per database the group writes to."""
+        shards: Dict[Engine, List[_Job]] = {}
+        for job in group:
+            try:
+                bind = self.bind or engine_for_tenant(job.tenant_id)
+            except Exception as e:
+                job.future.set_exception(e)
+                continue
+            shards.setdefault(bind, []).append(job)
+
+        for bind, jobs in shards.items():
+            self._commit(bind, jobs)
+
+    def _commit(self, bind: Engine, group: List[_Job]) -> None:
+        """Apply a group in one transaction, one savepoint per request."""
+        responses = {}
+
+        try:
+            with bind.connect() as connection:
+                transaction = connection.begin()
+                for job in group:
+                    request_savepoint = connection.begin_nested()
+                    with Session(bind=connection, join_transaction_mode="create_savepoint") as session:
+                        try:
+                            if job.tenant_id:
+                                set_tenant_context(session, job.tenant_id)
+                            responses[id(job)] = process_push(
+                                session, job.tenant_id, job.request, job.idempotency_key, advance_cache=False
+                            )
+                            session.commit()
+                            request_savepoint.commit()
+                        except Exception as e:
+                            session.rollback()
+                            request_savepoint.rollback()
+                            job.future.set_exception(e)
+                transaction.commit()
+
+                if connection.dialect.name == "postgresql":
+                    connection.exec_driver_sql("RESET ROLE")
+                    connection.exec_driver_sql("RESET app.current_tenant_id")
+                    connection.commit()
+        except Exception as e:
+            print(f"[WARN] Group commit of {len(group)} pushes failed: {e}")
+            for job in group:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            return
+
+        self.groups += 1
+        self.requests += len(group)
+
+        # Pull pages may only move to the new head once the events are durable
+        cache = get_pull_cache()
+        for job in group:
+            response = responses.get(id(job))
+            if response is None:
+                continue
+            if cache and job.tenant_id and any(r.get("status") == "accepted" for r in response.results):
+                cache.advance(job.tenant_id, response.server_lamport)
+            invalidate_after_push(job.tenant_id, job.request)
+            job.future.set_result(response)
+
+
+_committer: Optional[GroupCommitter] = None
+_committer_lock = threading.Lock()
+
+
+def get_group_committer() -> Optional[GroupCommitter]:
+    """Process-wide committer, or None when group commit is disabled."""
+    global _committer
+
+    if SYNC_GROUP_COMMIT_MS <= 0:
+        return None
+
+    with _committer_lock:
+        if _committer is None:
+            _committer = GroupCommitter()
+
+    return _committer
+
+
+def close_group_committer() -> None:
+    global _committer
+
+    with _committer_lock:
+        committer, _committer = _committer, None
+    if committer:
+        committer.close()
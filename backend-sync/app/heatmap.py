@@ -0,0 +1,188 @@
+"""
+Geohash heatmap of sales.
+Every accepted SALE event with a location is folded into the daily bucket of
+its geohash cell (GEOHASH_PRECISION characters, ~150 m at 7) in the same
+transaction that stores it, like the stock rollups. Coarser cells are prefixes
+of finer ones, so a map tile at any zoom is one GROUP BY over the stored
+cells inside its bounding box; raw events never leave the database.
+app.rebuild recomputes the cells from the log with the same aggregate().
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID, uuid4
+import math
+import os
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from .database import dialect_insert
+from .models import SalesHeatmapCell, StockEvent
+from .rollups import bucket_start
+
+GEOHASH_PRECISION = int(os.getenv("GEOHASH_PRECISION", "7"))
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+TOTAL_FIELDS = ("sales_units", "sales_amount", "event_count")
+
+Box = Tuple[float, float, float, float]  # (lat_min, lng_min, lat_max, lng_max)
+
+
+def encode(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Geohash of a point."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+
+    while len(chars) < precision:
+        interval, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+
+    return "".join(chars)
+
+
+def bounds(geohash: str) -> Box:
+    """Bounding box of a geohash cell."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lng_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def tile_bounds(z: int, x: int, y: int) -> Box:
+    """Bounding box of a Web Mercator (slippy map) tile."""
+    n = 2 ** z
+    lat = lambda row: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180
+
+
+def precision_for_zoom(z: int) -> int:
+    """Geohash length giving roughly 16-32 cells across a tile of zoom z."""
+    return max(1, min(GEOHASH_PRECISION, round(2 * (z + 5) / 5)))
+
+
+def aggregate(events: Iterable[StockEvent]) -> Dict[Tuple, Dict]:
+    """Sum located sales per (tenant, product, cell, day)."""
+    cells: Dict[Tuple, Dict] = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, 0))
+
+    for event in events:
+        if event.reason != "SALE" or event.location_lat is None or event.location_lng is None:
+            continue
+        key = (
+            event.tenant_id,
+            event.product_id,
+            encode(event.location_lat, event.location_lng),
+            bucket_start(event.created_at, "DAY")
+        )
+        cell = cells[key]
+        cell["sales_units"] += abs(event.delta)
+        cell["sales_amount"] += event.amount or 0.0
+        cell["event_count"] += 1
+
+    return cells
+
+
+class HeatmapStore:
+    """Incremental maintenance and tile queries of sales_heatmap_cells."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def add(self, events: Iterable[StockEvent]) -> None:
+        """
+        Fold accepted sales into their cells with one upsert per cell.
+        Does not commit: the caller commits together with the events.
+        """
+        insert = dialect_insert(self.session)
+        now = datetime.utcnow()
+
+        for (tenant_id, product_id, geohash, start), totals in aggregate(events).items():
+            lat_min, lng_min, lat_max, lng_max = bounds(geohash)
+            statement = insert(SalesHeatmapCell).values(
+                id=uuid4(),
+                tenant_id=tenant_id,
+                product_id=product_id,
+                geohash=geohash,
+                bucket_start=start,
+                cell_lat=(lat_min + lat_max) / 2,
+                cell_lng=(lng_min + lng_max) / 2,
+                updated_at=now,
+                **totals
+            )
+            incoming = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=["tenant_id", "product_id", "geohash", "bucket_start"],
+                set_={
+                    **{field: getattr(SalesHeatmapCell, field) + getattr(incoming, field) for field in TOTAL_FIELDS},
+                    "updated_at": incoming.updated_at
+                }
+            )
+            self.session.exec(statement)
+
+    def cells(
+        self,
+        tenant_id: UUID,
+        box: Box,
+        precision: int,
+        since: datetime,
+        until: datetime,
+        product_id: Optional[UUID] = None
+    ) -> List[Dict]:
+        """Sales per cell of the given precision inside a box over a day range, best first."""
+        lat_min, lng_min, lat_max, lng_max = box
+        prefix = func.substr(SalesHeatmapCell.geohash, 1, precision)
+
+        statement = (
+            select(prefix, *[func.sum(getattr(SalesHeatmapCell, f)) for f in TOTAL_FIELDS])
+            .where(
+                SalesHeatmapCell.tenant_id == tenant_id,
+                SalesHeatmapCell.bucket_start >= bucket_start(since, "DAY"),
+                SalesHeatmapCell.bucket_start < until,
+                SalesHeatmapCell.cell_lat >= lat_min,
+                SalesHeatmapCell.cell_lat < lat_max,
+                SalesHeatmapCell.cell_lng >= lng_min,
+                SalesHeatmapCell.cell_lng < lng_max
+            )
+            .group_by(prefix)
+            .order_by(func.sum(SalesHeatmapCell.sales_units).desc())
+        )
+        if product_id:
+            statement = statement.where(SalesHeatmapCell.product_id == product_id)
+
+        cells = []
+        for geohash, *values in self.session.exec(statement).all():
+            cell_lat_min, cell_lng_min, cell_lat_max, cell_lng_max = bounds(geohash)
+            cells.append({
+                "geohash": geohash,
+                "lat": (cell_lat_min + cell_lat_max) / 2,
+                "lng": (cell_lng_min + cell_lng_max) / 2,
+                "bbox": [cell_lng_min, cell_lat_min, cell_lng_max, cell_lat_max],
+                **dict(zip(TOTAL_FIELDS, values))
+            })
+
+        return cells
@@ -0,0 +1,80 @@
+"""
+Batch-level idempotency for /sync/push.
+Rural links often time out after the server already processed a batch, so the
+device resends it. The stored response is returned instead of re-running every
+per-operation duplicate check.
+"""
+
+from datetime import datetime, timedelta
+from hashlib import sha256
+from typing import Dict, Optional
+from uuid import UUID
+import os
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from .models import SyncBatchReceipt
+from .schemas import SyncPushRequest
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when a key is sent again with a different batch."""
+
+
+def compute_batch_hash(request: SyncPushRequest) -> str:
+    """Deterministic SHA-256 of a push batch."""
+    return sha256(request.model_dump_json().encode()).hexdigest()
+
+
+class BatchIdempotencyStore:
+    """
+    Table-backed store of push responses keyed by (tenant_id, Idempotency-Key).
+    """
+    
+    def __init__(self, session: Session, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS):
+        self.session = session
+        self.ttl = timedelta(seconds=ttl_seconds)
+    
+    def lookup(self, tenant_id: UUID, key: str, request_hash: str) -> Optional[Dict]:
+        """
+        Return the stored response for this batch, or None if it was never
+        processed (or the receipt expired).
+        """
+        receipt = self.session.exec(
+            select(SyncBatchReceipt).where(
+                SyncBatchReceipt.tenant_id == tenant_id,
+                SyncBatchReceipt.idempotency_key == key
+            )
+        ).first()
+        
+        if not receipt:
+            return None
+        
+        if receipt.created_at < datetime.utcnow() - self.ttl:
+            # Expired: drop it so the key can be stored again
+            self.session.delete(receipt)
+            self.session.commit()
+            return None
+        
+        if receipt.request_hash != request_hash:
+            raise IdempotencyKeyReused(key)
+        
+        return receipt.response
+    
+    def store(self, tenant_id: UUID, key: str, request_hash: str, response: Dict) -> None:
+        """Remember the response of a processed batch."""
+        receipt = SyncBatchReceipt(
+            tenant_id=tenant_id,
+            idempotency_key=key,
+            request_hash=request_hash,
+            response=response
+        )
+        self.session.add(receipt)
+        try:
+            self.session.commit()
+        except IntegrityError:
+            # A concurrent retransmission stored it first; both responses are equivalent
+            self.session.rollback()
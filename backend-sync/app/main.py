@@ -2,23 +2,49 @@
 FastAPI application for Agrotour Sync Engine.
 """
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Body, Depends, HTTPException, Header, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import Session
-from typing import List
-from datetime import datetime
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool
+from sqlmodel import Session, select
+from typing import Dict, List, Optional
+from uuid import UUID
+from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 
-from .database import get_session, create_db_and_tables
-from .models import StockEvent, SyncConflict
+from .database import get_session, get_session_factory, create_db_and_tables, tenant_moving_error
+from .models import StockEvent, SyncConflict, ConflictRuleSet
 from .sync_engine import AgrotourSyncEngine
+from .idempotency import BatchIdempotencyStore, IdempotencyKeyReused, compute_batch_hash
+from .push_queue import PushQueue, process_push, ticket_view, wants_async
+from .group_commit import close_group_committer, get_group_committer
+from .pull_cache import get_pull_cache
+from .devices import DeviceRegistry
+from .subscriptions import SubscriptionStore, pull_condition, subscription_key
+from .conflict_rules import InvalidRuleTable, compile_rules
+from .wire_format import JSON, body, negotiate, respond, to_columnar
+from .stream_ingest import NDJSON, STREAM_CHUNK_SIZE, IngestResponse, StreamIngestor, moving_line
+from .traffic import SYNC_CAPTURE_PATH, TrafficRecorder
+from .replicas import read_session
+from .rollups import GRANULARITIES, RollupStore, as_utc
+from .heatmap import HeatmapStore, precision_for_zoom, tile_bounds
+from .archive import ARCHIVE_AFTER_DAYS, ArchiveStore
+from .catalog import lookup_skus
+from .shards import TenantMoving, engine_for_tenant
+from .product_import import CSV, DEFAULT_CHUNK_SIZE, JSONL, ProductImporter, UnreadableCatalog, body_lines, parse_lines
+from .receipts import SHA256_HEX, ChunkRejected, ReceiptStore, ReceiptUploads, upload_view
 from .schemas import (
     SyncPushRequest,
     SyncPushResponse,
     SyncPullRequest,
     SyncPullResponse,
-    ConflictListResponse
+    ConflictListResponse,
+    DeviceListResponse,
+    SyncSubscription,
+    ConflictRulesUpdate,
+    ReceiptUploadStart,
+    ProductLookupRequest
 )
 
 from .middleware import TenantMiddleware
@@ -44,6 +70,10 @@ app.add_middleware(
 # Multi-tenancy Middleware
 app.add_middleware(TenantMiddleware)
 
+# Sanitized traffic capture, replayed with benchmarks.replay
+if SYNC_CAPTURE_PATH:
+    app.add_middleware(TrafficRecorder, path=SYNC_CAPTURE_PATH)
+
 
 @app.on_event("startup")
 def on_startup():
@@ -51,6 +81,12 @@ def on_startup():
     create_db_and_tables()
 
 
+@app.on_event("shutdown")
+def on_shutdown():
+    """Commit pushes still gathered for a group commit."""
+    close_group_committer()
+
+
 @app.get("/")
 def read_root():
     """Health check endpoint."""
@@ -63,98 +99,644 @@ def read_root():
 
 @app.post("/sync/push", response_model=SyncPushResponse)
 def sync_push(
-    request: SyncPushRequest,
+    http_request: Request,
+    request: SyncPushRequest = Depends(body(SyncPushRequest)),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+    accept: Optional[str] = Header(default=None),
+    prefer: Optional[str] = Header(default=None),
     session: Session = Depends(get_session)
 ):
     """
     Push operations from client to server.
     Implements idempotency, conflict detection, and resolution.
+    The body may be JSON, MessagePack or CBOR; the response format follows Accept.
     
     Args:
         request: Batch of operations to sync
+        idempotency_key: Optional batch key; a retransmitted batch gets the stored response
+        accept: Response media type (application/json, application/msgpack, application/cbor)
+        prefer: "respond-async" queues the batch and answers 202 with a ticket
         session: Database session
     
     Returns:
-        SyncPushResponse with results for each operation
+        SyncPushResponse with results for each operation (or a ticket when queued)
     """
-    sync_engine = AgrotourSyncEngine(session)
-    results = []
+    tenant_id = getattr(http_request.state, "tenant_id", None)
+    receipts = None
     
-    # 1. Process Stock Events (Operations)
-    for operation_data in request.operations:
-        # Create StockEvent from request data
-        operation = StockEvent(**operation_data.model_dump())
-        
-        # Compute operation hash if not provided
-        if not operation.operation_hash:
-            operation.operation_hash = operation.compute_operation_hash()
-        
-        # Accept operation through sync engine
-        result = sync_engine.accept_operation(operation)
-        results.append(result)
-        
-    # 2. Process Products (State Sync)
-    from .models import Product
-    for product_data in request.products:
-        product = Product(**product_data.model_dump())
-        product.content_hash = product.compute_hash() # Ensure hash is computed
-        
-        result = sync_engine.accept_operation(product)
-        results.append(result)
-
-    # 3. Process Pending Payments (State Sync)
-    from .models import PendingPayment
-    for payment_data in request.payments:
-        payment = PendingPayment(**payment_data.model_dump())
-        payment.content_hash = payment.compute_hash()
-        
-        result = sync_engine.accept_operation(payment)
-        results.append(result)
+    # 0. Batch-level idempotency (one lookup for a retransmitted batch)
+    if idempotency_key and tenant_id:
+        receipts = BatchIdempotencyStore(session)
+        batch_hash = compute_batch_hash(request)
+        try:
+            stored = receipts.lookup(tenant_id, idempotency_key, batch_hash)
+        except IdempotencyKeyReused:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key already used for a different batch"
+            )
+        if stored is not None:
+            return _push_reply(SyncPushResponse(**stored), accept)
     
-    return SyncPushResponse(
-        results=results,
-        server_lamport=sync_engine.server_lamport,
-        timestamp=datetime.utcnow()
-    )
+    # Write-ahead queue: acknowledge durably, apply in a worker
+    if tenant_id and wants_async(prefer):
+        try:
+            ticket = PushQueue(session).enqueue(tenant_id, request, idempotency_key)
+        except IdempotencyKeyReused:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key already used for a different batch"
+            )
+        return respond(negotiate(accept), ticket_view(ticket), status_code=status.HTTP_202_ACCEPTED)
+    
+    # Group commit: applied with concurrent pushes, answered after the shared commit
+    committer = get_group_committer()
+    if committer:
+        response = committer.submit(tenant_id, request, idempotency_key)
+    else:
+        response = process_push(session, tenant_id, request, idempotency_key)
+    
+    return _push_reply(response, accept)
+
+
+def _push_reply(response: SyncPushResponse, accept: Optional[str]):
+    """The push response in the format negotiated from Accept."""
+    media = negotiate(accept)
+    if media == JSON:
+        return response
+    return respond(media, response.model_dump(mode="json"))
+
+
+@app.get("/sync/push/tickets/{ticket_id}")
+def get_push_ticket(
+    ticket_id: UUID,
+    http_request: Request,
+    accept: Optional[str] = Header(default=None),
+    session: Session = Depends(get_session)
+):
+    """
+    State of an asynchronous push: PENDING, DONE (with the push response)
+    or FAILED (with the error).
+    """
+    ticket = PushQueue(session).get(http_request.state.tenant_id, ticket_id)
+    if not ticket:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ticket not found")
+    
+    return respond(negotiate(accept), ticket_view(ticket))
+
+
+@app.post("/sync/push/stream", response_class=IngestResponse)
+async def sync_push_stream(
+    http_request: Request,
+    chunk_size: int = Query(default=STREAM_CHUNK_SIZE, ge=1, le=5000),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+    open_session=Depends(get_session_factory)
+):
+    """
+    Push a large batch as NDJSON (see app/stream_ingest.py for the format).
+    Items are validated and applied chunk_size at a time, and one result line
+    per chunk is streamed back, so memory stays flat whatever the body size.
+    With an Idempotency-Key, chunks of a resent stream already applied are
+    answered from their stored receipts.
+    """
+    tenant_id = http_request.state.tenant_id
+    # Once streaming starts the status is sent: a frozen tenant gets its 503 now
+    try:
+        engine_for_tenant(tenant_id)
+    except TenantMoving:
+        raise tenant_moving_error()
+    
+    async def results():
+        try:
+            with open_session(tenant_id) as session:
+                ingestor = StreamIngestor(session, tenant_id, chunk_size, idempotency_key)
+                async for line in ingestor.run(http_request.stream()):
+                    yield line
+        except TenantMoving:
+            # Frozen between the check above and opening the session
+            yield moving_line()
+    
+    return IngestResponse(results(), media_type=NDJSON)
 
 
 @app.post("/sync/pull", response_model=SyncPullResponse)
 def sync_pull(
-    request: SyncPullRequest,
+    http_request: Request,
+    request: SyncPullRequest = Depends(body(SyncPullRequest)),
+    accept: Optional[str] = Header(default=None),
     session: Session = Depends(get_session)
 ):
     """
     Pull operations from server to client.
     Returns operations newer than client's last sync.
+    Pages are served from the Redis pull cache when it is configured, and
+    read from a caught-up replica when replicas are configured.
     
     Args:
-        request: Client's last known Lamport timestamp
+        request: Client's last known Lamport timestamp (JSON, MessagePack or CBOR)
+        accept: Response media type (application/json, application/msgpack, application/cbor)
         session: Database session
     
     Returns:
         SyncPullResponse with new operations
     """
-    # Query operations newer than client's last sync
-    from sqlmodel import select
+    limit = request.limit or 100
+    tenant_id = getattr(http_request.state, "tenant_id", None)
+    
+    # Every pull, registered device or not: a cursor below the collected horizon
+    # would silently miss purged deletions. Pulling from 0 is a full resync.
+    if tenant_id and request.last_lamport > 0:
+        if request.last_lamport < DeviceRegistry(session).collected_horizon(tenant_id):
+            return respond(negotiate(accept), SyncPullResponse(
+                operations=[],
+                server_lamport=AgrotourSyncEngine(session).server_lamport,
+                has_more=False,
+                next_lamport=0,
+                resync_required=True
+            ).model_dump(mode="json"))
+    
+    filters = None
+    
+    if request.device_id and tenant_id:
+        # The pull cursor acknowledges everything up to last_lamport
+        DeviceRegistry(session).record_pull(tenant_id, request.device_id, request.last_lamport)
+        
+        subscriptions = SubscriptionStore(session)
+        if request.subscription is not None:
+            subscriptions.save_for_device(tenant_id, request.device_id, request.subscription)
+        filters = subscriptions.resolve(tenant_id, request.device_id)
     
+    cache = get_pull_cache()
+    
+    # Only cache pulls whose body tenant matches the RLS tenant
+    cached = cache is not None and tenant_id == request.tenant_id
+    
+    def load_page() -> bytes:
+        # A replica must have replayed what the client (and the cached head) already saw
+        min_lamport = max(request.last_lamport, cache.known_head(tenant_id) if cached else 0)
+        with read_session(session, tenant_id, min_lamport) as reader:
+            return _load_pull_page(reader, request, limit, filters).model_dump_json().encode()
+    
+    if cached:
+        page = cache.get_or_load(
+            tenant_id,
+            request.last_lamport,
+            limit,
+            load_page=load_page,
+            load_head=lambda: AgrotourSyncEngine(session).server_lamport,
+            scope=subscription_key(filters) if filters else "all"
+        )
+    else:
+        page = load_page()
+    
+    media = negotiate(accept)
+    
+    # Cached pages are row-layout JSON: pass them through when nothing changes
+    if not request.device_id and request.layout == "rows" and media == JSON:
+        return Response(content=page, media_type=JSON)
+    
+    response = SyncPullResponse.model_validate_json(page)
+    
+    # Pages are shared by every device; the requester's own ops are dropped here
+    if request.device_id:
+        _exclude_own_operations(response, request.device_id)
+        if tenant_id:
+            response.push_results = PushQueue(session).collect_results(tenant_id, request.device_id)
+    
+    if request.layout == "columnar":
+        response.columns = to_columnar(response.operations)
+        response.operations = []
+    
+    if media == JSON:
+        return response
+    return respond(media, response.model_dump(mode="json"))
+
+
+def _load_pull_page(
+    session: Session,
+    request: SyncPullRequest,
+    limit: int,
+    filters: Optional[Dict] = None
+) -> SyncPullResponse:
+    """Query one page of operations newer than the client's cursor."""
     statement = select(StockEvent).where(
         StockEvent.tenant_id == request.tenant_id,
         StockEvent.lamport_ts > request.last_lamport,
         StockEvent.is_deleted == False
-    ).order_by(StockEvent.lamport_ts).limit(request.limit or 100)
+    )
+    
+    # Selective pull: only the device's subscribed products
+    if filters:
+        statement = statement.where(pull_condition(filters))
+    
+    statement = statement.order_by(StockEvent.lamport_ts).limit(limit)
     
     operations = session.exec(statement).all()
     
     return SyncPullResponse(
-        operations=[op.model_dump() for op in operations],
+        operations=[op.model_dump(mode="json") for op in operations],
         server_lamport=AgrotourSyncEngine(session).server_lamport,
-        has_more=len(operations) == (request.limit or 100)
+        has_more=len(operations) == limit,
+        next_lamport=operations[-1].lamport_ts if operations else request.last_lamport
+    )
+
+
+def _exclude_own_operations(response: SyncPullResponse, device_id: UUID) -> SyncPullResponse:
+    """Drop operations the requesting device pushed itself (no echo)."""
+    device = str(device_id)
+    response.operations = [op for op in response.operations if op["device_id"] != device]
+    return response
+
+
+@app.get("/sync/devices", response_model=DeviceListResponse)
+def list_devices(
+    http_request: Request,
+    session: Session = Depends(get_session)
+):
+    """
+    Sync state of every device of the tenant.
+    Each entry carries its cursors plus lag and backlog metrics.
+    """
+    tenant_id = http_request.state.tenant_id
+    server_lamport = AgrotourSyncEngine(session).server_lamport
+    
+    return DeviceListResponse(
+        devices=DeviceRegistry(session).lag_report(tenant_id, server_lamport),
+        server_lamport=server_lamport
+    )
+
+
+@app.get("/sync/devices/metrics", response_class=PlainTextResponse)
+def device_metrics(
+    http_request: Request,
+    session: Session = Depends(get_session)
+):
+    """Per-device lag and backlog in Prometheus text exposition format."""
+    tenant_id = http_request.state.tenant_id
+    server_lamport = AgrotourSyncEngine(session).server_lamport
+    devices = DeviceRegistry(session).lag_report(tenant_id, server_lamport)
+    
+    lines = [
+        "# HELP agrotour_sync_device_lag Lamport distance between the tenant head and the device cursor",
+        "# TYPE agrotour_sync_device_lag gauge",
+    ]
+    lines += [
+        f'agrotour_sync_device_lag{{tenant_id="{tenant_id}",device_id="{d["device_id"]}"}} {d["lag"]}'
+        for d in devices
+    ]
+    lines += [
+        "# HELP agrotour_sync_device_backlog Operations from other devices not yet pulled",
+        "# TYPE agrotour_sync_device_backlog gauge",
+    ]
+    lines += [
+        f'agrotour_sync_device_backlog{{tenant_id="{tenant_id}",device_id="{d["device_id"]}"}} {d["backlog"]}'
+        for d in devices
+    ]
+    
+    return "\n".join(lines) + "\n"
+
+
+@app.put("/sync/subscriptions/{role}")
+def set_role_subscription(
+    role: str,
+    subscription: SyncSubscription,
+    http_request: Request,
+    session: Session = Depends(get_session)
+):
+    """
+    Set the pull subscription shared by every device of a role.
+    Devices with a subscription of their own keep using it.
+    """
+    SubscriptionStore(session).save_for_role(http_request.state.tenant_id, role, subscription)
+    
+    return {"status": "saved", "role": role}
+
+
+@app.get("/products/by-sku/{sku:path}")
+def product_by_sku(sku: str, http_request: Request, session: Session = Depends(get_session)):
+    """Product of a scanned barcode or QR code (served from the SKU cache)."""
+    product = lookup_skus(session, http_request.state.tenant_id, [sku]).popitem()[1]
+    if not product:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown SKU")
+    
+    return product
+
+
+@app.post("/products/lookup")
+def lookup_products(request: ProductLookupRequest, http_request: Request, session: Session = Depends(get_session)):
+    """Products of a batch of scans; unknown SKUs are listed in missing."""
+    products = lookup_skus(session, http_request.state.tenant_id, request.skus)
+    
+    return {
+        "products": {sku: product for sku, product in products.items() if product},
+        "missing": [sku for sku, product in products.items() if not product]
+    }
+
+
+@app.post("/products/import")
+async def import_products(
+    http_request: Request,
+    created_by: UUID,
+    device_id: Optional[UUID] = None,
+    chunk_size: int = Query(default=DEFAULT_CHUNK_SIZE, ge=1, le=50_000),
+    content_type: str = Header(default=JSONL),
+    open_session=Depends(get_session_factory)
+):
+    """
+    Bulk import a product catalog (text/csv or application/x-ndjson body, see
+    app/product_import.py). SKUs the tenant already has are skipped, so a
+    failed import can be sent again. Answers the import summary.
+    """
+    tenant_id = http_request.state.tenant_id
+    fmt = CSV if "csv" in content_type.lower() else JSONL
+
+    def run():
+        with open_session(tenant_id) as session:
+            importer = ProductImporter(session, tenant_id, created_by, device_id, chunk_size)
+            # The body is read while the rows are imported, one chunk at a time
+            return importer.run(parse_lines(body_lines(http_request.stream()), fmt))
+
+    try:
+        return await run_in_threadpool(run)
+    except TenantMoving:
+        # Chunks committed before the freeze stay; sending the catalog again skips them
+        raise tenant_moving_error()
+    except UnreadableCatalog as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@app.get("/analytics/products")
+def product_analytics(
+    http_request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(default=50, ge=1, le=1000),
+    session: Session = Depends(get_session)
+):
+    """
+    Sales and stock totals per product over a period (default: last 30 days),
+    best sellers first. Served from the daily rollups.
+    """
+    until = as_utc(until) or datetime.utcnow()
+    since = as_utc(since) or until - timedelta(days=30)
+    
+    with read_session(session, http_request.state.tenant_id) as reader:
+        products = RollupStore(reader).product_totals(http_request.state.tenant_id, since, until, limit)
+    
+    return {"since": since, "until": until, "products": products}
+
+
+@app.get("/analytics/products/{product_id}")
+def product_series(
+    product_id: UUID,
+    http_request: Request,
+    granularity: str = "DAY",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    session: Session = Depends(get_session)
+):
+    """
+    Sales velocity and stock curve of a product in HOUR, DAY or WEEK buckets
+    (default: daily, last 30 days). Only buckets with events are returned.
+    stock_source tells what the curve is anchored on (see RollupStore.stock_anchor).
+    """
+    granularity = granularity.upper()
+    if granularity not in GRANULARITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"granularity must be one of {', '.join(GRANULARITIES)}"
+        )
+    
+    until = as_utc(until) or datetime.utcnow()
+    since = as_utc(since) or until - timedelta(days=30)
+    
+    with read_session(session, http_request.state.tenant_id) as reader:
+        rollups = RollupStore(reader)
+        buckets = rollups.series(http_request.state.tenant_id, product_id, granularity, since, until)
+        anchor = rollups.stock_anchor(http_request.state.tenant_id, product_id)
+    
+    days = max((until - since).total_seconds() / 86400, 1)
+    sales_units = sum(b["sales_units"] for b in buckets)
+    
+    return {
+        "product_id": str(product_id),
+        "granularity": granularity,
+        "since": since,
+        "until": until,
+        "sales_units": sales_units,
+        "sales_amount": sum(b["sales_amount"] for b in buckets),
+        "sales_per_day": round(sales_units / days, 3),
+        **anchor,
+        "buckets": buckets
+    }
+
+
+@app.get("/analytics/heatmap/{z}/{x}/{y}")
+def sales_heatmap_tile(
+    z: int,
+    x: int,
+    y: int,
+    http_request: Request,
+    response: Response,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    product_id: Optional[UUID] = None,
+    session: Session = Depends(get_session)
+):
+    """
+    Sales per geohash cell inside a web map tile (z/x/y, as in slippy map
+    URLs) over a period (default: last 30 days), as a GeoJSON
+    FeatureCollection of cell rectangles. The cell size follows the zoom.
+    """
+    if not 0 <= z <= 22 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid tile coordinates")
+    
+    until = as_utc(until) or datetime.utcnow()
+    since = as_utc(since) or until - timedelta(days=30)
+    precision = precision_for_zoom(z)
+    
+    with read_session(session, http_request.state.tenant_id) as reader:
+        cells = HeatmapStore(reader).cells(
+            http_request.state.tenant_id, tile_bounds(z, x, y), precision, since, until, product_id
+        )
+    
+    response.headers["Cache-Control"] = "private, max-age=60"
+    return {
+        "type": "FeatureCollection",
+        "precision": precision,
+        "since": since,
+        "until": until,
+        "features": [
+            {
+                "type": "Feature",
+                "id": cell["geohash"],
+                "bbox": cell["bbox"],
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[
+                        [cell["bbox"][0], cell["bbox"][1]],
+                        [cell["bbox"][2], cell["bbox"][1]],
+                        [cell["bbox"][2], cell["bbox"][3]],
+                        [cell["bbox"][0], cell["bbox"][3]],
+                        [cell["bbox"][0], cell["bbox"][1]],
+                    ]]
+                },
+                "properties": {
+                    "geohash": cell["geohash"],
+                    "lat": cell["lat"],
+                    "lng": cell["lng"],
+                    "sales_units": cell["sales_units"],
+                    "sales_amount": cell["sales_amount"],
+                    "event_count": cell["event_count"],
+                }
+            }
+            for cell in cells
+        ]
+    }
+
+
+@app.get("/audit/products/{product_id}/events")
+def product_event_history(
+    product_id: UUID,
+    http_request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    session: Session = Depends(get_session)
+):
+    """
+    Every stock event of a product created in [since, until), in Lamport
+    order. Ranges reaching past the archive horizon also scan the cold archive.
+    """
+    tenant_id = http_request.state.tenant_id
+    since, until = as_utc(since), as_utc(until)
+    
+    statement = select(StockEvent).where(
+        StockEvent.tenant_id == tenant_id,
+        StockEvent.product_id == product_id
+    )
+    if since:
+        statement = statement.where(StockEvent.created_at >= since)
+    if until:
+        statement = statement.where(StockEvent.created_at < until)
+    
+    with read_session(session, tenant_id) as reader:
+        events = reader.exec(statement.order_by(StockEvent.lamport_ts)).all()
+        events = [e.model_dump(mode="json") for e in events]
+    
+    archived = []
+    archive = ArchiveStore()
+    horizon = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    if archive.exists() and (since is None or since < horizon):
+        # An interrupted archival pass may leave a row in both tiers
+        hot = {e["id"] for e in events}
+        archived = [
+            e.model_dump(mode="json") for e in archive.events(tenant_id, [product_id], since, until)
+            if str(e.id) not in hot
+        ]
+    
+    return {
+        "product_id": str(product_id),
+        "archived": len(archived),
+        "events": archived + events
+    }
+
+
+@app.post("/receipts/uploads")
+def start_receipt_upload(
+    upload: ReceiptUploadStart,
+    http_request: Request,
+    session: Session = Depends(get_session)
+):
+    """
+    Start the chunked upload of a receipt photo, or resume it: next_chunk is
+    the first chunk the server has not acknowledged. A photo the tenant
+    already has is COMPLETE at once.
+    """
+    try:
+        started = ReceiptUploads(session).start(
+            http_request.state.tenant_id, upload.sha256, upload.size, upload.content_type, upload.chunk_size
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    
+    return upload_view(started)
+
+
+@app.get("/receipts/uploads/{upload_id}")
+def get_receipt_upload(upload_id: UUID, http_request: Request, session: Session = Depends(get_session)):
+    """State of an upload and the chunk to resume at."""
+    upload = ReceiptUploads(session).get(http_request.state.tenant_id, upload_id)
+    if not upload:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    
+    return upload_view(upload)
+
+
+@app.put("/receipts/uploads/{upload_id}/chunks/{index}")
+def put_receipt_chunk(
+    upload_id: UUID,
+    index: int,
+    http_request: Request,
+    data: bytes = Body(media_type="application/octet-stream"),
+    x_chunk_sha256: Optional[str] = Header(default=None),
+    session: Session = Depends(get_session)
+):
+    """
+    Upload chunk `index` (raw bytes, optionally with its X-Chunk-SHA256).
+    The chunk is acknowledged once durable; a rejected one answers 409 with
+    the next_chunk to resume at.
+    """
+    try:
+        upload = ReceiptUploads(session).put_chunk(http_request.state.tenant_id, upload_id, index, data, x_chunk_sha256)
+    except ChunkRejected as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"detail": e.reason, "next_chunk": e.next_chunk}
+        )
+    if not upload:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    
+    return upload_view(upload)
+
+
+@app.post("/receipts/uploads/{upload_id}/complete")
+def complete_receipt_upload(upload_id: UUID, http_request: Request, session: Session = Depends(get_session)):
+    """
+    Assemble and verify the photo. The response carries the receipt_photo
+    reference to set on the PendingPayment.
+    """
+    try:
+        upload = ReceiptUploads(session).complete(http_request.state.tenant_id, upload_id)
+    except ChunkRejected as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"detail": e.reason, "next_chunk": e.next_chunk}
+        )
+    if not upload:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    
+    return upload_view(upload)
+
+
+@app.get("/receipts/{sha256}")
+def get_receipt_photo(sha256: str, http_request: Request, session: Session = Depends(get_session)):
+    """A finished receipt photo of the tenant."""
+    store = ReceiptStore()
+    if not SHA256_HEX.match(sha256) or not store.has_photo(http_request.state.tenant_id, sha256):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Receipt not found")
+    
+    upload = ReceiptUploads(session).find(http_request.state.tenant_id, sha256)
+    return FileResponse(
+        store.photo_path(http_request.state.tenant_id, sha256),
+        media_type=upload.content_type if upload else "application/octet-stream",
+        headers={"Cache-Control": "private, max-age=31536000, immutable"}
     )
 
 
 @app.get("/sync/conflicts", response_model=ConflictListResponse)
 def list_conflicts(
     tenant_id: str,
+    http_request: Request,
     status: str = "PENDING",
     session: Session = Depends(get_session)
 ):
@@ -176,12 +758,41 @@ def list_conflicts(
         SyncConflict.status == status
     ).order_by(SyncConflict.detected_at.desc()).limit(50)
     
-    conflicts = session.exec(statement).all()
+    with read_session(session, getattr(http_request.state, "tenant_id", None)) as reader:
+        conflicts = reader.exec(statement).all()
+        
+        return ConflictListResponse(
+            conflicts=[c.model_dump() for c in conflicts],
+            total=len(conflicts)
+        )
+
+
+@app.put("/sync/conflict-rules")
+def set_conflict_rules(
+    update: ConflictRulesUpdate,
+    http_request: Request,
+    session: Session = Depends(get_session)
+):
+    """
+    Replace the tenant's conflict resolution rule table.
+    The table is compiled first, so an invalid table is rejected.
+    """
+    try:
+        compile_rules(update.rules)
+    except InvalidRuleTable as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    tenant_id = http_request.state.tenant_id
+    rule_set = session.exec(
+        select(ConflictRuleSet).where(ConflictRuleSet.tenant_id == tenant_id)
+    ).first() or ConflictRuleSet(tenant_id=tenant_id)
     
-    return ConflictListResponse(
-        conflicts=[c.model_dump() for c in conflicts],
-        total=len(conflicts)
-    )
+    rule_set.rules = update.rules
+    rule_set.updated_at = datetime.utcnow()
+    session.add(rule_set)
+    session.commit()
+    
+    return {"status": "saved", "rules": len(update.rules)}
 
 
 @app.post("/sync/conflicts/{conflict_id}/resolve")
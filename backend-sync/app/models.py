@@ -4,13 +4,27 @@ Implements offline-first synchronization with multi-tenancy.
 """
 
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from uuid import UUID, uuid4
 from hashlib import sha256
 import json
 
 from sqlmodel import SQLModel, Field, Column
-from sqlalchemy import JSON
+from sqlalchemy import JSON, Index, UniqueConstraint
+
+
+# Sync metadata left out of content hashes
+HASH_EXCLUDED_FIELDS = {
+    'content_hash', 'synced_at', 'lamport_ts',
+    'created_at', 'updated_at', 'version', 'field_lamports'
+}
+
+
+def content_hash_of(business_fields: Dict) -> str:
+    """SHA-256 of an entity's business fields (same as compute_hash, without an instance)."""
+    return sha256(
+        json.dumps(business_fields, sort_keys=True, default=str).encode()
+    ).hexdigest()
 
 
 class SyncBaseModel(SQLModel):
@@ -52,15 +66,7 @@ class SyncBaseModel(SQLModel):
         Compute deterministic hash of business fields only.
         Excludes sync metadata to detect actual content changes.
         """
-        business_fields = self.model_dump(
-            exclude={
-                'content_hash', 'synced_at', 'lamport_ts',
-                'created_at', 'updated_at', 'version'
-            }
-        )
-        return sha256(
-            json.dumps(business_fields, sort_keys=True, default=str).encode()
-        ).hexdigest()
+        return content_hash_of(self.model_dump(exclude=HASH_EXCLUDED_FIELDS))
     
     def increment_version(self):
         """Increment version counter for this entity."""
@@ -76,15 +82,29 @@ class Product(SyncBaseModel, table=True):
     Product entity.
     """
     __tablename__ = "products"
+    __table_args__ = (
+        # SKUs are unique within a tenant; also the barcode lookup index
+        UniqueConstraint("tenant_id", "sku"),
+    )
     
     name: str = Field(index=True)
     description: Optional[str] = None
     price: float
-    sku: str = Field(index=True, unique=True)
-    category: Optional[str] = None
+    sku: str
+    category: Optional[str] = Field(default=None, index=True)
     
     # Stock level (denormalized for quick access, but truth is in events)
     current_stock: int = Field(default=0)
+    
+    # Field-level LWW: Lamport of the last accepted write of each field.
+    # Fields missing here were last written at the row's lamport_ts.
+    field_lamports: Dict = Field(default_factory=dict, sa_column=Column(JSON))
+
+
+# Product fields merged independently by field-level LWW
+PRODUCT_MERGE_FIELDS = (
+    "name", "description", "price", "sku", "category", "current_stock", "is_deleted"
+)
 
 
 class StockEvent(SyncBaseModel, table=True):
@@ -94,6 +114,12 @@ class StockEvent(SyncBaseModel, table=True):
     """
     
     __tablename__ = "stock_events"
+    __table_args__ = (
+        # Selective pull: events of subscribed products after a cursor
+        Index("ix_stock_events_tenant_product_lamport", "tenant_id", "product_id", "lamport_ts"),
+        # Hash chain: one event per position of a device's sequence
+        UniqueConstraint("tenant_id", "device_id", "device_seq"),
+    )
     
     product_id: UUID = Field(foreign_key="products.id")
     
@@ -113,6 +139,12 @@ class StockEvent(SyncBaseModel, table=True):
     # Idempotency (Grok requirement)
     operation_hash: str = Field(unique=True, index=True, max_length=64)
     
+    # Per-device hash chain: position in the device's event log and the
+    # operation_hash of the device's previous event (None for the first one).
+    # Unchained events (device_seq None) skip the gap check.
+    device_seq: Optional[int] = None
+    prev_hash: Optional[str] = Field(default=None, max_length=64)
+    
     def compute_operation_hash(self) -> str:
         """
         Compute unique hash for this operation to ensure idempotency.
@@ -129,6 +161,82 @@ class StockEvent(SyncBaseModel, table=True):
         ).hexdigest()
 
 
+class StockCounter(SQLModel, table=True):
+    """
+    PN-counter CRDT state of one device for one product.
+    Each device only ever grows its own increments/decrements; the server
+    merges by taking the max of each, so merges commute and never conflict.
+    Stock = sum(increments) - sum(decrements) over all devices.
+    """
+    
+    __tablename__ = "stock_counters"
+    __table_args__ = (UniqueConstraint("tenant_id", "product_id", "device_id"),)
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True)
+    product_id: UUID = Field(foreign_key="products.id", index=True)
+    device_id: UUID
+    
+    increments: int = Field(default=0)  # P: restocks, cancellations
+    decrements: int = Field(default=0)  # N: sales, reservations, damage
+    
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class StockRollup(SQLModel, table=True):
+    """
+    Totals of accepted StockEvents of one product over one time bucket.
+    Maintained incrementally (HOUR and DAY buckets, UTC) in the transaction
+    that accepts each event, so analytics never scan stock_events.
+    """
+    
+    __tablename__ = "stock_rollups"
+    __table_args__ = (UniqueConstraint("tenant_id", "product_id", "granularity", "bucket_start"),)
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True)
+    product_id: UUID = Field(foreign_key="products.id")
+    granularity: str  # "HOUR", "DAY"
+    bucket_start: datetime
+    
+    units_in: int = Field(default=0)      # Sum of positive deltas
+    units_out: int = Field(default=0)     # Sum of negative deltas (as a positive number)
+    net_delta: int = Field(default=0)     # units_in - units_out (SET events excluded)
+    sales_units: int = Field(default=0)   # Units of SALE events
+    sales_amount: float = Field(default=0.0)
+    event_count: int = Field(default=0)
+    
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class SalesHeatmapCell(SQLModel, table=True):
+    """
+    Sales of one product in one geohash cell over one UTC day.
+    Maintained incrementally from located SALE events (see app/heatmap.py);
+    the cell center is stored so map tiles filter by bounding box.
+    """
+    
+    __tablename__ = "sales_heatmap_cells"
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "product_id", "geohash", "bucket_start"),
+        Index("ix_sales_heatmap_cells_tenant_bucket", "tenant_id", "bucket_start", "cell_lat", "cell_lng"),
+    )
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True)
+    product_id: UUID = Field(foreign_key="products.id")
+    geohash: str
+    bucket_start: datetime
+    cell_lat: float
+    cell_lng: float
+    
+    sales_units: int = Field(default=0)
+    sales_amount: float = Field(default=0.0)
+    event_count: int = Field(default=0)
+    
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 class SyncConflict(SQLModel, table=True):
     """
     Log of synchronization conflicts for audit and analysis.
@@ -168,6 +276,21 @@ class SyncConflict(SQLModel, table=True):
     user_feedback: Optional[str] = None
 
 
+class ConflictRuleSet(SQLModel, table=True):
+    """
+    Per-tenant conflict resolution rule table (see app.conflict_rules).
+    Tenants without a row use the default three-tier rules.
+    """
+    
+    __tablename__ = "conflict_rule_sets"
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True, unique=True)
+    
+    rules: List[Dict] = Field(sa_column=Column(JSON))
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 class PendingPayment(SyncBaseModel, table=True):
     """
     Offline payments pending reconciliation.
@@ -192,3 +315,156 @@ class PendingPayment(SyncBaseModel, table=True):
     # Evidence
     receipt_photo: Optional[str] = None
     notes: Optional[str] = None
+
+
+class ReceiptUpload(SQLModel, table=True):
+    """
+    Resumable chunked upload of a receipt photo (see app/receipts.py).
+    Chunks are stored by content hash; chunk_hashes lists the acknowledged
+    ones in order, so an interrupted upload resumes at len(chunk_hashes).
+    """
+    
+    __tablename__ = "receipt_uploads"
+    __table_args__ = (UniqueConstraint("tenant_id", "sha256"),)
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True)
+    
+    # SHA-256 and size of the whole photo, declared when the upload starts
+    sha256: str = Field(max_length=64)
+    size: int
+    content_type: str = Field(default="image/jpeg")
+    chunk_size: int
+    chunk_hashes: List[str] = Field(default_factory=list, sa_column=Column(JSON))
+    
+    status: str = Field(default="UPLOADING")  # "UPLOADING", "COMPLETE"
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class SyncBatchReceipt(SQLModel, table=True):
+    """
+    Stored response of an already processed push batch.
+    A retransmitted batch with the same Idempotency-Key is answered from here.
+    """
+    
+    __tablename__ = "sync_batch_receipts"
+    __table_args__ = (UniqueConstraint("tenant_id", "idempotency_key"),)
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True)
+    idempotency_key: str = Field(max_length=128)
+    
+    # SHA-256 of the request body, to reject a key reused for another batch
+    request_hash: str = Field(max_length=64)
+    response: Dict = Field(sa_column=Column(JSON))
+    
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class SyncPushTicket(SQLModel, table=True):
+    """
+    A push batch waiting in the write-ahead ingestion queue (asynchronous push).
+    Workers apply tickets in enqueue order per tenant; the device gets the
+    results by polling the ticket or on its next pull.
+    """
+    
+    __tablename__ = "sync_push_tickets"
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "idempotency_key"),
+        Index("ix_sync_push_tickets_status_tenant_enqueued", "status", "tenant_id", "enqueued_at"),
+        Index("ix_sync_push_tickets_tenant_device_status", "tenant_id", "device_id", "status"),
+    )
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True)
+    device_id: UUID
+    
+    idempotency_key: Optional[str] = Field(default=None, max_length=128)
+    request_hash: str = Field(max_length=64)
+    payload: Dict = Field(sa_column=Column(JSON))
+    
+    status: str = Field(default="PENDING")  # "PENDING", "DONE", "FAILED"
+    attempts: int = Field(default=0)
+    response: Optional[Dict] = Field(default=None, sa_column=Column(JSON))
+    error: Optional[str] = None
+    
+    enqueued_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    delivered_at: Optional[datetime] = None  # Results handed over on a pull
+
+
+class SyncDevice(SQLModel, table=True):
+    """
+    Server-side record of a device of a tenant.
+    Pulling from cursor X acknowledges every operation up to X, which bounds
+    how long tombstones must be kept and tells how far behind the device is.
+    """
+    
+    __tablename__ = "sync_devices"
+    __table_args__ = (UniqueConstraint("tenant_id", "device_id"),)
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True)
+    device_id: UUID
+    
+    last_pulled_lamport: int = Field(default=0)
+    last_pushed_lamport: int = Field(default=0)
+    
+    # Head of the device's event hash chain (last device_seq and its operation_hash)
+    chain_seq: int = Field(default=0)
+    chain_hash: Optional[str] = Field(default=None, max_length=64)
+    last_seen_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    # Selective pull: {"product_ids": [...], "categories": [...]}; None pulls everything
+    device_role: Optional[str] = None
+    subscription: Optional[Dict] = Field(default=None, sa_column=Column(JSON))
+
+
+class SyncHorizon(SQLModel, table=True):
+    """
+    Highest Lamport timestamp of a tenant below which rows may have been
+    purged (tombstone GC) or moved to the archive. A device whose cursor is
+    below it missed those changes and must resync from scratch.
+    """
+    
+    __tablename__ = "sync_horizons"
+    __table_args__ = (UniqueConstraint("tenant_id"),)
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True)
+    collected_lamport: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class SyncRoleSubscription(SQLModel, table=True):
+    """
+    Subscription shared by every device of a role (e.g. all market POS tablets).
+    Used when a device has no subscription of its own.
+    """
+    
+    __tablename__ = "sync_role_subscriptions"
+    __table_args__ = (UniqueConstraint("tenant_id", "role"),)
+    
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    tenant_id: UUID = Field(index=True)
+    role: str
+    
+    product_ids: List[str] = Field(default_factory=list, sa_column=Column(JSON))
+    categories: List[str] = Field(default_factory=list, sa_column=Column(JSON))
+    
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class TenantShard(SQLModel, table=True):
+    """
+    Directory entry placing a tenant on a database shard (see app/shards.py).
+    Lives on the default database; tenants without an entry stay there.
+    """
+    
+    __tablename__ = "tenant_shards"
+    
+    tenant_id: UUID = Field(primary_key=True)
+    shard: str = Field(max_length=64)
+    status: str = Field(default="ACTIVE")  # "ACTIVE", "MOVING" (writes frozen for the switch)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
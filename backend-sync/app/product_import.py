@@ -0,0 +1,291 @@
+"""
+Bulk import of a product catalog.
+Onboarding a cooperative means creating thousands of products at once. Through
+/sync/push every product costs a SELECT and a commit; the importer instead
+streams a CSV or JSONL catalog and, per chunk of rows:
+
+1. validates the rows (bad rows are reported with their line and skipped);
+2. skips SKUs the tenant already has, with one query for the whole chunk
+   (so an interrupted import can simply be run again);
+3. assigns the chunk a contiguous range of Lamport timestamps;
+4. loads it with COPY (Postgres) or executemany, and commits.
+
+An import stops with TenantMoving at the first chunk after its tenant is frozen
+for a shard move; the chunks before it are committed.
+
+CSV needs a header row; columns (and JSONL keys) are the ProductImportRow fields.
+POST /products/import feeds the request body through body_lines, so neither the
+body nor its text is ever held whole.
+
+Imported products are stamped after the current Lamport clock, which the sync
+engine reads from products as well as events: later device edits of an
+imported product get later stamps and win.
+
+Usage:
+    python -m app.product_import --tenant UUID --user UUID catalog.csv [--chunk-size 5000]
+"""
+
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID, uuid4
+import argparse
+import codecs
+import csv
+import json
+import time
+
+import anyio.from_thread
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from .catalog import get_sku_cache, normalize_sku
+from .database import BulkWriter, set_tenant_context, tenant_session
+from .models import HASH_EXCLUDED_FIELDS, Product, content_hash_of
+from .shards import ensure_placed
+from .sync_engine import AgrotourSyncEngine
+
+CSV = "text/csv"
+JSONL = "application/x-ndjson"
+
+DEFAULT_CHUNK_SIZE = 5_000
+
+# Invalid rows reported in full; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# A catalog line longer than this (in characters) ends the import instead of being buffered
+MAX_LINE_CHARS = 1024 * 1024
+
+PRODUCT_COLUMNS = tuple(Product.__table__.columns.keys())
+
+# Columns of an imported product not taken from the catalog
+PRODUCT_DEFAULTS = {
+    "version": 1,
+    "device_type": "WEB",
+    "is_deleted": False,
+    "deleted_at": None,
+    "field_lamports": {},
+}
+
+
+class ProductImportRow(BaseModel):
+    """One product of an imported catalog."""
+
+    sku: str = Field(min_length=1)
+    name: str = Field(min_length=1)
+    price: float = Field(ge=0)
+    description: Optional[str] = None
+    category: Optional[str] = None
+    current_stock: int = Field(default=0, ge=0)
+
+
+def parse_lines(lines: Iterable[str], fmt: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """(line number, record, parse error) of a CSV or JSONL catalog; blank lines are skipped."""
+    if fmt == CSV:
+        reader = csv.DictReader(lines)
+        for record in reader:
+            # Empty cells are missing values
+            yield reader.line_num, {k: v for k, v in record.items() if k and v not in (None, "")}, None
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, None, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "Expected a JSON object"
+            continue
+        yield number, record, None
+
+
+class UnreadableCatalog(ValueError):
+    """Raised for a catalog body that is not UTF-8 text or has an overlong line."""
+
+
+def body_lines(stream: AsyncIterator[bytes]) -> Iterator[str]:
+    """
+    Lines (ends included) of a request body, for an importer running in a
+    worker thread. Each body chunk is awaited on the event loop and decoded
+    incrementally, so only one chunk and one partial line are held at a time.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    chunks = stream.__aiter__()
+
+    async def next_chunk() -> Optional[bytes]:
+        try:
+            return await chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    pending = ""
+    while True:
+        data = anyio.from_thread.run(next_chunk)
+        try:
+            pending += decoder.decode(data or b"", final=data is None)
+        except UnicodeDecodeError as e:
+            raise UnreadableCatalog(f"Body is not UTF-8: {e.reason}")
+        # Only "\n" ends a line: CSV keeps its "\r", JSON strings may hold other separators
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+        if len(pending) > MAX_LINE_CHARS:
+            raise UnreadableCatalog("Line too long")
+        if data is None:
+            break
+
+    if pending:
+        yield pending
+
+
+def format_of(path: Path) -> str:
+    return CSV if path.suffix.lower() == ".csv" else JSONL
+
+
+class ProductImporter:
+    """Chunked, set-based creation of a tenant's products."""
+
+    def __init__(
+        self,
+        session: Session,
+        tenant_id: UUID,
+        user_id: UUID,
+        device_id: Optional[UUID] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ):
+        self.session = session
+        self.tenant_id = tenant_id
+        self.user_id = user_id
+        # The import job acts as one device of the tenant
+        self.device_id = device_id or uuid4()
+        self.chunk_size = chunk_size
+
+    def run(self, records: Iterable[Tuple[int, Optional[Dict], Optional[str]]]) -> Dict:
+        start = time.perf_counter()
+        summary = {"rows": 0, "created": 0, "existing": 0, "invalid": 0, "errors": []}
+        # After the clock (events and products, earlier imports included). The engine
+        # derives its clock from these rows too, so device edits of imported products
+        # get later stamps and are not ignored as stale.
+        lamport = AgrotourSyncEngine(self.session).server_lamport
+        first_lamport = lamport + 1
+
+        chunk: List[Tuple[int, ProductImportRow]] = []
+        seen = set()
+
+        def report(line: int, detail: str) -> None:
+            summary["invalid"] += 1
+            if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                summary["errors"].append({"line": line, "detail": detail})
+
+        for line, record, error in records:
+            summary["rows"] += 1
+            if error:
+                report(line, error)
+                continue
+            try:
+                row = ProductImportRow(**record)
+            except ValidationError as e:
+                report(line, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+                continue
+
+            row.sku = normalize_sku(row.sku)
+            if row.sku in seen:
+                report(line, f"Duplicate SKU in the catalog: {row.sku}")
+                continue
+            seen.add(row.sku)
+
+            chunk.append((line, row))
+            if len(chunk) >= self.chunk_size:
+                lamport = self._load(chunk, lamport, summary)
+                chunk = []
+
+        if chunk:
+            lamport = self._load(chunk, lamport, summary)
+
+        # Cached lookups (including "unknown SKU") are stale now
+        cache = get_sku_cache()
+        if cache:
+            cache.invalidate(self.tenant_id)
+
+        summary["lamport_range"] = [first_lamport, lamport] if summary["created"] else None
+        summary["seconds"] = round(time.perf_counter() - start, 3)
+        summary["status"] = "imported"
+        return summary
+
+    def _load(self, chunk: List[Tuple[int, ProductImportRow]], lamport: int, summary: Dict) -> int:
+        """Insert the chunk's new products in one transaction; returns the last Lamport used."""
+        # The session is held for the whole import: stop at the chunk after a shard move froze the tenant
+        ensure_placed(self.tenant_id, self.session.get_bind())
+        set_tenant_context(self.session, self.tenant_id)
+
+        existing = set(self.session.exec(
+            select(Product.sku).where(
+                Product.tenant_id == self.tenant_id,
+                Product.sku.in_([row.sku for _, row in chunk])
+            )
+        ).all())
+        new_rows = [row for _, row in chunk if row.sku not in existing]
+        summary["existing"] += len(chunk) - len(new_rows)
+
+        now = datetime.utcnow()
+        writer = BulkWriter(self.session, Product.__table__, PRODUCT_COLUMNS, self.chunk_size)
+        for offset, row in enumerate(new_rows, start=1):
+            # Plain rows: building ORM instances would dominate the import time
+            product = {
+                **PRODUCT_DEFAULTS,
+                **row.model_dump(),
+                "id": uuid4(),
+                "tenant_id": self.tenant_id,
+                "device_id": self.device_id,
+                "created_by": self.user_id,
+                "updated_by": self.user_id,
+            }
+            product["content_hash"] = content_hash_of(
+                {k: v for k, v in product.items() if k not in HASH_EXCLUDED_FIELDS}
+            )
+            product.update(lamport_ts=lamport + offset, synced_at=now, created_at=now, updated_at=now)
+            writer.add(tuple(product[column] for column in PRODUCT_COLUMNS))
+
+        try:
+            writer.flush()
+            self.session.commit()
+        except IntegrityError:
+            # A SKU created concurrently (e.g. by a device push): report the chunk, keep going
+            self.session.rollback()
+            summary["invalid"] += len(new_rows)
+            summary["errors"].append({
+                "line": chunk[0][0],
+                "detail": f"Chunk of {len(new_rows)} products conflicted with SKUs created meanwhile; run the import again"
+            })
+            return lamport
+
+        summary["created"] += len(new_rows)
+        return lamport + len(new_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import a product catalog (CSV or JSONL)")
+    parser.add_argument("catalog", type=Path)
+    parser.add_argument("--tenant", type=UUID, required=True)
+    parser.add_argument("--user", type=UUID, required=True, help="Recorded as created_by")
+    parser.add_argument("--device", type=UUID, help="Device id of the import (default: a new one)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with open(args.catalog, newline="", encoding="utf-8-sig") as catalog:
+        with tenant_session(args.tenant) as session:
+            importer = ProductImporter(session, args.tenant, args.user, args.device, args.chunk_size)
+            summary = importer.run(parse_lines(catalog, format_of(args.catalog)))
+
+    for error in summary["errors"]:
+        print(f"[WARN] Line {error['line']}: {error['detail']}")
+    summary.pop("errors")
+    print(f"[INFO] Import tenant={args.tenant} {summary}")
+
+
+if __name__ == "__main__":
+    main()
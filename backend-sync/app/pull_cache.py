@@ -0,0 +1,170 @@
+"""
+Redis-backed cache of encoded /sync/pull pages.
+Many devices of a tenant pull the same pages at once (e.g. after a price
+update every tablet at a market asks for the same cursor). Pages are keyed by
+(tenant, head Lamport, cursor, limit, subscription scope), so they are invalidated as soon as the
+tenant's Lamport clock advances, and concurrent misses share one DB query.
+"""
+
+from typing import Callable, Dict, Optional
+from uuid import UUID
+import os
+import threading
+import time
+
+from redis.exceptions import RedisError
+
+from .database import get_redis
+
+PULL_CACHE_TTL_SECONDS = int(os.getenv("PULL_CACHE_TTL_SECONDS", "300"))
+
+# How long a cross-worker miss waits for the worker that holds the fill lock
+FILL_LOCK_MS = 5000
+FILL_WAIT_SECONDS = 2.0
+FILL_POLL_SECONDS = 0.02
+
+HEADS_KEY = "sync:heads"
+
+
+class _SingleFlight:
+    """Collapse concurrent in-process loads of the same key into one call."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, "_Call"] = {}
+
+    def do(self, key: str, fn: Callable[[], bytes]) -> bytes:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.value
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[bytes] = None
+        self.error: Optional[Exception] = None
+
+
+class PullPageCache:
+    """
+    Per-tenant cache of encoded pull pages.
+    The tenant head (last server Lamport) lives in a sorted set so it only
+    ever moves forward, whatever the order in which pushes report it.
+    """
+
+    def __init__(self, client, ttl_seconds: int = PULL_CACHE_TTL_SECONDS):
+        self.client = client
+        self.ttl = ttl_seconds
+        self._flight = _SingleFlight()
+
+    def _page_key(self, tenant_id: UUID, head: int, cursor: int, limit: int, scope: str) -> str:
+        return f"sync:pull:{tenant_id}:{head}:{cursor}:{limit}:{scope}"
+
+    def get_head(self, tenant_id: UUID) -> Optional[int]:
+        """Current head Lamport of the tenant, or None if unknown."""
+        score = self.client.zscore(HEADS_KEY, str(tenant_id))
+        return int(score) if score is not None else None
+
+    def known_head(self, tenant_id: UUID) -> int:
+        """Head Lamport of the tenant, 0 if unknown or Redis is unavailable."""
+        try:
+            return self.get_head(tenant_id) or 0
+        except RedisError:
+            return 0
+
+    def advance(self, tenant_id: UUID, lamport: int) -> None:
+        """
+        Move the tenant head forward; every page cached under an older head
+        becomes unreachable and expires on its own.
+        """
+        try:
+            self.client.zadd(HEADS_KEY, {str(tenant_id): lamport}, gt=True)
+        except RedisError as e:
+            print(f"[WARN] Pull cache head update failed: {e}")
+
+    def get_or_load(
+        self,
+        tenant_id: UUID,
+        cursor: int,
+        limit: int,
+        load_page: Callable[[], bytes],
+        load_head: Callable[[], int],
+        scope: str = "all"
+    ) -> bytes:
+        """
+        Return the encoded page, loading it from the database at most once per
+        head across concurrent requests. Falls back to the loader if Redis fails.
+        """
+        try:
+            head = self.get_head(tenant_id)
+            if head is None:
+                head = load_head()
+                self.advance(tenant_id, head)
+
+            key = self._page_key(tenant_id, head, cursor, limit, scope)
+            cached = self.client.get(key)
+            if cached is not None:
+                return cached
+
+            return self._flight.do(key, lambda: self._fill(key, load_page))
+        except RedisError as e:
+            print(f"[WARN] Pull cache unavailable, reading from database: {e}")
+            return load_page()
+
+    def _fill(self, key: str, load_page: Callable[[], bytes]) -> bytes:
+        """Load a page, coordinating with other workers through a fill lock."""
+        lock_key = f"{key}:lock"
+
+        if not self.client.set(lock_key, b"1", nx=True, px=FILL_LOCK_MS):
+            # Another worker is filling this page: wait briefly for it
+            deadline = time.monotonic() + FILL_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                time.sleep(FILL_POLL_SECONDS)
+                cached = self.client.get(key)
+                if cached is not None:
+                    return cached
+            return load_page()
+
+        try:
+            page = load_page()
+            self.client.set(key, page, ex=self.ttl)
+            return page
+        finally:
+            self.client.delete(lock_key)
+
+
+_pull_cache: Optional[PullPageCache] = None
+
+
+def get_pull_cache() -> Optional[PullPageCache]:
+    """Process-wide pull cache, or None when Redis is not configured."""
+    global _pull_cache
+
+    if _pull_cache is None:
+        client = get_redis()
+        if client is None:
+            return None
+        _pull_cache = PullPageCache(client)
+
+    return _pull_cache
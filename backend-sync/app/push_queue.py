@@ -0,0 +1,323 @@
+"""
+Write-ahead ingestion queue for /sync/push.
+At market peaks a phone should not wait for conflict handling and commits.
+In asynchronous mode (header `Prefer: respond-async`, or SYNC_PUSH_MODE=ASYNC)
+the batch is appended to sync_push_tickets and a ticket is returned at once.
+Workers drain the queue through AgrotourSyncEngine in enqueue order per
+tenant; the device polls GET /sync/push/tickets/{id} or receives the results
+with its next pull.
+
+Usage:
+    python -m app.push_queue [--interval 0.5] [--batch-size 100] [--once]
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from uuid import UUID
+import argparse
+import os
+import time
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from .catalog import invalidate_after_push
+from .database import set_tenant_context
+from .devices import DeviceRegistry
+from .idempotency import BatchIdempotencyStore, IdempotencyKeyReused, compute_batch_hash
+from .models import SyncPushTicket
+from .pull_cache import get_pull_cache
+from .schemas import SyncPushRequest, SyncPushResponse
+from .shards import TenantMoving, engine_for_tenant, shard_engines
+from .sync_engine import AgrotourSyncEngine
+
+# "SYNC": push answers with the results (default); "ASYNC": push answers with a ticket
+SYNC_PUSH_MODE = os.getenv("SYNC_PUSH_MODE", "SYNC").upper()
+PUSH_QUEUE_MAX_ATTEMPTS = int(os.getenv("PUSH_QUEUE_MAX_ATTEMPTS", "3"))
+
+DEFAULT_BATCH_SIZE = 100
+
+
+def wants_async(prefer: Optional[str]) -> bool:
+    """Asynchronous push requested by the client (RFC 7240) or by configuration."""
+    if prefer:
+        preferences = {p.strip().lower() for p in prefer.split(",")}
+        if "respond-async" in preferences:
+            return True
+        if "wait" in preferences or any(p.startswith("wait=") for p in preferences):
+            return False
+    return SYNC_PUSH_MODE == "ASYNC"
+
+
+def process_push(
+    session: Session,
+    tenant_id: Optional[UUID],
+    request: SyncPushRequest,
+    idempotency_key: Optional[str] = None,
+    advance_cache: bool = True
+) -> SyncPushResponse:
+    """
+    Apply a push batch and its bookkeeping: device cursor, pull cache head and
+    idempotency receipt. Shared by synchronous pushes, queue workers and group
+    commit (which advances the cache itself, after its shared commit).
+    """
+    sync_engine = AgrotourSyncEngine(session)
+    results = sync_engine.apply_push(request)
+
+    response = SyncPushResponse(
+        results=results,
+        server_lamport=sync_engine.server_lamport,
+        timestamp=datetime.utcnow()
+    )
+
+    if tenant_id:
+        DeviceRegistry(session).record_push(tenant_id, request.device_id, sync_engine.server_lamport)
+
+    # Invalidate cached pull pages once the tenant clock moved
+    cache = get_pull_cache() if advance_cache else None
+    if cache and tenant_id and any(r.get("status") == "accepted" for r in results):
+        cache.advance(tenant_id, sync_engine.server_lamport)
+    if advance_cache:
+        invalidate_after_push(tenant_id, request)
+
+    if idempotency_key and tenant_id:
+        BatchIdempotencyStore(session).store(
+            tenant_id, idempotency_key, compute_batch_hash(request), response.model_dump(mode="json")
+        )
+
+    return response
+
+
+def ticket_view(ticket: SyncPushTicket) -> Dict:
+    """Public representation of a ticket."""
+    return {
+        "ticket": str(ticket.id),
+        "status": ticket.status,
+        "enqueued_at": ticket.enqueued_at.isoformat(),
+        "finished_at": ticket.finished_at.isoformat() if ticket.finished_at else None,
+        "response": ticket.response,
+        "error": ticket.error,
+    }
+
+
+class PushQueue:
+    """Enqueue, drain and deliver asynchronous push batches."""
+
+    def __init__(self, session: Session, max_attempts: int = PUSH_QUEUE_MAX_ATTEMPTS):
+        self.session = session
+        self.max_attempts = max_attempts
+
+    def enqueue(
+        self,
+        tenant_id: UUID,
+        request: SyncPushRequest,
+        idempotency_key: Optional[str] = None
+    ) -> SyncPushTicket:
+        """
+        Durably append a batch. A batch resent with the same Idempotency-Key
+        gets its existing ticket back.
+        """
+        request_hash = compute_batch_hash(request)
+
+        existing = self._find(tenant_id, idempotency_key, request_hash)
+        if existing:
+            return existing
+
+        ticket = SyncPushTicket(
+            tenant_id=tenant_id,
+            device_id=request.device_id,
+            idempotency_key=idempotency_key,
+            request_hash=request_hash,
+            payload=request.model_dump(mode="json")
+        )
+        self.session.add(ticket)
+        try:
+            self.session.commit()
+        except IntegrityError:
+            # A concurrent retransmission enqueued it first
+            self.session.rollback()
+            return self._find(tenant_id, idempotency_key, request_hash)
+        self.session.refresh(ticket)
+
+        return ticket
+
+    def _find(self, tenant_id: UUID, idempotency_key: Optional[str], request_hash: str) -> Optional[SyncPushTicket]:
+        if not idempotency_key:
+            return None
+
+        ticket = self.session.exec(
+            select(SyncPushTicket).where(
+                SyncPushTicket.tenant_id == tenant_id,
+                SyncPushTicket.idempotency_key == idempotency_key
+            )
+        ).first()
+        if ticket and ticket.request_hash != request_hash:
+            raise IdempotencyKeyReused(idempotency_key)
+        return ticket
+
+    def get(self, tenant_id: UUID, ticket_id: UUID) -> Optional[SyncPushTicket]:
+        ticket = self.session.get(SyncPushTicket, ticket_id)
+        return ticket if ticket and ticket.tenant_id == tenant_id else None
+
+    def collect_results(self, tenant_id: UUID, device_id: UUID) -> List[Dict]:
+        """Finished tickets of a device not handed over yet (marked as delivered)."""
+        tickets = self.session.exec(
+            select(SyncPushTicket).where(
+                SyncPushTicket.tenant_id == tenant_id,
+                SyncPushTicket.device_id == device_id,
+                SyncPushTicket.status.in_(["DONE", "FAILED"]),
+                SyncPushTicket.delivered_at == None
+            ).order_by(SyncPushTicket.enqueued_at)
+        ).all()
+        if not tickets:
+            return []
+
+        views = [ticket_view(ticket) for ticket in tickets]
+        now = datetime.utcnow()
+        for ticket in tickets:
+            ticket.delivered_at = now
+            self.session.add(ticket)
+        self.session.commit()
+
+        return views
+
+    def pending_tenants(self) -> List[UUID]:
+        return self.session.exec(
+            select(SyncPushTicket.tenant_id).where(SyncPushTicket.status == "PENDING").distinct()
+        ).all()
+
+    def drain_tenant(self, tenant_id: UUID, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """
+        Apply up to batch_size pending tickets of a tenant, oldest first.
+        A failing ticket stops the drain (later tickets may depend on it)
+        until it has used up its attempts and is marked FAILED.
+        """
+        tickets = self.session.exec(
+            select(SyncPushTicket).where(
+                SyncPushTicket.status == "PENDING",
+                SyncPushTicket.tenant_id == tenant_id
+            ).order_by(SyncPushTicket.enqueued_at).limit(batch_size)
+        ).all()
+
+        processed = 0
+        for ticket in tickets:
+            ticket_id = ticket.id
+            try:
+                request = SyncPushRequest.model_validate(ticket.payload)
+                response = process_push(self.session, tenant_id, request, ticket.idempotency_key)
+            except Exception as e:
+                self.session.rollback()
+                # A rollback also drops a tenant context set inside the transaction
+                set_tenant_context(self.session, tenant_id)
+                ticket = self.session.get(SyncPushTicket, ticket_id)
+                ticket.attempts += 1
+                ticket.error = str(e)[:500]
+                if ticket.attempts >= self.max_attempts:
+                    ticket.status = "FAILED"
+                    ticket.finished_at = datetime.utcnow()
+                self.session.add(ticket)
+                self.session.commit()
+                print(f"[WARN] Push ticket {ticket_id} failed (attempt {ticket.attempts}): {e}")
+                if ticket.status == "PENDING":
+                    break
+                continue
+
+            ticket = self.session.get(SyncPushTicket, ticket_id)
+            ticket.status = "DONE"
+            ticket.attempts += 1
+            ticket.response = response.model_dump(mode="json")
+            ticket.finished_at = datetime.utcnow()
+            self.session.add(ticket)
+            self.session.commit()
+            processed += 1
+
+        return processed
+
+
+def _lock_key(tenant_id: UUID) -> int:
+    return int.from_bytes(tenant_id.bytes[:8], "big", signed=True)
+
+
+def _advisory_lock(connection, tenant_id: UUID) -> bool:
+    """Try to take the tenant's drain lock on the connection (always granted off Postgres)."""
+    if connection.dialect.name != "postgresql":
+        return True
+    return bool(connection.exec_driver_sql(f"SELECT pg_try_advisory_lock({_lock_key(tenant_id)})").scalar())
+
+
+@contextmanager
+def _tenant_worker_session(tenant_id: UUID) -> Iterator[Optional[Session]]:
+    """
+    Session on the tenant's shard, pinned to one connection holding the
+    tenant's advisory lock, so only one worker drains a tenant at a time
+    (None if another worker has it or the tenant is being moved).
+    """
+    try:
+        bind = engine_for_tenant(tenant_id)
+    except TenantMoving:
+        yield None
+        return
+
+    with bind.connect() as connection:
+        locked = _advisory_lock(connection, tenant_id)
+        # The lock is held by the connection, not the transaction. Ending the
+        # transaction here lets the Session begin its own, so every ticket's
+        # commit is a real commit and not a savepoint release inside this one.
+        connection.commit()
+        if not locked:
+            yield None
+            return
+
+        with Session(bind=connection) as session:
+            try:
+                # Committed, the context outlives the rollback of a failed ticket
+                set_tenant_context(session, tenant_id)
+                session.commit()
+                yield session
+            finally:
+                session.rollback()
+                if connection.dialect.name == "postgresql":
+                    connection.exec_driver_sql(f"SELECT pg_advisory_unlock({_lock_key(tenant_id)})")
+                    connection.exec_driver_sql("RESET ROLE")
+                    connection.exec_driver_sql("RESET app.current_tenant_id")
+                    connection.commit()
+
+
+def drain_all(batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """One pass over every tenant with pending tickets, on every shard."""
+    tenant_ids = []
+    for shard_engine in shard_engines().values():
+        with Session(shard_engine) as session:
+            tenant_ids += PushQueue(session).pending_tenants()
+
+    processed = 0
+    for tenant_id in dict.fromkeys(tenant_ids):
+        with _tenant_worker_session(tenant_id) as session:
+            if session is None:
+                continue
+            done = PushQueue(session).drain_tenant(tenant_id, batch_size)
+        if done:
+            print(f"[INFO] Push queue tenant={tenant_id} applied={done}")
+        processed += done
+
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drain the asynchronous push queue")
+    parser.add_argument("--interval", type=float, default=0.5, help="Idle poll interval in seconds")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Tickets per tenant per pass")
+    parser.add_argument("--once", action="store_true", help="Drain once and exit")
+    args = parser.parse_args()
+
+    while True:
+        processed = drain_all(args.batch_size)
+        if args.once:
+            break
+        if not processed:
+            time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Parallel rebuild of the projections derived from the event log.
+stock_rollups and sales_heatmap_cells (and, with --stock, Product.current_stock)
+are recomputed from stock_events when they drift. The log is partitioned by
+(tenant, product): each partition is replayed in a worker process through a
+server-side cursor read in chunks (after the partition's events in the cold
+archive, if any), and its rollups and cells are written back with COPY,
+replacing the old ones in the same transaction.
+
+Archived events are read for a bounded group of products at a time, dropping
+other products' rows while the files are read. With shards, every tenant is
+rebuilt on the shard it is placed on: partitions are planned per shard and
+each worker connects to its partition's shard.
+
+Run it in a quiet period: a partition that races live ingestion fails with a
+serialization error and is retried.
+
+Usage:
+    python -m app.rebuild [--tenant UUID] [--workers 4] [--partition-events 200000]
+                          [--chunk-size 5000] [--stock] [--archive PATH]
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID, uuid4
+import argparse
+import multiprocessing
+import os
+import time
+
+from sqlalchemy import column, delete, func, table
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlmodel import Session, create_engine, select
+
+from .archive import ARCHIVE_PATH, ArchiveStore
+from .crdt import SYNC_STOCK_MODE
+from .database import BulkWriter, set_tenant_context
+from .heatmap import TOTAL_FIELDS as CELL_FIELDS, aggregate as aggregate_cells, bounds
+from .models import Product, SalesHeatmapCell, StockEvent, StockRollup
+from .rollups import TOTAL_FIELDS, aggregate, stock_lamport
+from .shards import DEFAULT_SHARD, get_shard_router, shard_engines
+
+DEFAULT_WORKERS = os.cpu_count() or 2
+DEFAULT_PARTITION_EVENTS = 200_000
+DEFAULT_CHUNK_SIZE = 5_000
+MAX_ATTEMPTS = 3
+
+# Archived events held in memory at once while replaying a partition
+ARCHIVE_GROUP_EVENTS = 100_000
+
+ROLLUP_COLUMNS = ("id", "tenant_id", "product_id", "granularity", "bucket_start", *TOTAL_FIELDS, "updated_at")
+CELL_COLUMNS = (
+    "id", "tenant_id", "product_id", "geohash", "bucket_start", "cell_lat", "cell_lng", *CELL_FIELDS, "updated_at"
+)
+
+# Columns replayed from the log (attribute names match StockEvent for aggregate())
+EVENT_COLUMNS = (
+    StockEvent.tenant_id, StockEvent.product_id, StockEvent.operation, StockEvent.delta,
+    StockEvent.reason, StockEvent.amount, StockEvent.created_at,
+    StockEvent.location_lat, StockEvent.location_lng, StockEvent.lamport_ts,
+)
+
+
+def plan_partitions(
+    session: Session,
+    tenant_id: Optional[UUID] = None,
+    partition_events: int = DEFAULT_PARTITION_EVENTS,
+    archive: Optional[ArchiveStore] = None
+) -> List[Tuple[UUID, List[UUID], int]]:
+    """
+    Split the log (and its archived part) into (tenant, products, event count)
+    partitions of about partition_events events. A partition never spans
+    tenants (RLS context is per tenant); a product is never split.
+    """
+    statement = select(StockEvent.tenant_id, StockEvent.product_id, func.count()).where(
+        StockEvent.is_deleted == False
+    ).group_by(StockEvent.tenant_id, StockEvent.product_id)
+    if tenant_id:
+        statement = statement.where(StockEvent.tenant_id == tenant_id)
+
+    counts: Dict[UUID, Dict[UUID, int]] = {}
+    for tid, product_id, events in session.exec(statement).all():
+        counts.setdefault(tid, {})[product_id] = events
+
+    if archive:
+        for tid in ([tenant_id] if tenant_id else archive.tenants()):
+            for product_id, events in archive.product_counts(tid).items():
+                products = counts.setdefault(tid, {})
+                products[product_id] = products.get(product_id, 0) + events
+
+    by_tenant = {tid: list(products.items()) for tid, products in counts.items()}
+
+    partitions = []
+    for tid, products in by_tenant.items():
+        current: List[UUID] = []
+        size = 0
+        # Largest products first, so the biggest partitions start early
+        for product_id, events in sorted(products, key=lambda p: -p[1]):
+            if current and size + events > partition_events:
+                partitions.append((tid, current, size))
+                current, size = [], 0
+            current.append(product_id)
+            size += events
+        if current:
+            partitions.append((tid, current, size))
+
+    return sorted(partitions, key=lambda p: -p[2])
+
+
+def _replay(
+    session: Session,
+    tenant_id: UUID,
+    product_ids: List[UUID],
+    chunk_size: int,
+    stock: bool,
+    archive: Optional[ArchiveStore] = None
+) -> Dict:
+    """Replay one partition (archived events first) inside the session's transaction."""
+    for projection in (StockRollup, SalesHeatmapCell):
+        session.exec(delete(projection).where(
+            projection.tenant_id == tenant_id,
+            projection.product_id.in_(product_ids)
+        ))
+
+    writer = BulkWriter(session, StockRollup.__table__, ROLLUP_COLUMNS, chunk_size)
+    cell_writer = BulkWriter(session, SalesHeatmapCell.__table__, CELL_COLUMNS, chunk_size)
+    now = datetime.utcnow()
+    stocks: Dict[UUID, Tuple[int, int]] = {}
+    events = 0
+
+    def emit(product_events: List) -> None:
+        for (tid, pid, granularity, start), totals in aggregate(product_events).items():
+            writer.add((uuid4(), tid, pid, granularity, start, *[totals[f] for f in TOTAL_FIELDS], now))
+        # Heatmap cells come from the same events (located sales only)
+        for (tid, pid, geohash, start), totals in aggregate_cells(product_events).items():
+            lat_min, lng_min, lat_max, lng_max = bounds(geohash)
+            cell_writer.add((
+                uuid4(), tid, pid, geohash, start, (lat_min + lat_max) / 2, (lng_min + lng_max) / 2,
+                *[totals[f] for f in CELL_FIELDS], now
+            ))
+
+    def apply_stock(event) -> None:
+        value, _ = stocks.get(event.product_id, (0, 0))
+        value = event.delta if event.operation == "SET" else value + event.delta
+        # The replayed stock is as of the product's last event
+        stocks[event.product_id] = (value, event.lamport_ts)
+
+    def replay(group: List[UUID], archived: Dict[UUID, List]) -> int:
+        """Replay a group of products; archived events precede the hot ones of their product."""
+        def start_product(product_id: UUID) -> List:
+            cold = archived.pop(product_id, [])
+            if stock:
+                for event in cold:
+                    apply_stock(event)
+            return cold
+
+        # Server-side cursor: rows arrive chunk_size at a time, ordered per product
+        result = session.connection().execution_options(stream_results=True, yield_per=chunk_size).execute(
+            select(*EVENT_COLUMNS).where(
+                StockEvent.tenant_id == tenant_id,
+                StockEvent.product_id.in_(group),
+                StockEvent.is_deleted == False
+            ).order_by(StockEvent.product_id, StockEvent.lamport_ts)
+        )
+
+        # Buckets are emitted per product, so memory is bounded by one product
+        replayed = 0
+        current: List = []
+        for chunk in result.partitions():
+            for event in chunk:
+                if not current or event.product_id != current[-1].product_id:
+                    if current:
+                        emit(current)
+                    current = start_product(event.product_id)
+                    replayed += len(current)
+                current.append(event)
+
+                if stock:
+                    apply_stock(event)
+            replayed += len(chunk)
+        if current:
+            emit(current)
+
+        # Products whose events are all archived
+        for product_id in list(archived):
+            cold = start_product(product_id)
+            replayed += len(cold)
+            emit(cold)
+        return replayed
+
+    # The archive is read once per group, keeping only the group's events in memory
+    groups = [(list(product_ids), False)]
+    if archive:
+        groups = _archive_groups(product_ids, archive.product_counts(tenant_id, product_ids), ARCHIVE_GROUP_EVENTS)
+
+    for group, has_archived in groups:
+        archived: Dict[UUID, List] = {}
+        if has_archived:
+            for event in archive.events(tenant_id, group):
+                if not event.is_deleted:
+                    archived.setdefault(event.product_id, []).append(event)
+        events += replay(group, archived)
+    writer.flush()
+    cell_writer.flush()
+
+    if stock:
+        _write_stock(session, tenant_id, stocks, chunk_size)
+
+    return {"events": events, "buckets": writer.written, "cells": cell_writer.written, "products": len(product_ids)}
+
+
+def _archive_groups(
+    product_ids: List[UUID],
+    counts: Dict[UUID, int],
+    group_events: int
+) -> List[Tuple[List[UUID], bool]]:
+    """
+    (products, has archived events) groups of a partition: the products without
+    archived events together, the others in groups of about group_events
+    archived events (a product is never split).
+    """
+    hot = [p for p in product_ids if not counts.get(p)]
+    groups = [(hot, False)] if hot else []
+
+    current: List[UUID] = []
+    size = 0
+    for product_id in product_ids:
+        events = counts.get(product_id, 0)
+        if not events:
+            continue
+        if current and size + events > group_events:
+            groups.append((current, True))
+            current, size = [], 0
+        current.append(product_id)
+        size += events
+    if current:
+        groups.append((current, True))
+    return groups
+
+
+def _write_stock(
+    session: Session,
+    tenant_id: UUID,
+    stocks: Dict[UUID, Tuple[int, int]],
+    chunk_size: int
+) -> None:
+    """
+    Set Product.current_stock from the replayed (stock, last event Lamport)
+    values (COPY + UPDATE ... FROM on Postgres). The field's Lamport stamp is
+    raised to the last replayed event, so stock curves only apply later events.
+    """
+    now = datetime.utcnow()
+
+    if session.get_bind().dialect.name != "postgresql":
+        products = session.exec(
+            select(Product).where(Product.tenant_id == tenant_id, Product.id.in_(list(stocks)))
+        ).all()
+        for product in products:
+            value, lamport = stocks[product.id]
+            product.current_stock = value
+            product.field_lamports = {
+                **(product.field_lamports or {}),
+                "current_stock": max(stock_lamport(product), lamport)
+            }
+            product.updated_at = now
+            session.add(product)
+        return
+
+    connection = session.connection()
+    connection.exec_driver_sql(
+        "CREATE TEMP TABLE rebuild_stock (product_id uuid, stock integer, lamport bigint) ON COMMIT DROP"
+    )
+
+    temp = table("rebuild_stock", column("product_id"), column("stock"), column("lamport"))
+    writer = BulkWriter(session, temp, ("product_id", "stock", "lamport"), chunk_size)
+    for product_id, (value, lamport) in stocks.items():
+        writer.add((product_id, value, lamport))
+    writer.flush()
+
+    connection.exec_driver_sql(
+        "UPDATE products SET current_stock = s.stock, updated_at = %(now)s, "
+        "field_lamports = (COALESCE(products.field_lamports::jsonb, '{}'::jsonb) || jsonb_build_object("
+        "'current_stock', GREATEST(COALESCE((products.field_lamports->>'current_stock')::bigint, "
+        "products.lamport_ts), s.lamport)))::json "
+        "FROM rebuild_stock s WHERE products.id = s.product_id AND products.tenant_id = %(tenant)s",
+        {"now": now, "tenant": str(tenant_id)}
+    )
+
+
+_engines: Dict[str, object] = {}
+
+
+def rebuild_partition(
+    database_url: str,
+    tenant_id: UUID,
+    product_ids: List[UUID],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    stock: bool = False,
+    archive_path: Optional[str] = None
+) -> Dict:
+    """Rebuild one partition atomically (runs in a worker process)."""
+    engine = _engines.get(database_url)
+    if engine is None:
+        engine = _engines[database_url] = create_engine(database_url)
+
+    start = time.perf_counter()
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        with Session(engine) as session:
+            if engine.dialect.name == "postgresql":
+                # One snapshot for the replay; a concurrent rollup write makes it fail and retry
+                session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            set_tenant_context(session, tenant_id)
+            try:
+                archive = ArchiveStore(archive_path) if archive_path else None
+                stats = _replay(session, tenant_id, product_ids, chunk_size, stock, archive)
+                session.commit()
+                break
+            except (OperationalError, IntegrityError) as e:
+                session.rollback()
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                print(f"[WARN] Partition of tenant {tenant_id} retried ({attempt}): {e.orig}")
+
+    stats.update(tenant_id=str(tenant_id), seconds=round(time.perf_counter() - start, 3))
+    return stats
+
+
+def rebuild(
+    database_url: Optional[str] = None,
+    tenant_id: Optional[UUID] = None,
+    workers: int = DEFAULT_WORKERS,
+    partition_events: int = DEFAULT_PARTITION_EVENTS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    stock: bool = False,
+    archive_path: Optional[str] = ARCHIVE_PATH
+) -> Dict:
+    """
+    Plan partitions and replay them in a process pool (in-process with 1 worker).
+    Archived events under archive_path are replayed too, when it exists.
+    Without database_url every shard is rebuilt, each tenant on its own shard.
+    """
+    archive = ArchiveStore(archive_path) if archive_path else None
+    if archive and not archive.exists():
+        archive = archive_path = None
+
+    router = None if database_url else get_shard_router()
+    if database_url:
+        shard_urls = {DEFAULT_SHARD: database_url}
+    else:
+        shard_urls = {
+            name: shard_engine.url.render_as_string(hide_password=False)
+            for name, shard_engine in shard_engines().items()
+        }
+
+    partitions = []
+    for shard, url in shard_urls.items():
+        planner = create_engine(url)
+        with Session(planner) as session:
+            planned = plan_partitions(session, tenant_id, partition_events, archive)
+        planner.dispose()
+
+        for tid, products, size in planned:
+            if router:
+                # Rows left behind by a move without --purge, or archived events of another shard's tenant
+                placed, status = router.placement(tid)
+                if placed != shard:
+                    continue
+                if status == "MOVING":
+                    print(f"[WARN] Tenant {tid} is moving off shard {shard}; skipped")
+                    continue
+            partitions.append((url, tid, products, size))
+    partitions.sort(key=lambda p: -p[3])
+
+    totals = {"partitions": len(partitions), "events": 0, "buckets": 0, "cells": 0, "products": 0}
+    args = [(url, tid, products, chunk_size, stock, archive_path) for url, tid, products, _ in partitions]
+
+    def collect(stats: Dict) -> None:
+        for key in ("events", "buckets", "cells", "products"):
+            totals[key] += stats[key]
+        print(f"[INFO] Rebuilt tenant={stats['tenant_id']} products={stats['products']} "
+              f"events={stats['events']} buckets={stats['buckets']} cells={stats['cells']} in {stats['seconds']}s")
+
+    if workers <= 1 or len(partitions) <= 1:
+        for arguments in args:
+            collect(rebuild_partition(*arguments))
+    else:
+        # spawn: workers must not inherit the parent's pooled connections
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            for stats in pool.map(rebuild_partition, *zip(*args)):
+                collect(stats)
+
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild rollups, heatmap cells (and stock) from the event log")
+    parser.add_argument("--tenant", type=UUID, help="Only rebuild this tenant")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--partition-events", type=int, default=DEFAULT_PARTITION_EVENTS)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--stock", action="store_true", help="Also recompute Product.current_stock")
+    parser.add_argument("--archive", default=ARCHIVE_PATH, help="Archive root to replay too (see app.archive)")
+    args = parser.parse_args()
+
+    if args.stock and SYNC_STOCK_MODE == "CRDT":
+        parser.error("--stock replays events; in CRDT mode stock is projected from the counters")
+
+    start = time.perf_counter()
+    totals = rebuild(
+        tenant_id=args.tenant,
+        workers=args.workers,
+        partition_events=args.partition_events,
+        chunk_size=args.chunk_size,
+        stock=args.stock,
+        archive_path=args.archive
+    )
+    elapsed = time.perf_counter() - start
+    print(f"[INFO] Rebuild done: {totals} in {elapsed:.1f}s "
+          f"({totals['events'] / max(elapsed, 1e-9):,.0f} events/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Resumable chunked upload of receipt photos.
+On 2G links a photo upload is often cut. Devices upload it in small chunks
+instead, each acknowledged once durable, and resume after the last
+acknowledged chunk:
+
+1. POST /receipts/uploads {sha256, size}: starts (or resumes) the upload of a
+   photo and answers the chunk size and next_chunk. A photo the tenant
+   already has is answered COMPLETE at once.
+2. PUT /receipts/uploads/{id}/chunks/{index}: one chunk, in order.
+3. POST /receipts/uploads/{id}/complete: assembles and verifies the photo.
+
+Chunks and photos are stored by SHA-256 under RECEIPT_STORAGE_PATH, per tenant,
+so a chunk or photo sent twice is stored once. PendingPayment.receipt_photo
+only references finished photos, as "sha256:<hex>".
+"""
+
+from datetime import datetime
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, Optional
+from uuid import UUID
+import os
+import re
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from .models import ReceiptUpload
+
+RECEIPT_STORAGE_PATH = os.getenv("RECEIPT_STORAGE_PATH", "receipts")
+RECEIPT_CHUNK_SIZE = int(os.getenv("RECEIPT_CHUNK_SIZE", str(64 * 1024)))
+RECEIPT_MAX_BYTES = int(os.getenv("RECEIPT_MAX_BYTES", str(10 * 1024 * 1024)))
+
+REFERENCE_PREFIX = "sha256:"
+SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ChunkRejected(Exception):
+    """A chunk that cannot be acknowledged; the device resumes at next_chunk."""
+
+    def __init__(self, reason: str, next_chunk: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.next_chunk = next_chunk
+
+
+def reference(digest: str) -> str:
+    """receipt_photo value of a finished photo."""
+    return f"{REFERENCE_PREFIX}{digest}"
+
+
+def digest_of(receipt_photo: Optional[str]) -> Optional[str]:
+    """SHA-256 of a receipt_photo reference (None for other values, e.g. legacy URLs)."""
+    if not receipt_photo or not receipt_photo.startswith(REFERENCE_PREFIX):
+        return None
+    digest = receipt_photo[len(REFERENCE_PREFIX):]
+    return digest if SHA256_HEX.match(digest) else None
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(path.name + ".tmp")
+    with open(temp, "wb") as output:
+        output.write(data)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temp, path)
+
+
+class ReceiptStore:
+    """Content-addressed chunks and photos of one root directory."""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = Path(root or RECEIPT_STORAGE_PATH)
+
+    def _path(self, tenant_id: UUID, kind: str, digest: str) -> Path:
+        return self.root / f"tenant={tenant_id}" / kind / digest[:2] / digest
+
+    def chunk_path(self, tenant_id: UUID, digest: str) -> Path:
+        return self._path(tenant_id, "chunks", digest)
+
+    def photo_path(self, tenant_id: UUID, digest: str) -> Path:
+        return self._path(tenant_id, "photos", digest)
+
+    def has_photo(self, tenant_id: UUID, digest: str) -> bool:
+        return self.photo_path(tenant_id, digest).is_file()
+
+    def put_chunk(self, tenant_id: UUID, data: bytes) -> str:
+        """Store a chunk durably (once per content) and return its SHA-256."""
+        digest = sha256(data).hexdigest()
+        path = self.chunk_path(tenant_id, digest)
+        if not path.is_file():
+            _write_atomic(path, data)
+        return digest
+
+    def assemble(self, tenant_id: UUID, upload: ReceiptUpload) -> bool:
+        """
+        Concatenate the chunks into the photo if they hash to the declared
+        SHA-256. Raises ChunkRejected (upload again) if a chunk file is gone.
+        """
+        path = self.photo_path(tenant_id, upload.sha256)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(path.name + ".tmp")
+
+        digest, size = sha256(), 0
+        try:
+            with open(temp, "wb") as output:
+                for chunk_digest in upload.chunk_hashes:
+                    data = self.chunk_path(tenant_id, chunk_digest).read_bytes()
+                    digest.update(data)
+                    size += len(data)
+                    output.write(data)
+                output.flush()
+                os.fsync(output.fileno())
+        except FileNotFoundError:
+            temp.unlink(missing_ok=True)
+            raise ChunkRejected("A chunk of the photo is missing: upload it again", 0)
+
+        if digest.hexdigest() != upload.sha256 or size != upload.size:
+            temp.unlink()
+            return False
+
+        os.replace(temp, path)
+        return True
+
+    def discard_chunks(self, tenant_id: UUID, digests) -> None:
+        for digest in digests:
+            self.chunk_path(tenant_id, digest).unlink(missing_ok=True)
+
+
+class ReceiptUploads:
+    """Upload sessions of receipt photos."""
+
+    def __init__(self, session: Session, store: Optional[ReceiptStore] = None):
+        self.session = session
+        self.store = store or ReceiptStore()
+
+    def get(self, tenant_id: UUID, upload_id: UUID) -> Optional[ReceiptUpload]:
+        upload = self.session.get(ReceiptUpload, upload_id)
+        return upload if upload and upload.tenant_id == tenant_id else None
+
+    def start(
+        self,
+        tenant_id: UUID,
+        digest: str,
+        size: int,
+        content_type: str = "image/jpeg",
+        chunk_size: Optional[int] = None
+    ) -> ReceiptUpload:
+        """Start the upload of a photo, or return the existing one to resume it."""
+        digest = digest.lower()
+        if not SHA256_HEX.match(digest):
+            raise ValueError("sha256 must be 64 hex characters")
+        if not 0 < size <= RECEIPT_MAX_BYTES:
+            raise ValueError(f"size must be between 1 and {RECEIPT_MAX_BYTES} bytes")
+
+        existing = self.find(tenant_id, digest)
+        if existing:
+            if existing.size != size:
+                raise ValueError("size does not match the earlier upload of this sha256")
+            return existing
+
+        upload = ReceiptUpload(
+            tenant_id=tenant_id,
+            sha256=digest,
+            size=size,
+            content_type=content_type,
+            # The device may ask for smaller chunks on a poor link, never larger ones
+            chunk_size=min(chunk_size or RECEIPT_CHUNK_SIZE, RECEIPT_CHUNK_SIZE),
+            # Photo already stored (e.g. uploaded from another device): nothing to send
+            status="COMPLETE" if self.store.has_photo(tenant_id, digest) else "UPLOADING"
+        )
+        self.session.add(upload)
+        try:
+            self.session.commit()
+        except IntegrityError:
+            # Started concurrently by another request: resume that one
+            self.session.rollback()
+            return self.start(tenant_id, digest, size, content_type, chunk_size)
+
+        self.session.refresh(upload)
+        return upload
+
+    def find(self, tenant_id: UUID, digest: str) -> Optional[ReceiptUpload]:
+        """Upload of a photo by its SHA-256."""
+        return self.session.exec(
+            select(ReceiptUpload).where(ReceiptUpload.tenant_id == tenant_id, ReceiptUpload.sha256 == digest)
+        ).first()
+
+    def put_chunk(
+        self,
+        tenant_id: UUID,
+        upload_id: UUID,
+        index: int,
+        data: bytes,
+        declared: Optional[str] = None
+    ) -> Optional[ReceiptUpload]:
+        """
+        Acknowledge chunk `index` once it is durable. Chunks come in order; a
+        chunk already acknowledged is accepted again (its ack may have been
+        lost), anything else is rejected with the index to resume at.
+        """
+        upload = self.get(tenant_id, upload_id)
+        if upload is None:
+            return None
+
+        received = len(upload.chunk_hashes)
+        if upload.status == "COMPLETE":
+            raise ChunkRejected("Upload already complete", received)
+
+        digest = sha256(data).hexdigest()
+        if declared and declared.lower() != digest:
+            raise ChunkRejected("Chunk does not match its X-Chunk-SHA256 (corrupted in transit)", received)
+
+        if index < received:
+            if upload.chunk_hashes[index] != digest:
+                raise ChunkRejected(f"Chunk {index} differs from the acknowledged one", received)
+            return upload
+        if index > received:
+            raise ChunkRejected(f"Chunks must be sent in order: expected {received}", received)
+
+        total = sum(self.store.chunk_path(tenant_id, d).stat().st_size for d in upload.chunk_hashes) + len(data)
+        if not data or len(data) > upload.chunk_size or total > upload.size:
+            raise ChunkRejected(f"Chunks must be 1 to {upload.chunk_size} bytes within the declared size", received)
+
+        self.store.put_chunk(tenant_id, data)
+        upload.chunk_hashes = [*upload.chunk_hashes, digest]
+        upload.updated_at = datetime.utcnow()
+        self.session.add(upload)
+        self.session.commit()
+        self.session.refresh(upload)
+        return upload
+
+    def complete(self, tenant_id: UUID, upload_id: UUID) -> Optional[ReceiptUpload]:
+        """Assemble and verify the photo; a failed verification restarts the upload."""
+        upload = self.get(tenant_id, upload_id)
+        if upload is None or upload.status == "COMPLETE":
+            return upload
+
+        # Chunks still needed by other unfinished uploads of the tenant are kept
+        in_use = set()
+        for hashes in self.session.exec(
+            select(ReceiptUpload.chunk_hashes).where(
+                ReceiptUpload.tenant_id == tenant_id,
+                ReceiptUpload.status == "UPLOADING",
+                ReceiptUpload.id != upload.id
+            )
+        ).all():
+            in_use.update(hashes)
+
+        try:
+            if not self.store.assemble(tenant_id, upload):
+                raise ChunkRejected("Photo does not match the declared sha256 and size: upload it again", 0)
+        except ChunkRejected:
+            self.store.discard_chunks(tenant_id, set(upload.chunk_hashes) - in_use)
+            upload.chunk_hashes = []
+            self.session.add(upload)
+            self.session.commit()
+            raise
+
+        self.store.discard_chunks(tenant_id, set(upload.chunk_hashes) - in_use)
+
+        upload.status = "COMPLETE"
+        upload.updated_at = datetime.utcnow()
+        self.session.add(upload)
+        self.session.commit()
+        self.session.refresh(upload)
+        return upload
+
+
+def upload_view(upload: ReceiptUpload) -> Dict:
+    """Response body of an upload: where to resume, or the reference once complete."""
+    view = {
+        "upload_id": str(upload.id),
+        "status": upload.status,
+        "sha256": upload.sha256,
+        "size": upload.size,
+        "chunk_size": upload.chunk_size,
+        "next_chunk": len(upload.chunk_hashes),
+    }
+    if upload.status == "COMPLETE":
+        view["receipt_photo"] = reference(upload.sha256)
+    return view
@@ -0,0 +1,238 @@
+"""
+Offline payment reconciliation against POS and bank settlement files.
+Payments taken offline (POS_OFFLINE, TRANSFER) wait in
+reconciliation_status="PENDING" until the provider's settlement confirms them.
+The job reads a settlement export (CSV or JSON) and matches it against all
+pending POS_OFFLINE and TRANSFER payments of the tenant at once (cash is
+never matched):
+
+1. hash join on pos_transaction_id, then checked against amount and time window;
+2. rows without a transaction id (bank transfers) join pending payments without
+   one on the amount in cents, nearest in time within the window.
+
+Matches become CONFIRMED; a transaction id whose amount or time disagrees
+becomes FAILED for the producer to review. Statuses are written with one
+UPDATE per chunk of payments, so thousands of payments reconcile in one pass.
+Each payment written gets a new server Lamport stamp and its refreshed content
+hash in that UPDATE: a device pushing its older copy of the payment loses the
+last-writer-wins check instead of reverting the status.
+
+Usage:
+    python -m app.reconciliation --tenant UUID settlement.csv [--window-hours 72] [--dry-run]
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+from uuid import UUID
+import argparse
+import csv
+import json
+import os
+
+from sqlalchemy import bindparam, update
+from sqlmodel import Session, select
+
+from .database import set_tenant_context
+from .models import HASH_EXCLUDED_FIELDS, PendingPayment, content_hash_of
+from .rollups import as_utc
+from .shards import engine_for_tenant
+from .sync_engine import AgrotourSyncEngine
+
+# Settlements may arrive days after an offline sale
+RECONCILE_WINDOW_HOURS = float(os.getenv("RECONCILE_WINDOW_HOURS", "72"))
+
+# Settlement file column names, first match wins
+FIELD_ALIASES = {
+    # Not a bare "id": exports number their rows with it, which is no transaction id
+    "transaction_id": ("transaction_id", "pos_transaction_id", "operation_id"),
+    "amount": ("amount", "transaction_amount", "gross_amount", "total"),
+    "settled_at": ("settled_at", "date_approved", "date", "created_at", "timestamp"),
+    "status": ("status", "state"),
+}
+
+# Payment methods settled by a provider; cash is never reconciled
+RECONCILED_METHODS = ("POS_OFFLINE", "TRANSFER")
+
+# Settlement statuses of money that never arrived
+FAILED_STATUSES = {"FAILED", "DECLINED", "REJECTED", "REVERSED", "REFUNDED", "CANCELLED", "CHARGEBACK"}
+
+UPDATE_CHUNK_SIZE = 1_000
+
+
+@dataclass
+class Settlement:
+    """One settled (or failed) transaction of a settlement file."""
+
+    transaction_id: Optional[str]
+    cents: int
+    settled_at: datetime
+    failed: bool
+
+
+def _field(row: Dict, name: str):
+    for alias in FIELD_ALIASES[name]:
+        if row.get(alias) not in (None, ""):
+            return row[alias]
+    return None
+
+
+def _settlement(row: Dict) -> Settlement:
+    transaction_id = _field(row, "transaction_id")
+    amount = _field(row, "amount")
+    settled_at = _field(row, "settled_at")
+    if amount is None or settled_at is None:
+        raise ValueError(f"Settlement row without amount or date: {row}")
+
+    return Settlement(
+        transaction_id=str(transaction_id).strip() if transaction_id is not None else None,
+        cents=round(float(amount) * 100),
+        settled_at=as_utc(datetime.fromisoformat(str(settled_at).replace("Z", "+00:00"))),
+        failed=str(_field(row, "status") or "").upper() in FAILED_STATUSES,
+    )
+
+
+def read_settlements(path: Path) -> Iterator[Settlement]:
+    """
+    Rows of a settlement export: CSV with a header row, a JSON list, or a JSON
+    object with the list under "results" or "transactions" (provider APIs).
+    """
+    if path.suffix.lower() == ".json":
+        with open(path) as settlement_file:
+            data = json.load(settlement_file)
+        if isinstance(data, dict):
+            data = data.get("results", data.get("transactions", []))
+        for row in data:
+            yield _settlement(row)
+        return
+
+    with open(path, newline="") as settlement_file:
+        for row in csv.DictReader(settlement_file):
+            yield _settlement(row)
+
+
+class PaymentReconciler:
+    """Matches the pending payments of a tenant against settlements."""
+
+    def __init__(self, session: Session, window_hours: float = RECONCILE_WINDOW_HOURS):
+        self.session = session
+        self.window = timedelta(hours=window_hours)
+
+    def reconcile(self, tenant_id: UUID, settlements: Iterable[Settlement], dry_run: bool = False) -> Dict:
+        # Build side: every pending payment of the tenant, in one query
+        pending = self.session.exec(
+            select(PendingPayment.id, PendingPayment.pos_transaction_id, PendingPayment.amount, PendingPayment.created_at)
+            .where(
+                PendingPayment.tenant_id == tenant_id,
+                PendingPayment.reconciliation_status == "PENDING",
+                PendingPayment.payment_method.in_(RECONCILED_METHODS),
+                PendingPayment.is_deleted == False
+            )
+        ).all()
+
+        by_transaction = {}
+        by_cents = defaultdict(list)
+        for payment_id, transaction_id, amount, created_at in pending:
+            if transaction_id:
+                by_transaction[transaction_id.strip()] = (payment_id, round(amount * 100), created_at)
+            else:
+                by_cents[round(amount * 100)].append((payment_id, created_at))
+
+        confirmed: List[UUID] = []
+        failed: List[UUID] = []
+        settlements_read = unmatched = 0
+
+        # Probe side: the settlement rows, streamed
+        for settlement in settlements:
+            settlements_read += 1
+
+            if settlement.transaction_id:
+                match = by_transaction.pop(settlement.transaction_id, None)
+                if match is None:
+                    unmatched += 1
+                    continue
+                payment_id, cents, created_at = match
+                agrees = cents == settlement.cents and abs(settlement.settled_at - created_at) <= self.window
+                (failed if settlement.failed or not agrees else confirmed).append(payment_id)
+                continue
+
+            # No transaction id: nearest pending payment of the same amount
+            candidates = [
+                (abs(settlement.settled_at - created_at), index)
+                for index, (_, created_at) in enumerate(by_cents.get(settlement.cents, []))
+                if abs(settlement.settled_at - created_at) <= self.window
+            ]
+            if not candidates or settlement.failed:
+                unmatched += 1
+                continue
+            payment_id, _ = by_cents[settlement.cents].pop(min(candidates)[1])
+            confirmed.append(payment_id)
+
+        if not dry_run:
+            self._set_status(confirmed, "CONFIRMED")
+            self._set_status(failed, "FAILED")
+            self.session.commit()
+
+        return {
+            "status": "dry_run" if dry_run else "reconciled",
+            "settlements": settlements_read,
+            "confirmed": len(confirmed),
+            "failed": len(failed),
+            "unmatched_settlements": unmatched,
+            "still_pending": len(pending) - len(confirmed) - len(failed),
+        }
+
+    def _set_status(self, payment_ids: List[UUID], status: str) -> None:
+        """Chunked status update (bounded IN lists), stamping each row after the server clock."""
+        now = datetime.utcnow()
+        lamport = AgrotourSyncEngine(self.session).server_lamport
+        changes = {"reconciliation_status": status, "reconciled": status == "CONFIRMED", "reconciled_at": now}
+        table = PendingPayment.__table__
+
+        for start in range(0, len(payment_ids), UPDATE_CHUNK_SIZE):
+            payments = self.session.exec(
+                select(PendingPayment).where(PendingPayment.id.in_(payment_ids[start:start + UPDATE_CHUNK_SIZE]))
+            ).all()
+
+            rows = []
+            for payment in payments:
+                lamport += 1
+                business = {**payment.model_dump(exclude=HASH_EXCLUDED_FIELDS), **changes}
+                rows.append({"payment_id": payment.id, "lamport": lamport, "hash": content_hash_of(business)})
+
+            # One executemany UPDATE: the per-row stamp and hash are bound parameters
+            self.session.connection().execute(
+                update(table)
+                .where(table.c.id == bindparam("payment_id"))
+                .values(
+                    **changes,
+                    lamport_ts=bindparam("lamport"),
+                    content_hash=bindparam("hash"),
+                    synced_at=now,
+                    updated_at=now,
+                    version=table.c.version + 1
+                ),
+                rows
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile pending payments against a settlement file")
+    parser.add_argument("settlement_file", type=Path, help="CSV or JSON settlement export")
+    parser.add_argument("--tenant", type=UUID, required=True)
+    parser.add_argument("--window-hours", type=float, default=RECONCILE_WINDOW_HOURS)
+    parser.add_argument("--dry-run", action="store_true", help="Match without writing")
+    args = parser.parse_args()
+
+    with Session(engine_for_tenant(args.tenant)) as session:
+        set_tenant_context(session, args.tenant)
+        result = PaymentReconciler(session, args.window_hours).reconcile(
+            args.tenant, read_settlements(args.settlement_file), args.dry_run
+        )
+    print(f"[INFO] Reconciliation tenant={args.tenant} {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Read-replica routing for the sync read paths.
+When DATABASE_REPLICA_URLS is set, /sync/pull and /sync/conflicts read from
+streaming replicas instead of the primary. Routing is lag-aware: a replica is
+only used if it has replayed the tenant's events up to the Lamport timestamp
+the client already knows, so a device never reads older state than it has
+seen. Otherwise the read falls back to the primary.
+
+Replica sessions get the same RLS context as primary sessions
+(set_tenant_context); the policies replicate with the schema.
+"""
+
+from contextlib import contextmanager
+from itertools import count
+from typing import Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+import os
+import time
+
+from sqlalchemy import func
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, create_engine, select
+
+from .database import set_tenant_context
+from .models import StockEvent
+from .shards import on_default_shard
+
+DATABASE_REPLICA_URLS = [url for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# A replica head read this recently is reused. A cached head can only be lower
+# than the real one, so staleness can only cause a fallback, never a stale read.
+REPLICA_HEAD_TTL_SECONDS = float(os.getenv("REPLICA_HEAD_TTL_SECONDS", "1"))
+
+
+class ReplicaRouter:
+    """Round-robin over replicas, skipping the ones behind the client."""
+
+    def __init__(self, engines: List[Engine], head_ttl: float = REPLICA_HEAD_TTL_SECONDS):
+        self.engines = engines
+        self.head_ttl = head_ttl
+        self._turn = count()
+        self._heads: Dict[Tuple[int, UUID], Tuple[float, int]] = {}
+
+    def replica_head(self, index: int, session: Session, tenant_id: UUID) -> int:
+        """Highest Lamport timestamp of the tenant replayed on a replica."""
+        key = (index, tenant_id)
+        cached = self._heads.get(key)
+        if cached and time.monotonic() - cached[0] < self.head_ttl:
+            return cached[1]
+
+        head = session.exec(
+            select(func.max(StockEvent.lamport_ts)).where(StockEvent.tenant_id == tenant_id)
+        ).first() or 0
+        self._heads[key] = (time.monotonic(), head)
+        return head
+
+    def _open(self, tenant_id: UUID, min_lamport: int) -> Optional[Session]:
+        """A tenant-bound session on the next replica caught up to min_lamport."""
+        start = next(self._turn)
+
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            session = Session(self.engines[index])
+            try:
+                set_tenant_context(session, tenant_id)
+                if self.replica_head(index, session, tenant_id) >= min_lamport:
+                    return session
+            except SQLAlchemyError as e:
+                print(f"[WARN] Replica {index} unavailable: {e}")
+            session.close()
+
+        return None
+
+    @contextmanager
+    def read_session(self, primary: Session, tenant_id: UUID, min_lamport: int) -> Iterator[Session]:
+        session = self._open(tenant_id, min_lamport)
+        if session is None:
+            yield primary
+            return
+
+        try:
+            yield session
+        finally:
+            session.close()
+
+
+_router: Optional[ReplicaRouter] = None
+
+
+def get_replica_router() -> Optional[ReplicaRouter]:
+    """Process-wide router, or None when no replica is configured."""
+    global _router
+
+    if _router is None and DATABASE_REPLICA_URLS:
+        _router = ReplicaRouter([
+            create_engine(url.strip(), pool_pre_ping=True) for url in DATABASE_REPLICA_URLS
+        ])
+
+    return _router
+
+
+@contextmanager
+def read_session(primary: Session, tenant_id: Optional[UUID], min_lamport: int = 0) -> Iterator[Session]:
+    """
+    Session for a read-only query: a replica that has caught up to
+    min_lamport, or the primary session.
+    """
+    router = get_replica_router()
+    # Replicas follow the default database: tenants moved to another shard read their shard
+    if router is None or tenant_id is None or not on_default_shard(tenant_id):
+        yield primary
+        return
+
+    with router.read_session(primary, tenant_id, min_lamport) as session:
+        yield session
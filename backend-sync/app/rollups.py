@@ -0,0 +1,256 @@
+"""
+Time-bucketed stock and sales rollups.
+Every accepted StockEvent is folded into an HOUR and a DAY bucket of its
+product (UTC, by event creation time) in the same transaction that stores it.
+Sales velocity and stock curves are then read from a handful of rollup rows
+instead of scanning the event log; weeks are summed from days.
+
+Stock curves are walked back from the product's stock now. The counters keep
+Product.current_stock current in CRDT mode. In EVENTS mode it is a snapshot
+(the last product push, or app.rebuild --stock) as of the Lamport stamp of
+that write: the logged events after the stamp are applied on top of it.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from .crdt import SYNC_STOCK_MODE
+from .database import dialect_insert
+from .models import Product, StockEvent, StockRollup
+
+# Stored granularities; WEEK is derived from DAY
+STORED_GRANULARITIES = ("HOUR", "DAY")
+GRANULARITIES = ("HOUR", "DAY", "WEEK")
+
+TOTAL_FIELDS = ("units_in", "units_out", "net_delta", "sales_units", "sales_amount", "event_count")
+
+
+def stock_lamport(product: Product) -> int:
+    """Lamport stamp of the last write of Product.current_stock."""
+    return (product.field_lamports or {}).get("current_stock", product.lamport_ts)
+
+
+def as_utc(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """Naive UTC, like the stored timestamps (query parameters may carry an offset)."""
+    if timestamp is None or timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """Start of the bucket containing timestamp."""
+    hour = timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == "HOUR":
+        return hour
+
+    day = hour.replace(hour=0)
+    if granularity == "DAY":
+        return day
+
+    return day - timedelta(days=day.weekday())
+
+
+def event_totals(event: StockEvent) -> Dict:
+    """Contribution of one event to its buckets."""
+    delta = 0 if event.operation == "SET" else event.delta
+    is_sale = event.reason == "SALE"
+
+    return {
+        "units_in": max(delta, 0),
+        "units_out": max(-delta, 0),
+        "net_delta": delta,
+        "sales_units": abs(event.delta) if is_sale else 0,
+        "sales_amount": (event.amount or 0.0) if is_sale else 0.0,
+        "event_count": 1,
+    }
+
+
+def aggregate(events: Iterable[StockEvent]) -> Dict[Tuple, Dict]:
+    """Sum events per (tenant, product, granularity, bucket)."""
+    buckets: Dict[Tuple, Dict] = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, 0))
+
+    for event in events:
+        totals = event_totals(event)
+        for granularity in STORED_GRANULARITIES:
+            key = (event.tenant_id, event.product_id, granularity, bucket_start(event.created_at, granularity))
+            bucket = buckets[key]
+            for field in TOTAL_FIELDS:
+                bucket[field] += totals[field]
+
+    return buckets
+
+
+class RollupStore:
+    """Incremental maintenance and queries of stock_rollups."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def add(self, events: Iterable[StockEvent]) -> None:
+        """
+        Fold accepted events into their buckets with one upsert per bucket.
+        Does not commit: the caller commits together with the events.
+        """
+        insert = dialect_insert(self.session)
+        now = datetime.utcnow()
+
+        for (tenant_id, product_id, granularity, start), totals in aggregate(events).items():
+            statement = insert(StockRollup).values(
+                id=uuid4(),
+                tenant_id=tenant_id,
+                product_id=product_id,
+                granularity=granularity,
+                bucket_start=start,
+                updated_at=now,
+                **totals
+            )
+            incoming = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=["tenant_id", "product_id", "granularity", "bucket_start"],
+                set_={
+                    **{field: getattr(StockRollup, field) + getattr(incoming, field) for field in TOTAL_FIELDS},
+                    "updated_at": incoming.updated_at
+                }
+            )
+            self.session.exec(statement)
+
+    def series(
+        self,
+        tenant_id: UUID,
+        product_id: UUID,
+        granularity: str,
+        since: datetime,
+        until: datetime
+    ) -> List[Dict]:
+        """
+        Non-empty buckets of a product in [since, until), oldest first.
+        Each bucket carries the stock at its end, walked back from the
+        product's stock now (see current_stock) with the net deltas of later
+        buckets.
+        """
+        stored = "HOUR" if granularity == "HOUR" else "DAY"
+
+        rows = self.session.exec(
+            select(StockRollup).where(
+                StockRollup.tenant_id == tenant_id,
+                StockRollup.product_id == product_id,
+                StockRollup.granularity == stored,
+                StockRollup.bucket_start >= bucket_start(since, granularity),
+                StockRollup.bucket_start < until
+            ).order_by(StockRollup.bucket_start)
+        ).all()
+
+        buckets: Dict[datetime, Dict] = {}
+        for row in rows:
+            start = bucket_start(row.bucket_start, granularity)
+            bucket = buckets.setdefault(start, {"bucket_start": start, **dict.fromkeys(TOTAL_FIELDS, 0)})
+            for field in TOTAL_FIELDS:
+                bucket[field] += getattr(row, field)
+
+        # Stock curve: stock now minus everything that happened after each bucket
+        stock = self.current_stock(tenant_id, product_id)
+        if stock is not None:
+            later = self.session.exec(
+                select(func.sum(StockRollup.net_delta)).where(
+                    StockRollup.tenant_id == tenant_id,
+                    StockRollup.product_id == product_id,
+                    StockRollup.granularity == stored,
+                    StockRollup.bucket_start >= until
+                )
+            ).first() or 0
+            stock -= later
+
+        series = list(buckets.values())
+        for bucket in reversed(series):
+            bucket["stock"] = stock
+            if stock is not None:
+                stock -= bucket["net_delta"]
+            bucket["bucket_start"] = bucket["bucket_start"].isoformat()
+
+        return series
+
+    def current_stock(self, tenant_id: UUID, product_id: UUID) -> Optional[int]:
+        """
+        Stock of a product now. In EVENTS mode the snapshot in
+        Product.current_stock is brought forward with the logged events after
+        its stamp (from the last SET among them, if any); only those events
+        of the product are read, through the (tenant, product, lamport) index.
+        """
+        product = self.session.get(Product, product_id)
+        if not product or product.tenant_id != tenant_id:
+            return None
+        if SYNC_STOCK_MODE == "CRDT":
+            return product.current_stock
+
+        def after(lamport: int):
+            return (
+                StockEvent.tenant_id == tenant_id,
+                StockEvent.product_id == product_id,
+                StockEvent.lamport_ts > lamport,
+                StockEvent.is_deleted == False
+            )
+
+        stock, anchor = product.current_stock, stock_lamport(product)
+        last_set = self.session.exec(
+            select(StockEvent.delta, StockEvent.lamport_ts)
+            .where(*after(anchor), StockEvent.operation == "SET")
+            .order_by(StockEvent.lamport_ts.desc())
+            .limit(1)
+        ).first()
+        if last_set:
+            stock, anchor = last_set
+
+        later = self.session.exec(
+            select(func.sum(StockEvent.delta)).where(*after(anchor), StockEvent.operation != "SET")
+        ).first() or 0
+        return stock + later
+
+    def stock_anchor(self, tenant_id: UUID, product_id: UUID) -> Dict:
+        """
+        What the stock curve of series() is walked back from: "counters" (kept
+        current by every merge) in CRDT mode, otherwise "snapshot", the stock
+        last written to the product at Lamport stock_lamport plus the events
+        logged after it.
+        """
+        if SYNC_STOCK_MODE == "CRDT":
+            return {"stock_source": "counters", "stock_lamport": None}
+
+        product = self.session.get(Product, product_id)
+        written = stock_lamport(product) if product and product.tenant_id == tenant_id else None
+        return {"stock_source": "snapshot", "stock_lamport": written}
+
+    def product_totals(
+        self,
+        tenant_id: UUID,
+        since: datetime,
+        until: datetime,
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """Totals per product over a day range, best sellers first."""
+        statement = (
+            select(StockRollup.product_id, *[func.sum(getattr(StockRollup, f)) for f in TOTAL_FIELDS])
+            .where(
+                StockRollup.tenant_id == tenant_id,
+                StockRollup.granularity == "DAY",
+                StockRollup.bucket_start >= bucket_start(since, "DAY"),
+                StockRollup.bucket_start < until
+            )
+            .group_by(StockRollup.product_id)
+            .order_by(func.sum(StockRollup.sales_units).desc())
+        )
+        if limit:
+            statement = statement.limit(limit)
+
+        days = max((until - since).total_seconds() / 86400, 1)
+        totals = []
+        for product_id, *values in self.session.exec(statement).all():
+            entry = {"product_id": str(product_id), **dict(zip(TOTAL_FIELDS, values))}
+            entry["sales_per_day"] = round(entry["sales_units"] / days, 3)
+            totals.append(entry)
+
+        return totals
@@ -3,7 +3,7 @@ Pydantic schemas for API requests and responses.
 """
 
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Literal, Optional
 from uuid import UUID
 from pydantic import BaseModel, Field
 
@@ -33,6 +33,10 @@ class StockEventCreate(BaseModel):
     updated_by: UUID
     
     operation_hash: Optional[str] = None
+    
+    # Hash chain of the device's events (see StockEvent)
+    device_seq: Optional[int] = None
+    prev_hash: Optional[str] = None
 
 
 class ProductSync(BaseModel):
@@ -54,6 +58,10 @@ class ProductSync(BaseModel):
     version: int = 1
     is_deleted: bool = False
     
+    # Field-level LWW: Lamport of each field this device edited.
+    # When omitted, the whole row is compared by lamport_ts.
+    field_lamports: Optional[Dict[str, int]] = None
+    
     created_by: UUID
     updated_by: UUID
 
@@ -88,12 +96,24 @@ class PendingPaymentSync(BaseModel):
     updated_by: UUID
 
 
+class StockCounterSync(BaseModel):
+    """A device's PN-counter state for one product (cumulative totals)."""
+    
+    tenant_id: UUID
+    product_id: UUID
+    device_id: UUID
+    
+    increments: int = Field(ge=0)
+    decrements: int = Field(ge=0)
+
+
 class SyncPushRequest(BaseModel):
     """Request to push operations to server."""
     
     operations: List[StockEventCreate] = [] # Events (Append-only)
     products: List[ProductSync] = []        # State (Last-Write-Wins)
     payments: List[PendingPaymentSync] = [] # State (Last-Write-Wins)
+    counters: List[StockCounterSync] = []   # State (CRDT merge)
     
     client_lamport: int
     device_id: UUID
@@ -107,12 +127,29 @@ class SyncPushResponse(BaseModel):
     timestamp: datetime
 
 
+class SyncSubscription(BaseModel):
+    """Subset of the tenant's events a device wants to pull."""
+    
+    product_ids: List[UUID] = []
+    categories: List[str] = []
+    device_role: Optional[str] = None
+
+
 class SyncPullRequest(BaseModel):
     """Request to pull operations from server."""
     
     tenant_id: UUID
     last_lamport: int
     limit: Optional[int] = 100
+    
+    # Identifies the puller; last_lamport is recorded as its acknowledgement
+    device_id: Optional[UUID] = None
+    
+    # Stored server-side for device_id; later pulls may omit it
+    subscription: Optional[SyncSubscription] = None
+    
+    # "columnar": operations come back dictionary-encoded in `columns`
+    layout: Literal["rows", "columnar"] = "rows"
 
 
 class SyncPullResponse(BaseModel):
@@ -121,6 +158,19 @@ class SyncPullResponse(BaseModel):
     operations: List[Dict]
     server_lamport: int
     has_more: bool
+    
+    # Cursor for the next pull (operations may be filtered out of the page)
+    next_lamport: int = 0
+    
+    # Columnar layout of the operations (see app.wire_format.to_columnar)
+    columns: Optional[Dict] = None
+    
+    # Finished asynchronous pushes of the requesting device (see app.push_queue)
+    push_results: List[Dict] = []
+    
+    # The cursor is below the tenant's collected horizon (tombstones purged or
+    # events archived since): drop local data and pull again from 0
+    resync_required: bool = False
 
 
 class ConflictListResponse(BaseModel):
@@ -128,3 +178,31 @@ class ConflictListResponse(BaseModel):
     
     conflicts: List[Dict]
     total: int
+
+
+class DeviceListResponse(BaseModel):
+    """Sync state and lag of every device of a tenant."""
+    
+    devices: List[Dict]
+    server_lamport: int
+
+
+class ConflictRulesUpdate(BaseModel):
+    """Replace the tenant's conflict resolution rule table."""
+    
+    rules: List[Dict]
+
+
+class ReceiptUploadStart(BaseModel):
+    """Start or resume the chunked upload of a receipt photo."""
+    
+    sha256: str  # Of the whole photo
+    size: int
+    content_type: str = "image/jpeg"
+    chunk_size: Optional[int] = Field(default=None, ge=1)  # Smaller chunks for poor links
+
+
+class ProductLookupRequest(BaseModel):
+    """A batch of scanned SKUs (barcodes or QR codes)."""
+    
+    skus: List[str] = Field(min_length=1, max_length=500)
@@ -0,0 +1,323 @@
+"""
+Tenant sharding across databases.
+DATABASE_SHARD_URLS names extra databases ("eu2=postgresql://...,eu3=...").
+The DATABASE_URL database is the "default" shard and holds the directory
+(tenant_shards) placing tenants on shards. Tenants without an entry live on
+the default shard, and an unsharded deployment never reads the directory.
+
+A tenant is moved online with:
+    python -m app.shards move --tenant UUID --to eu2 [--purge]
+
+1. copy: every row of the tenant is copied to the target while it keeps working;
+2. catch-up: rows changed during the copy are copied again;
+3. freeze: the tenant is marked MOVING and its requests get 503 while the
+   last changes and deletions are applied (a few seconds: the directory
+   cache TTL, the grace for in-flight requests, then one short pass);
+4. switch: the directory points at the target; --purge deletes the source rows.
+
+Usage:
+    python -m app.shards list [--tenant UUID ...]
+    python -m app.shards move --tenant UUID --to SHARD [--chunk-size 5000] [--grace 5] [--purge]
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+import argparse
+import os
+import threading
+import time
+
+from sqlalchemy import delete
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from .database import engine, dialect_insert, set_tenant_context
+from .models import TenantShard
+
+DEFAULT_SHARD = "default"
+
+# "name=url" pairs, comma-separated
+DATABASE_SHARD_URLS = dict(
+    entry.strip().split("=", 1) for entry in os.getenv("DATABASE_SHARD_URLS", "").split(",") if entry.strip()
+)
+
+# Directory entries read this recently are reused; a move waits this long after freezing
+SHARD_MAP_TTL_SECONDS = float(os.getenv("SHARD_MAP_TTL_SECONDS", "5"))
+
+# Column the server sets on every write of a row, used to copy only the rows
+# changed since the previous pass. Other tables are copied whole on every pass.
+CHANGE_COLUMNS = {
+    "stock_events": "synced_at",  # Set on accept; events are never updated
+    "stock_rollups": "updated_at",
+    "sales_heatmap_cells": "updated_at",
+    "stock_counters": "updated_at",
+    "sync_devices": "last_seen_at",
+}
+
+# Server clocks may disagree: a pass also re-copies rows this much older than its start
+CLOCK_MARGIN = timedelta(seconds=60)
+
+DEFAULT_CHUNK_SIZE = 5_000
+
+
+class TenantMoving(Exception):
+    """Raised while a tenant is frozen for the switch to another shard."""
+
+
+class ShardRouter:
+    """Tenant → shard engine, with a short-lived cache of the directory."""
+
+    def __init__(self, engines: Dict[str, Engine], directory: Engine, ttl: float = SHARD_MAP_TTL_SECONDS):
+        self.engines = engines
+        self.directory = directory
+        self.ttl = ttl
+        self._entries: Dict[UUID, Tuple[float, str, str]] = {}
+
+    def placement(self, tenant_id: UUID) -> Tuple[str, str]:
+        """(shard, status) of a tenant."""
+        cached = self._entries.get(tenant_id)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            return cached[1], cached[2]
+
+        with Session(self.directory) as session:
+            set_tenant_context(session, tenant_id)
+            entry = session.get(TenantShard, tenant_id)
+
+        shard, status = (entry.shard, entry.status) if entry else (DEFAULT_SHARD, "ACTIVE")
+        self._entries[tenant_id] = (time.monotonic(), shard, status)
+        return shard, status
+
+    def shard_of(self, tenant_id: UUID) -> str:
+        shard, status = self.placement(tenant_id)
+        if status == "MOVING":
+            raise TenantMoving(tenant_id)
+        return shard
+
+    def engine_for(self, tenant_id: UUID) -> Engine:
+        return self.engines[self.shard_of(tenant_id)]
+
+    def assign(self, tenant_id: UUID, shard: str, status: str = "ACTIVE") -> None:
+        """Write a tenant's directory entry."""
+        if shard not in self.engines:
+            raise ValueError(f"Unknown shard: {shard}")
+
+        with Session(self.directory) as session:
+            set_tenant_context(session, tenant_id)
+            entry = session.get(TenantShard, tenant_id) or TenantShard(tenant_id=tenant_id, shard=shard)
+            entry.shard = shard
+            entry.status = status
+            entry.updated_at = datetime.utcnow()
+            session.add(entry)
+            session.commit()
+
+        self._entries.pop(tenant_id, None)
+
+
+_router: Optional[ShardRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_shard_router() -> Optional[ShardRouter]:
+    """Process-wide router, or None when no extra shard is configured."""
+    global _router
+
+    if not DATABASE_SHARD_URLS:
+        return None
+
+    with _router_lock:
+        if _router is None:
+            engines = {DEFAULT_SHARD: engine}
+            engines.update({
+                name.strip(): create_engine(url.strip(), pool_pre_ping=True)
+                for name, url in DATABASE_SHARD_URLS.items()
+            })
+            _router = ShardRouter(engines, engine)
+
+    return _router
+
+
+def shard_engines() -> Dict[str, Engine]:
+    """Every shard engine by name (just the default one when unsharded)."""
+    router = get_shard_router()
+    return router.engines if router else {DEFAULT_SHARD: engine}
+
+
+def engine_for_tenant(tenant_id: Optional[UUID]) -> Engine:
+    """Engine of the tenant's shard (raises TenantMoving during a switch)."""
+    router = get_shard_router()
+    if router is None or tenant_id is None:
+        return engine
+    return router.engine_for(tenant_id)
+
+
+def ensure_placed(tenant_id: UUID, bind: Engine) -> None:
+    """
+    For sessions held across a whole upload: raise TenantMoving once the tenant
+    is frozen or has been switched away from bind. Checked before each chunk.
+    """
+    router = get_shard_router()
+    if router and router.engine_for(tenant_id) is not bind:
+        raise TenantMoving(tenant_id)
+
+
+def on_default_shard(tenant_id: Optional[UUID]) -> bool:
+    router = get_shard_router()
+    return router is None or tenant_id is None or router.shard_of(tenant_id) == DEFAULT_SHARD
+
+
+def tenant_tables():
+    """Tables holding tenant rows, parents first (the directory stays put)."""
+    return [
+        table for table in SQLModel.metadata.sorted_tables
+        if "tenant_id" in table.columns and table.name != TenantShard.__tablename__
+    ]
+
+
+def _copy_table(
+    table,
+    source: Session,
+    target: Session,
+    tenant_id: UUID,
+    since: Optional[datetime],
+    chunk_size: int
+) -> int:
+    """Upsert the tenant's rows (changed since `since`, when tracked) into the target."""
+    statement = select(table).where(table.c.tenant_id == tenant_id)
+    column = CHANGE_COLUMNS.get(table.name)
+    if since and column:
+        statement = statement.where(table.c[column] >= since)
+
+    insert = dialect_insert(target)
+    copied = 0
+    result = source.connection().execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+
+    for rows in result.partitions():
+        upsert = insert(table).values([dict(row._mapping) for row in rows])
+        upsert = upsert.on_conflict_do_update(
+            index_elements=["id"],
+            set_={c.name: upsert.excluded[c.name] for c in table.columns if c.name != "id"}
+        )
+        target.connection().execute(upsert)
+        copied += len(rows)
+
+    return copied
+
+
+def _delete_missing(table, source: Session, target: Session, tenant_id: UUID, chunk_size: int) -> int:
+    """Delete target rows the source no longer has (purged or replaced meanwhile)."""
+    ids = lambda session: set(session.exec(select(table.c.id).where(table.c.tenant_id == tenant_id)).all())
+    missing = list(ids(target) - ids(source))
+
+    for start in range(0, len(missing), chunk_size):
+        target.exec(delete(table).where(table.c.id.in_(missing[start:start + chunk_size])))
+
+    return len(missing)
+
+
+def _sync_pass(source: Session, target: Session, tenant_id: UUID, since: Optional[datetime], chunk_size: int) -> Dict:
+    """One copy pass, committed on the target."""
+    # The RLS context is per connection: set it again for this pass's transactions
+    set_tenant_context(source, tenant_id)
+    set_tenant_context(target, tenant_id)
+
+    tables = tenant_tables()
+    deleted = sum(_delete_missing(t, source, target, tenant_id, chunk_size) for t in reversed(tables))
+    copied = {t.name: _copy_table(t, source, target, tenant_id, since, chunk_size) for t in tables}
+    target.commit()
+    source.rollback()
+    return {"copied": sum(copied.values()), "deleted": deleted, "tables": copied}
+
+
+def move_tenant(
+    router: ShardRouter,
+    tenant_id: UUID,
+    to_shard: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    grace: float = 5.0,
+    purge: bool = False
+) -> Dict:
+    """Move a tenant to another shard while it keeps syncing (see module docstring)."""
+    from_shard = router.shard_of(tenant_id)
+    if from_shard == to_shard:
+        return {"status": "unchanged", "shard": to_shard}
+    if to_shard not in router.engines:
+        raise ValueError(f"Unknown shard: {to_shard}")
+
+    with Session(router.engines[from_shard]) as source, Session(router.engines[to_shard]) as target:
+        # 1. Bulk copy, online
+        started = datetime.utcnow()
+        first = _sync_pass(source, target, tenant_id, None, chunk_size)
+        print(f"[INFO] Move {tenant_id}: copied {first['copied']} rows to {to_shard}")
+
+        # 2. Catch up with what was written during the copy, online
+        caught_up = datetime.utcnow()
+        second = _sync_pass(source, target, tenant_id, started - CLOCK_MARGIN, chunk_size)
+        print(f"[INFO] Move {tenant_id}: caught up {second['copied']} rows")
+
+        # 3. Freeze: wait until every process has seen MOVING and in-flight requests ended
+        router.assign(tenant_id, from_shard, status="MOVING")
+        freeze_start = time.monotonic()
+        try:
+            time.sleep(router.ttl + grace)
+            last = _sync_pass(source, target, tenant_id, caught_up - CLOCK_MARGIN, chunk_size)
+        except Exception:
+            router.assign(tenant_id, from_shard)
+            raise
+
+        # 4. Switch
+        router.assign(tenant_id, to_shard)
+        frozen = time.monotonic() - freeze_start
+        print(f"[INFO] Move {tenant_id}: switched to {to_shard} after a {frozen:.1f}s freeze "
+              f"({last['copied']} rows copied, {last['deleted']} deleted)")
+
+        purged = 0
+        if purge:
+            set_tenant_context(source, tenant_id)
+            for table in reversed(tenant_tables()):
+                purged += source.exec(delete(table).where(table.c.tenant_id == tenant_id)).rowcount
+            source.commit()
+
+    return {
+        "status": "moved",
+        "from": from_shard,
+        "to": to_shard,
+        "rows": first["copied"],
+        "frozen_seconds": round(frozen, 3),
+        "purged": purged,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tenant shard directory and online moves")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="List shards and where tenants are placed")
+    listing.add_argument("--tenant", type=UUID, nargs="*", default=[], help="Tenants to show the placement of")
+    move = commands.add_parser("move", help="Move a tenant to another shard online")
+    move.add_argument("--tenant", type=UUID, required=True)
+    move.add_argument("--to", required=True, help="Target shard name")
+    move.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    move.add_argument("--grace", type=float, default=5.0, help="Seconds for in-flight requests to finish")
+    move.add_argument("--purge", action="store_true", help="Delete the tenant's rows from the source")
+    args = parser.parse_args()
+
+    router = get_shard_router()
+    if router is None:
+        parser.error("no shard configured (DATABASE_SHARD_URLS)")
+
+    if args.command == "list":
+        print(f"[INFO] Shards: {', '.join(router.engines)}")
+        # tenant_shards is under RLS: entries are read one tenant at a time, in its context
+        for tenant_id in args.tenant:
+            shard, status = router.placement(tenant_id)
+            print(f"  {tenant_id} {shard} {status}")
+        return
+
+    for shard_engine in router.engines.values():
+        SQLModel.metadata.create_all(shard_engine)
+
+    print(f"[INFO] {move_tenant(router, args.tenant, args.to, args.chunk_size, args.grace, args.purge)}")
+
+
+if __name__ == "__main__":
+    main()
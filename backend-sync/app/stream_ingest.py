@@ -0,0 +1,279 @@
+"""
+Streaming ingestion of large pushes for the Sync Engine.
+A device back online after weeks can hold tens of thousands of operations.
+Instead of parsing the whole batch up front, /sync/push/stream reads an NDJSON
+body line by line and validates and applies it in fixed-size chunks, streaming
+one result line back per chunk. Memory stays bounded by the chunk size.
+
+Request body (application/x-ndjson), one JSON document per line:
+    {"device_id": "uuid", "client_lamport": 1200}          <- header, first line
+    {"kind": "operation", ...StockEventCreate fields}
+    {"kind": "product", ...ProductSync fields}
+    {"kind": "payment", ...PendingPaymentSync fields}
+    {"kind": "counter", ...StockCounterSync fields}
+
+Response (application/x-ndjson):
+    {"chunk": 0, "items": 500, "results": [...], "server_lamport": 812}
+    ...
+    {"status": "complete", "items": 12000, "chunks": 24, "server_lamport": 9100}
+A malformed line ends the stream with
+    {"status": "error", "line": 731, "detail": "...", "items": 500}
+Chunks before it stay applied; operations are idempotent, so the client can
+resend the whole body. The same holds when the tenant starts moving to another
+shard mid-stream (checked before every chunk); the stream then ends with
+    {"status": "moving", "detail": "...", "retry_after": 5, "items": 500}
+
+With an Idempotency-Key header, chunk N of the stream is stored as the batch
+"<key>/N", like a /sync/push batch: a resent stream (same key, same chunk_size)
+gets the stored line for every chunk already applied and only applies the rest.
+A chunk that differs from the one stored under its key ends the stream with
+    {"status": "error", "chunk": 3, "detail": "...", "items": 1500}
+Streams are always applied synchronously; Prefer: respond-async is not honoured.
+"""
+
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from uuid import UUID
+import json
+import os
+
+from pydantic import BaseModel, ValidationError
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from .catalog import invalidate_after_push
+from .devices import DeviceRegistry
+from .idempotency import BatchIdempotencyStore, IdempotencyKeyReused, compute_batch_hash
+from .pull_cache import get_pull_cache
+from .shards import TenantMoving, ensure_placed
+from .schemas import (
+    PendingPaymentSync,
+    ProductSync,
+    StockCounterSync,
+    StockEventCreate,
+    SyncPushRequest,
+)
+from .sync_engine import AgrotourSyncEngine
+
+NDJSON = "application/x-ndjson"
+
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "500"))
+
+# A single line longer than this is rejected instead of buffered
+MAX_LINE_BYTES = 1024 * 1024
+
+# Seconds a client should wait before resending a stream cut by a tenant move
+MOVING_RETRY_AFTER = 5
+
+# Line kind -> (schema, SyncPushRequest field)
+ITEM_KINDS = {
+    "operation": (StockEventCreate, "operations"),
+    "product": (ProductSync, "products"),
+    "payment": (PendingPaymentSync, "payments"),
+    "counter": (StockCounterSync, "counters"),
+}
+
+
+class StreamHeader(BaseModel):
+    """First line of a streamed push."""
+
+    device_id: UUID
+    client_lamport: int
+
+
+class MalformedLine(ValueError):
+    """Raised for a body line that cannot be parsed or validated."""
+
+    def __init__(self, line: int, detail: str):
+        super().__init__(detail)
+        self.line = line
+        self.detail = detail
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Split a byte stream into (line number, line) for non-empty lines, holding
+    at most one partial line in memory.
+    """
+    buffer = b""
+    line_no = 0
+
+    async for data in stream:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, line
+        if len(buffer) > MAX_LINE_BYTES:
+            raise MalformedLine(line_no + 1, "Line too long")
+
+    if buffer.strip():
+        yield line_no + 1, buffer
+
+
+def parse_item(line: bytes, line_no: int):
+    """Validate one item line into (push field, schema instance)."""
+    try:
+        data = json.loads(line)
+        schema, field = ITEM_KINDS[data.pop("kind")]
+        return field, schema.model_validate(data)
+    except (KeyError, TypeError, AttributeError):
+        raise MalformedLine(line_no, f"Line must be an object with kind in {sorted(ITEM_KINDS)}")
+    except (ValueError, ValidationError) as e:
+        raise MalformedLine(line_no, str(e))
+
+
+class StreamIngestor:
+    """Applies an NDJSON push chunk by chunk through the sync engine."""
+
+    def __init__(
+        self,
+        session: Session,
+        tenant_id: UUID,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        idempotency_key: Optional[str] = None
+    ):
+        self.session = session
+        self.tenant_id = tenant_id
+        self.chunk_size = chunk_size
+        self.idempotency_key = idempotency_key
+        self.receipts = BatchIdempotencyStore(session) if idempotency_key else None
+        self.sync_engine = AgrotourSyncEngine(session)
+        self.accepted = False
+
+    async def run(self, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Consume the body and yield one NDJSON result line per applied chunk."""
+        header: Optional[StreamHeader] = None
+        chunk: Dict[str, List] = {field: [] for _, field in ITEM_KINDS.values()}
+        pending = items = chunks = 0
+
+        try:
+            async for line_no, line in iter_lines(stream):
+                if header is None:
+                    try:
+                        header = StreamHeader.model_validate_json(line)
+                    except ValidationError as e:
+                        raise MalformedLine(line_no, f"Invalid header: {e}")
+                    continue
+
+                field, item = parse_item(line, line_no)
+                chunk[field].append(item)
+                pending += 1
+
+                if pending == self.chunk_size:
+                    yield await self._apply(header, chunk, chunks)
+                    items += pending
+                    chunks += 1
+                    chunk = {field: [] for field in chunk}
+                    pending = 0
+
+            if header is None:
+                raise MalformedLine(0, "Empty body: a header line is required")
+
+            if pending:
+                yield await self._apply(header, chunk, chunks)
+                items += pending
+                chunks += 1
+        except MalformedLine as e:
+            if chunks:
+                await run_in_threadpool(self._finish, header)
+            yield _line({"status": "error", "line": e.line, "detail": e.detail, "items": items})
+            return
+        except IdempotencyKeyReused:
+            if chunks:
+                await run_in_threadpool(self._finish, header)
+            yield _line({
+                "status": "error",
+                "chunk": chunks,
+                "detail": "Idempotency-Key already used for a different batch",
+                "items": items
+            })
+            return
+        except TenantMoving:
+            # The session's shard is no longer the tenant's: only the cache head is safe to move
+            self._advance_cache()
+            yield moving_line(items)
+            return
+
+        if chunks:
+            await run_in_threadpool(self._finish, header)
+        yield _line({
+            "status": "complete",
+            "items": items,
+            "chunks": chunks,
+            "server_lamport": self.sync_engine.server_lamport
+        })
+
+    async def _apply(self, header: StreamHeader, chunk: Dict[str, List], index: int) -> bytes:
+        request = SyncPushRequest(
+            client_lamport=header.client_lamport,
+            device_id=header.device_id,
+            **chunk
+        )
+        if self.receipts:
+            key = f"{self.idempotency_key}/{index}"
+            batch_hash = compute_batch_hash(request)
+            stored = await run_in_threadpool(self.receipts.lookup, self.tenant_id, key, batch_hash)
+            if stored is not None:
+                # Applied by an earlier attempt of this stream: answered as it was then
+                self.sync_engine.server_lamport = max(self.sync_engine.server_lamport, stored["server_lamport"])
+                self.accepted = self.accepted or any(r.get("status") == "accepted" for r in stored["results"])
+                return _line(stored)
+
+        # The session outlives the directory cache: a move must not miss this chunk
+        ensure_placed(self.tenant_id, self.session.get_bind())
+        # The engine is synchronous: keep the event loop free while it runs
+        results = await run_in_threadpool(self.sync_engine.apply_push, request)
+        self.accepted = self.accepted or any(r.get("status") == "accepted" for r in results)
+        # The chunk is committed: products it changed must not be served from the SKU cache
+        invalidate_after_push(self.tenant_id, request)
+
+        reply = _line({
+            "chunk": index,
+            "items": len(results),
+            "results": results,
+            "server_lamport": self.sync_engine.server_lamport
+        })
+        if self.receipts:
+            await run_in_threadpool(self.receipts.store, self.tenant_id, key, batch_hash, json.loads(reply))
+        return reply
+
+    def _finish(self, header: StreamHeader) -> None:
+        """Same bookkeeping as a regular push, once for the whole stream."""
+        DeviceRegistry(self.session).record_push(
+            self.tenant_id, header.device_id, self.sync_engine.server_lamport
+        )
+        self._advance_cache()
+
+    def _advance_cache(self) -> None:
+        cache = get_pull_cache()
+        if cache and self.accepted:
+            cache.advance(self.tenant_id, self.sync_engine.server_lamport)
+
+
+def moving_line(items: int = 0) -> bytes:
+    """Last line of a stream cut because the tenant is moving shards."""
+    return _line({
+        "status": "moving",
+        "detail": "Tenant is being moved to another database, resend the stream shortly",
+        "retry_after": MOVING_RETRY_AFTER,
+        "items": items
+    })
+
+
+def _line(data: Dict) -> bytes:
+    return json.dumps(data, default=str).encode() + b"\n"
+
+
+class IngestResponse(StreamingResponse):
+    """
+    Streams results while the request body is still being read.
+    StreamingResponse listens for the disconnect message in parallel, which
+    would consume the body messages, so that listener is left out here.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,122 @@
+"""
+Subscription filters for selective pull.
+A market POS tablet selling 30 of a producer's 2,000 SKUs only needs the
+events of those products. Subscriptions are stored per device (or per device
+role) and turned into an indexed condition on the pull query.
+"""
+
+from datetime import datetime
+from hashlib import sha256
+from typing import Dict, Optional
+from uuid import UUID
+import json
+
+from sqlalchemy import or_
+from sqlmodel import Session, select
+
+from .models import Product, StockEvent, SyncDevice, SyncRoleSubscription
+from .schemas import SyncSubscription
+
+
+def _filters(subscription: SyncSubscription) -> Dict:
+    """Normalized, order-independent filter dict (stored as JSON)."""
+    return {
+        "product_ids": sorted(str(p) for p in subscription.product_ids),
+        "categories": sorted(set(subscription.categories)),
+    }
+
+
+def subscription_key(filters: Dict) -> str:
+    """Short stable hash of a filter, used to scope cached pull pages."""
+    return sha256(json.dumps(filters, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def pull_condition(filters: Dict):
+    """
+    WHERE clause restricting StockEvents to a subscription.
+    Both branches are served by ix_stock_events_tenant_product_lamport.
+    """
+    clauses = []
+
+    if filters["product_ids"]:
+        clauses.append(StockEvent.product_id.in_([UUID(p) for p in filters["product_ids"]]))
+
+    if filters["categories"]:
+        clauses.append(StockEvent.product_id.in_(
+            select(Product.id).where(Product.category.in_(filters["categories"]))
+        ))
+
+    return or_(*clauses)
+
+
+class SubscriptionStore:
+    """Stores and resolves device and role subscriptions."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def save_for_device(self, tenant_id: UUID, device_id: UUID, subscription: SyncSubscription) -> None:
+        """Store the device's own filter (the device row exists once it pulled)."""
+        device = self.session.exec(
+            select(SyncDevice).where(
+                SyncDevice.tenant_id == tenant_id,
+                SyncDevice.device_id == device_id
+            )
+        ).first()
+        if not device:
+            return
+
+        filters = _filters(subscription)
+        device.subscription = filters if (filters["product_ids"] or filters["categories"]) else None
+        device.device_role = subscription.device_role
+
+        self.session.add(device)
+        self.session.commit()
+
+    def save_for_role(self, tenant_id: UUID, role: str, subscription: SyncSubscription) -> None:
+        """Store the filter shared by every device of a role."""
+        role_sub = self.session.exec(
+            select(SyncRoleSubscription).where(
+                SyncRoleSubscription.tenant_id == tenant_id,
+                SyncRoleSubscription.role == role
+            )
+        ).first()
+        if not role_sub:
+            role_sub = SyncRoleSubscription(tenant_id=tenant_id, role=role)
+
+        filters = _filters(subscription)
+        role_sub.product_ids = filters["product_ids"]
+        role_sub.categories = filters["categories"]
+        role_sub.updated_at = datetime.utcnow()
+
+        self.session.add(role_sub)
+        self.session.commit()
+
+    def resolve(self, tenant_id: UUID, device_id: UUID) -> Optional[Dict]:
+        """
+        Effective filter for a device: its own subscription, else its role's,
+        else None (pull everything).
+        """
+        device = self.session.exec(
+            select(SyncDevice).where(
+                SyncDevice.tenant_id == tenant_id,
+                SyncDevice.device_id == device_id
+            )
+        ).first()
+        if not device:
+            return None
+
+        if device.subscription:
+            return device.subscription
+
+        if device.device_role:
+            role_sub = self.session.exec(
+                select(SyncRoleSubscription).where(
+                    SyncRoleSubscription.tenant_id == tenant_id,
+                    SyncRoleSubscription.role == device.device_role
+                )
+            ).first()
+            if role_sub and (role_sub.product_ids or role_sub.categories):
+                return {"product_ids": role_sub.product_ids, "categories": role_sub.categories}
+
+        return None
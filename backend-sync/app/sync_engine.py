@@ -4,29 +4,23 @@ Implements conflict detection and resolution based on 5 AI consensus.
 """
 
 from datetime import datetime
-from typing import List, Dict, Optional, Union, Type
+from typing import List, Dict, Optional, Tuple, Union, Type
 from uuid import UUID
 
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
 from sqlmodel import Session, select, SQLModel
-from .models import StockEvent, SyncConflict, Product, PendingPayment, SyncBaseModel
+from .models import StockEvent, SyncConflict, Product, PendingPayment, ReceiptUpload, SyncBaseModel, PRODUCT_MERGE_FIELDS
+from .schemas import SyncPushRequest
+from .conflict_rules import CompiledRuleTable, ConflictResolution, load_rule_table
+from .crdt import COMMUTATIVE_OPERATIONS, SYNC_STOCK_MODE, StockCounterStore
+from .devices import DeviceRegistry
+from .heatmap import HeatmapStore
+from .receipts import digest_of
+from .rollups import RollupStore
 
-
-class ConflictResolution:
-    """Result of conflict resolution attempt."""
-    
-    def __init__(
-        self,
-        winner_id: UUID,
-        reason: str,
-        method: str,
-        confidence: float = 1.0,
-        requires_approval: bool = False
-    ):
-        self.winner_id = winner_id
-        self.reason = reason
-        self.method = method
-        self.confidence = confidence
-        self.requires_approval = requires_approval
+# Recent events of a product checked for concurrency
+RECENT_OPS_LIMIT = 10
 
 
 class AgrotourSyncEngine:
@@ -35,16 +29,230 @@ class AgrotourSyncEngine:
     Implements consensus from Grok, ChatGPT, Qwen, Claude, Gemini.
     """
     
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, stock_mode: Optional[str] = None):
         self.session = session
+        self.stock_mode = stock_mode or SYNC_STOCK_MODE
         self.server_lamport = self._get_max_lamport()
+        self._rule_tables: Dict[UUID, CompiledRuleTable] = {}
+        
+        # Hot-path lookups prefetched once per push batch (see _prefetch_events)
+        self._known_hashes: Optional[Dict[str, UUID]] = None
+        self._recent_ops: Optional[Dict[UUID, List[StockEvent]]] = None
+        self._chain_heads: Optional[Dict[Tuple[UUID, UUID], Tuple[int, Optional[str]]]] = None
+        # Position in the batch of its events still being applied (see _apply_events)
+        self._batch_positions: Optional[Dict[UUID, int]] = None
     
     def _get_max_lamport(self) -> int:
-        """Get current maximum Lamport timestamp from database."""
-        result = self.session.exec(
-            select(StockEvent.lamport_ts).order_by(StockEvent.lamport_ts.desc()).limit(1)
-        ).first()
-        return result if result else 0
+        """
+        Get current maximum Lamport timestamp from database: the newest event,
+        product or payment write (bulk imports and reconciliation stamp rows
+        without any event).
+        """
+        # One round trip: every maximum is an index lookup
+        latest = self.session.exec(select(*(
+            select(func.max(model.lamport_ts)).scalar_subquery()
+            for model in (StockEvent, Product, PendingPayment)
+        ))).one()
+        return max(value or 0 for value in latest)
+    
+    def apply_push(self, request: SyncPushRequest) -> List[Dict]:
+        """
+        Apply a whole push batch: events first, then product and payment state.
+        Returns one result per item, in request order.
+        """
+        results = []
+        
+        # 1. Process Stock Events (Operations)
+        operations = []
+        for operation_data in request.operations:
+            operation = StockEvent(**operation_data.model_dump())
+            
+            # Compute operation hash if not provided
+            if not operation.operation_hash:
+                operation.operation_hash = operation.compute_operation_hash()
+            
+            operations.append(operation)
+        
+        self._prefetch_events(operations)
+        self._chain_heads = {}
+        try:
+            results.extend(self._apply_events(operations))
+        finally:
+            self._known_hashes = self._recent_ops = self._chain_heads = None
+            self._batch_positions = None
+        
+        # 2. Process Products (State Sync)
+        for product_data in request.products:
+            product = Product(**product_data.model_dump(exclude={"field_lamports"}))
+            product.content_hash = product.compute_hash()
+            
+            if product_data.field_lamports:
+                results.append(self._merge_product_fields(product, product_data.field_lamports))
+                continue
+            
+            results.append(self.accept_operation(product))
+        
+        # 3. Process Pending Payments (State Sync)
+        for payment_data in request.payments:
+            payment = PendingPayment(**payment_data.model_dump())
+            receipt_missing = not self._receipt_uploaded(payment)
+            if receipt_missing:
+                payment.receipt_photo = None
+            payment.content_hash = payment.compute_hash()
+            
+            result = self.accept_operation(payment)
+            if receipt_missing:
+                result["receipt_photo"] = "not_uploaded"
+            results.append(result)
+        
+        # 4. Merge Stock Counters (CRDT, never conflicts)
+        if request.counters and self.stock_mode != "CRDT":
+            # The merge projects into current_stock, which EVENTS mode derives from the log
+            results.extend(
+                {
+                    "status": "rejected",
+                    "product_id": str(counter.product_id),
+                    "message": f"Stock counters are only merged in CRDT mode (server mode: {self.stock_mode})"
+                }
+                for counter in request.counters
+            )
+        elif request.counters:
+            results.extend(StockCounterStore(self.session).merge(request.counters))
+        
+        return results
+    
+    def _receipt_uploaded(self, payment: PendingPayment) -> bool:
+        """
+        Whether the payment's receipt photo reference points at a finished
+        upload. A reference to an unfinished one is dropped: the device pushes
+        the payment again once the upload completes.
+        """
+        digest = digest_of(payment.receipt_photo)
+        if digest is None:
+            return True
+        
+        return self.session.exec(
+            select(ReceiptUpload.id).where(
+                ReceiptUpload.tenant_id == payment.tenant_id,
+                ReceiptUpload.sha256 == digest,
+                ReceiptUpload.status == "COMPLETE"
+            )
+        ).first() is not None
+    
+    def _prefetch_events(self, operations: List[StockEvent]) -> None:
+        """
+        Load what the per-event checks need for the whole batch in two queries:
+        the known operation hashes and the recent events of every product.
+        Each accepted event then costs its writes only, instead of two more
+        round trips to the database.
+        """
+        if not operations:
+            return
+        
+        hashes = {op.operation_hash for op in operations}
+        self._known_hashes = dict(self.session.exec(
+            select(StockEvent.operation_hash, StockEvent.id).where(StockEvent.operation_hash.in_(hashes))
+        ).all())
+        
+        # Latest RECENT_OPS_LIMIT events per product, in one windowed query
+        rank = func.row_number().over(
+            partition_by=StockEvent.product_id, order_by=StockEvent.lamport_ts.desc()
+        ).label("rank")
+        ranked = select(StockEvent, rank).where(
+            StockEvent.product_id.in_({op.product_id for op in operations}),
+            StockEvent.is_deleted == False
+        ).subquery()
+        recent = aliased(StockEvent, ranked)
+        
+        self._recent_ops = {op.product_id: [] for op in operations}
+        for op in self.session.exec(
+            select(recent).where(ranked.c.rank <= RECENT_OPS_LIMIT).order_by(ranked.c.lamport_ts.desc())
+        ).all():
+            # Detached: the per-event commits must not expire (and reload) them
+            self.session.expunge(op)
+            self._recent_ops[op.product_id].append(op)
+    
+    def _remember_event(self, operation: StockEvent) -> None:
+        """Add an accepted event to the prefetched lookups of the batch."""
+        if self._known_hashes is not None:
+            self._known_hashes[operation.operation_hash] = operation.id
+        
+        if self._recent_ops is not None and operation.product_id in self._recent_ops:
+            # Not truncated here: an event held back later in the batch is taken out again
+            self._recent_ops[operation.product_id].insert(0, StockEvent(**operation.model_dump()))
+    
+    def _forget_event(self, operation: StockEvent) -> None:
+        """Take an event the batch did not store back out of the prefetched lookups."""
+        if self._known_hashes is not None and self._known_hashes.get(operation.operation_hash) == operation.id:
+            del self._known_hashes[operation.operation_hash]
+        
+        if self._recent_ops is not None and operation.product_id in self._recent_ops:
+            self._recent_ops[operation.product_id] = [
+                op for op in self._recent_ops[operation.product_id] if op.id != operation.id
+            ]
+    
+    def _chain_head(self, operation: StockEvent) -> Tuple[int, Optional[str]]:
+        """Chain head of the event's device (read once per device and push batch)."""
+        key = (operation.tenant_id, operation.device_id)
+        if self._chain_heads is not None and key in self._chain_heads:
+            return self._chain_heads[key]
+        
+        head = DeviceRegistry(self.session).chain_head(*key)
+        if self._chain_heads is not None:
+            self._chain_heads[key] = head
+        return head
+    
+    def _check_chain(self, operation: StockEvent) -> Optional[Dict]:
+        """
+        Compare a chained event with its device's chain head.
+        The next event must carry the next device_seq and the head's hash;
+        anything else is a gap (earlier events never arrived: the device is
+        asked for exactly that range) or a fork (the device's log diverged
+        from what the server received, e.g. a restored backup).
+        Returns the result to answer with, or None when the event extends the chain.
+        """
+        if operation.device_seq is None:
+            return None
+        
+        head_seq, head_hash = self._chain_head(operation)
+        
+        if operation.device_seq == head_seq and operation.operation_hash == head_hash:
+            # Retry of the head event that was answered but not stored (rejected or in conflict)
+            return {"status": "duplicate", "message": "Operation already processed"}
+        
+        if operation.device_seq > head_seq + 1:
+            return {
+                "status": "gap",
+                "missing": {"from_seq": head_seq + 1, "to_seq": operation.device_seq - 1},
+                "chain_seq": head_seq,
+                "chain_hash": head_hash,
+                "message": "Earlier events of this device are missing - resend the range"
+            }
+        
+        if operation.device_seq <= head_seq or operation.prev_hash != head_hash:
+            return {
+                "status": "fork",
+                "chain_seq": head_seq,
+                "chain_hash": head_hash,
+                "message": "Event log diverged from the server - full reconciliation required"
+            }
+        
+        return None
+    
+    def _advance_chain(self, operation: StockEvent) -> None:
+        """Make a chained event the head of its device's chain (committed by the caller)."""
+        if operation.device_seq is None:
+            return
+        
+        DeviceRegistry(self.session).advance_chain(
+            operation.tenant_id, operation.device_id, operation.device_seq, operation.operation_hash
+        )
+        self._advance_chain_head(operation)
+    
+    def _advance_chain_head(self, operation: StockEvent) -> None:
+        """Move the cached chain head only (the device row is written by _advance_chain)."""
+        if operation.device_seq is not None and self._chain_heads is not None:
+            self._chain_heads[(operation.tenant_id, operation.device_id)] = (operation.device_seq, operation.operation_hash)
     
     def accept_operation(self, operation: Union[StockEvent, Product, PendingPayment]) -> Dict:
         """
@@ -62,20 +270,89 @@ class AgrotourSyncEngine:
         """
         Handle Event Sourcing (append-only) operations like StockEvent.
         """
+        early = self._prepare_event(operation)
+        if early:
+            return early
+        
+        conflict = self._first_conflict(operation)
+        resolution = self._resolve_conflict(operation, conflict) if conflict else None
+        return self._finish_event(operation, conflict, resolution)
+    
+    def _apply_events(self, operations: List[StockEvent]) -> List[Dict]:
+        """
+        Apply the events of a push batch, resolving all their conflicts at once:
+        1. every event is prepared and its first conflict detected, as if the
+           events before it were stored;
+        2. the conflicting pairs are scored in one rule table pass per tenant;
+        3. the events are finished in order. An event held back for approval or
+           rejected is taken out of the batch state, and the later events of
+           its product are checked again (and resolved one by one) without it.
+        An event repeated within the batch is answered as a duplicate of its first copy.
+        """
+        results: List[Optional[Dict]] = [None] * len(operations)
+        prepared: List[Tuple[int, StockEvent, Optional[StockEvent]]] = []
+        self._batch_positions = {}
+        
+        for position, operation in enumerate(operations):
+            early = self._prepare_event(operation)
+            if early:
+                results[position] = early
+                continue
+            
+            prepared.append((position, operation, self._first_conflict(operation, position)))
+            self._batch_positions[operation.id] = position
+            self._remember_event(operation)
+            self._advance_chain_head(operation)
+        
+        pairs_by_tenant: Dict[UUID, List[Tuple[StockEvent, StockEvent]]] = {}
+        for _, operation, conflict in prepared:
+            if conflict:
+                pairs_by_tenant.setdefault(operation.tenant_id, []).append((operation, conflict))
+        resolved = {
+            id(pair[0]): resolution
+            for tenant_id, pairs in pairs_by_tenant.items()
+            for pair, resolution in zip(pairs, self.resolve_conflicts(tenant_id, pairs))
+        }
+        
+        held_products = set()
+        for position, operation, conflict in prepared:
+            resolution = resolved.get(id(operation))
+            if operation.product_id in held_products:
+                conflict = self._first_conflict(operation, position)
+                resolution = self._resolve_conflict(operation, conflict) if conflict else None
+            
+            result = self._finish_event(operation, conflict, resolution)
+            if result["status"] != "accepted":
+                self._forget_event(operation)
+                held_products.add(operation.product_id)
+            results[position] = result
+        
+        return results
+    
+    def _prepare_event(self, operation: StockEvent) -> Optional[Dict]:
+        """Steps 1-4 of accepting an event; returns the answer when it stops there."""
         # 1. IDEMPOTENCY CHECK
-        existing = self.session.exec(
-            select(StockEvent).where(
-                StockEvent.operation_hash == operation.operation_hash
-            )
-        ).first()
+        if self._known_hashes is not None:
+            existing_id = self._known_hashes.get(operation.operation_hash)
+        else:
+            existing_id = self.session.exec(
+                select(StockEvent.id).where(
+                    StockEvent.operation_hash == operation.operation_hash
+                )
+            ).first()
         
-        if existing:
+        if existing_id:
             return {
                 "status": "duplicate",
-                "operation_id": str(existing.id),
+                "operation_id": str(existing_id),
                 "message": "Operation already processed"
             }
         
+        # 1b. VERIFY DEVICE HASH CHAIN (gaps and forks in one comparison)
+        chain_break = self._check_chain(operation)
+        if chain_break:
+            return chain_break
+        
         # 2. UPDATE LAMPORT CLOCK
         self.server_lamport = max(self.server_lamport, operation.lamport_ts) + 1
         operation.lamport_ts = self.server_lamport
@@ -87,12 +364,30 @@ class AgrotourSyncEngine:
         # 4. INCREMENT VERSION
         operation.increment_version()
         
-        # 5. DETECT CONCURRENT OPERATIONS
-        conflicts = self._detect_concurrent_operations(operation)
+        return None
+    
+    def _first_conflict(self, operation: StockEvent, position: Optional[int] = None) -> Optional[StockEvent]:
+        """
+        5. DETECT CONCURRENT OPERATIONS
+        In CRDT mode, stock deltas commute and skip detection entirely.
+        """
+        if self.stock_mode == "CRDT" and operation.operation in COMMUTATIVE_OPERATIONS:
+            return None
         
-        if conflicts:
-            resolution = self._resolve_conflict(operation, conflicts[0])
-            conflict_record = self._log_conflict(operation, conflicts[0], resolution)
+        conflicts = self._detect_concurrent_operations(operation, position)
+        return conflicts[0] if conflicts else None
+    
+    def _finish_event(
+        self,
+        operation: StockEvent,
+        conflict: Optional[StockEvent],
+        resolution: Optional[ConflictResolution]
+    ) -> Dict:
+        """Steps 5-7 of accepting an event: log its conflict, validate and persist it."""
+        if conflict:
+            if resolution.requires_approval:
+                self._advance_chain(operation)
+            conflict_record = self._log_conflict(operation, conflict, resolution)
             
             if resolution.requires_approval:
                 return {
@@ -110,20 +405,31 @@ class AgrotourSyncEngine:
         # 6. VALIDATE BUSINESS RULES
         validation = self._validate_business_rules(operation)
         if not validation["valid"]:
+            # The device must not resend it: the chain moves past rejected events too
+            if operation.device_seq is not None:
+                self._advance_chain(operation)
+                self.session.commit()
             return {
                 "status": "rejected",
                 "reason": validation["reason"],
                 "suggestion": validation.get("alternative")
             }
         
-        # 7. PERSIST OPERATION
+        # 7. PERSIST OPERATION (with its rollup and heatmap buckets, in one transaction)
+        operation_id = str(operation.id)
         self.session.add(operation)
+        self._advance_chain(operation)
+        RollupStore(self.session).add([operation])
+        HeatmapStore(self.session).add([operation])
         self.session.commit()
-        self.session.refresh(operation)
+        
+        # Batch events are discarded after the push: skip the reload round trip
+        if self._known_hashes is None:
+            self.session.refresh(operation)
         
         return {
             "status": "accepted",
-            "operation_id": str(operation.id),
+            "operation_id": operation_id,
             "server_lamport": self.server_lamport,
             "message": "Event accepted successfully"
         }
@@ -149,6 +455,10 @@ class AgrotourSyncEngine:
                  for key, value in entity_data.items():
                      setattr(current_state, key, value)
                  
+                 # Whole-row write: every field now carries the row Lamport
+                 if isinstance(current_state, Product):
+                     current_state.field_lamports = {}
+                 
                  # Update metadata
                  self.server_lamport = max(self.server_lamport, entity.lamport_ts) + 1
                  current_state.lamport_ts = self.server_lamport
@@ -188,23 +498,90 @@ class AgrotourSyncEngine:
             
             return {"status": "accepted", "message": "New state created"}
     
+    def _merge_product_fields(self, entity: Product, field_lamports: Dict[str, int]) -> Dict:
+        """
+        Field-level Last-Write-Wins for Product.
+        Each edited field is compared with the Lamport of its own last write,
+        so concurrent edits of different fields (price from web, description
+        from mobile) are both applied in one write.
+        """
+        current_state = self.session.get(Product, entity.id)
+        
+        if not current_state:
+            return self._handle_state_sync(entity)
+        
+        # Materialize stamps: unstamped fields were written at the row Lamport
+        stamps = {
+            field: (current_state.field_lamports or {}).get(field, current_state.lamport_ts)
+            for field in PRODUCT_MERGE_FIELDS
+        }
+        
+        self.server_lamport = max(self.server_lamport, max(field_lamports.values())) + 1
+        applied, stale = [], []
+        
+        for field, lamport in field_lamports.items():
+            if field not in stamps:
+                continue
+            # Tie: server state wins, as for whole rows
+            if lamport > stamps[field]:
+                setattr(current_state, field, getattr(entity, field))
+                stamps[field] = self.server_lamport
+                applied.append(field)
+            else:
+                stale.append(field)
+        
+        if not applied:
+            return {
+                "status": "ignored",
+                "message": "All fields stale (Older Lamport)",
+                "stale_fields": stale,
+                "server_lamport": self.server_lamport
+            }
+        
+        current_state.field_lamports = stamps
+        current_state.lamport_ts = self.server_lamport
+        current_state.updated_by = entity.updated_by
+        current_state.synced_at = datetime.utcnow()
+        current_state.increment_version()
+        current_state.content_hash = current_state.compute_hash()
+        
+        self.session.add(current_state)
+        self.session.commit()
+        
+        return {
+            "status": "accepted",
+            "message": "Fields merged (field-level LWW)",
+            "applied_fields": applied,
+            "stale_fields": stale,
+            "server_lamport": self.server_lamport
+        }
+    
     def _detect_concurrent_operations(
         self,
-        new_op: StockEvent
+        new_op: StockEvent,
+        position: Optional[int] = None
     ) -> List[StockEvent]:
         """
         Detect operations that conflict with the new operation.
         Two operations conflict if they affect the same product and
         happened "concurrently" (neither causally precedes the other).
+        In a batch, only its events before `position` count.
         """
-        # Find recent operations on same product
-        recent_ops = self.session.exec(
-            select(StockEvent).where(
-                StockEvent.product_id == new_op.product_id,
-                StockEvent.is_deleted == False,
-                StockEvent.id != new_op.id
-            ).order_by(StockEvent.lamport_ts.desc()).limit(10)
-        ).all()
+        # Find recent operations on same product (prefetched for push batches)
+        if self._recent_ops is not None and new_op.product_id in self._recent_ops:
+            positions = self._batch_positions or {}
+            recent_ops = [
+                op for op in self._recent_ops[new_op.product_id]
+                if op.id != new_op.id and (position is None or positions.get(op.id, -1) < position)
+            ][:RECENT_OPS_LIMIT]
+        else:
+            recent_ops = self.session.exec(
+                select(StockEvent).where(
+                    StockEvent.product_id == new_op.product_id,
+                    StockEvent.is_deleted == False,
+                    StockEvent.id != new_op.id
+                ).order_by(StockEvent.lamport_ts.desc()).limit(RECENT_OPS_LIMIT)
+            ).all()
         
         conflicts = []
         for op in recent_ops:
@@ -217,6 +594,13 @@ class AgrotourSyncEngine:
         
         return conflicts
     
+    def _rule_table(self, tenant_id: UUID) -> CompiledRuleTable:
+        """Compiled conflict rules of a tenant, loaded once per engine."""
+        table = self._rule_tables.get(tenant_id)
+        if table is None:
+            table = self._rule_tables[tenant_id] = load_rule_table(self.session, tenant_id)
+        return table
+    
     def _resolve_conflict(
         self,
         new_op: StockEvent,
@@ -227,56 +611,17 @@ class AgrotourSyncEngine:
         1. Hardcoded rules (Grok requirement)
         2. Heuristics (Qwen suggestion)
         3. AI suggestions with approval (Gemini + Claude)
+        The tiers live in the tenant's rule table (app.conflict_rules).
         """
-        
-        # TIER 1: HARDCODED RULES (deterministic, highest priority)
-        
-        # Rule 1: Paid sales take absolute precedence
-        if new_op.payment_status == "PAID" and conflict_op.payment_status != "PAID":
-            return ConflictResolution(
-                winner_id=new_op.id,
-                reason="Paid sale has absolute priority",
-                method="HARDCODED",
-                confidence=1.0
-            )
-        
-        if conflict_op.payment_status == "PAID" and new_op.payment_status != "PAID":
-            return ConflictResolution(
-                winner_id=conflict_op.id,
-                reason="Existing operation is a paid sale",
-                method="HARDCODED",
-                confidence=1.0
-            )
-        
-        # Rule 2: DECREMENT operations (sales) > INCREMENT (restocks)
-        if new_op.operation == "DECREMENT" and conflict_op.operation == "INCREMENT":
-            return ConflictResolution(
-                winner_id=new_op.id,
-                reason="Sales take priority over restocks",
-                method="HARDCODED",
-                confidence=0.95
-            )
-        
-        # TIER 2: HEURISTICS (simple, fast)
-        
-        # Heuristic 1: Earlier Lamport timestamp wins
-        if new_op.lamport_ts < conflict_op.lamport_ts:
-            return ConflictResolution(
-                winner_id=new_op.id,
-                reason="Operation occurred first (lower Lamport timestamp)",
-                method="HEURISTIC",
-                confidence=0.9
-            )
-        
-        # TIER 3: ESCALATE TO MANUAL RESOLUTION
-        # (AI suggestions would go here in Phase 9)
-        return ConflictResolution(
-            winner_id=new_op.id,
-            reason="Ambiguous conflict - requires producer decision",
-            method="MANUAL",
-            confidence=0.5,
-            requires_approval=True
-        )
+        return self._rule_table(new_op.tenant_id).resolve(new_op, conflict_op)
+    
+    def resolve_conflicts(
+        self,
+        tenant_id: UUID,
+        pairs: List[Tuple[StockEvent, StockEvent]]
+    ) -> List[ConflictResolution]:
+        """Resolve a batch of (new, existing) conflicting pairs in one pass."""
+        return self._rule_table(tenant_id).resolve_batch(pairs)
     
     def _log_conflict(
         self,
@@ -294,8 +639,8 @@ class AgrotourSyncEngine:
             entity_id=op_a.product_id,
             operation_a_id=op_a.id,
             operation_b_id=op_b.id,
-            payload_a=op_a.model_dump(),
-            payload_b=op_b.model_dump(),
+            payload_a=op_a.model_dump(mode="json"),
+            payload_b=op_b.model_dump(mode="json"),
             status="PENDING" if resolution.requires_approval else "RESOLVED_AUTO",
             resolution_method=resolution.method,
             winner_id=resolution.winner_id,
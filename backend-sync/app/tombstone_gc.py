@@ -0,0 +1,163 @@
+"""
+Tombstone garbage collection for the Sync Engine.
+Soft-deleted rows are only needed until every device has seen the delete.
+Below the tenant's safe horizon (see DeviceRegistry.safe_horizon) they are
+physically purged in batches, together with the events of deleted products
+and the rollups, heatmap cells and stock counters derived from them.
+
+Usage:
+    python -m app.tombstone_gc [--tenant UUID] [--batch-size 500] [--interval 0]
+"""
+
+from typing import Dict, List, Optional, Tuple, Type
+from uuid import UUID
+import argparse
+import time
+
+from sqlalchemy import delete, exists
+from sqlmodel import Session, SQLModel, select
+
+from .database import set_tenant_context
+from .devices import DeviceRegistry
+from .models import (
+    PendingPayment,
+    Product,
+    SalesHeatmapCell,
+    StockCounter,
+    StockEvent,
+    StockRollup,
+    SyncBaseModel,
+    SyncDevice,
+)
+from .shards import TenantMoving, engine_for_tenant, shard_engines
+
+DEFAULT_BATCH_SIZE = 500
+
+# Rows referencing products.id besides events; they go with their product
+PRODUCT_DEPENDENTS = (StockRollup, SalesHeatmapCell, StockCounter)
+
+
+class TombstoneCollector:
+    """Purges tombstones of one tenant below its safe horizon."""
+
+    def __init__(self, session: Session, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.session = session
+        self.batch_size = batch_size
+
+    def collect(self, tenant_id: UUID, horizon: Optional[int] = None) -> Dict:
+        """
+        Purge everything no active device still needs.
+        Events go first, since they reference products.
+        """
+        if horizon is None:
+            horizon = DeviceRegistry(self.session).safe_horizon(tenant_id)
+
+        purged = {"horizon": horizon, "stock_events": 0, "products": 0, "pending_payments": 0}
+        if horizon <= 0:
+            return purged
+
+        # Durable before anything goes: devices behind it are told to resync
+        DeviceRegistry(self.session).record_collected(tenant_id, horizon)
+        self.session.commit()
+
+        # 1. Deleted events, and events superseded by a deleted product
+        deleted_product = exists().where(
+            Product.id == StockEvent.product_id,
+            Product.is_deleted == True,
+            Product.lamport_ts <= horizon
+        )
+        purged["stock_events"] = self._purge(
+            StockEvent,
+            StockEvent.tenant_id == tenant_id,
+            StockEvent.lamport_ts <= horizon,
+            (StockEvent.is_deleted == True) | deleted_product
+        )
+
+        # 2. Deleted products no longer referenced by any event, with their projections
+        referenced = exists().where(StockEvent.product_id == Product.id)
+        purged["products"] = self._purge(
+            Product,
+            Product.tenant_id == tenant_id,
+            Product.is_deleted == True,
+            Product.lamport_ts <= horizon,
+            ~referenced,
+            dependents=PRODUCT_DEPENDENTS
+        )
+
+        # 3. Deleted payments
+        purged["pending_payments"] = self._purge(
+            PendingPayment,
+            PendingPayment.tenant_id == tenant_id,
+            PendingPayment.is_deleted == True,
+            PendingPayment.lamport_ts <= horizon
+        )
+
+        return purged
+
+    def _purge(
+        self,
+        model: Type[SyncBaseModel],
+        *conditions,
+        dependents: Tuple[Type[SQLModel], ...] = ()
+    ) -> int:
+        """
+        Delete matching rows in fixed-size batches, committing each one.
+        Rows of the dependents referencing a batch (by product_id) are
+        deleted first, in the same transaction.
+        """
+        total = 0
+
+        while True:
+            ids: List[UUID] = self.session.exec(
+                select(model.id).where(*conditions).limit(self.batch_size)
+            ).all()
+            if not ids:
+                return total
+
+            for dependent in dependents:
+                self.session.exec(delete(dependent).where(dependent.product_id.in_(ids)))
+            self.session.exec(delete(model).where(model.id.in_(ids)))
+            self.session.commit()
+            total += len(ids)
+
+
+def collect_all(tenant_id: Optional[UUID] = None, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+    """Run one collection pass over one tenant or every tenant with devices."""
+    if tenant_id:
+        tenant_ids = [tenant_id]
+    else:
+        tenant_ids = []
+        for shard_engine in shard_engines().values():
+            with Session(shard_engine) as session:
+                tenant_ids += session.exec(select(SyncDevice.tenant_id).distinct()).all()
+
+    # A moved tenant may still have rows on its previous shard (moved without --purge)
+    for tid in dict.fromkeys(tenant_ids):
+        # One session per tenant: the RLS context is session-bound
+        try:
+            bind = engine_for_tenant(tid)
+        except TenantMoving:
+            print(f"[INFO] Tombstone GC tenant={tid} skipped (moving shards)")
+            continue
+        with Session(bind) as session:
+            set_tenant_context(session, tid)
+            purged = TombstoneCollector(session, batch_size).collect(tid)
+        print(f"[INFO] Tombstone GC tenant={tid} {purged}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Purge tombstones below each tenant's safe horizon")
+    parser.add_argument("--tenant", type=UUID, help="Only collect this tenant")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--interval", type=int, default=0, help="Repeat every N seconds (0 = run once)")
+    args = parser.parse_args()
+
+    while True:
+        collect_all(args.tenant, args.batch_size)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
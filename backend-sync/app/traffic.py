@@ -0,0 +1,185 @@
+"""
+Sanitized capture of sync traffic, for replay with benchmarks.replay.
+When SYNC_CAPTURE_PATH is set, every /sync/push and /sync/pull request is
+appended to that file as one JSON line: arrival offset, path, headers and body,
+plus the status and latency seen in production.
+
+Captures are sanitized on the way in. UUIDs (tenants, devices, users, products)
+are replaced by keyed pseudonyms, so the same id maps to the same pseudonym
+within a capture (relations are kept), and free-text and payment identifiers
+are dropped. Numbers, Lamport timestamps and operation types are kept, since
+they drive the engine's behaviour.
+"""
+
+from typing import Any, Dict, Optional
+from uuid import UUID, uuid5
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+from .wire_format import decode
+
+SYNC_CAPTURE_PATH = os.getenv("SYNC_CAPTURE_PATH")
+
+# Key of the pseudonyms; a random key per process makes captures unlinkable
+SYNC_CAPTURE_KEY = os.getenv("SYNC_CAPTURE_KEY") or secrets.token_hex(16)
+
+CAPTURED_PATHS = ("/sync/push", "/sync/pull")
+
+# Free text and payment identifiers: dropped, or a placeholder where required
+REDACTED_FIELDS = {
+    "description", "notes", "receipt_photo",
+    "pos_transaction_id", "pos_device_id", "location_lat", "location_lng",
+}
+PLACEHOLDER_FIELDS = {"name": "redacted"}
+
+CAPTURED_HEADERS = ("x-tenant-id", "content-type", "accept", "idempotency-key")
+
+# Ids owned by the device, remapped for each simulated clone
+CLONED_FIELDS = {"id", "device_id", "created_by", "updated_by", "sale_id"}
+
+
+class Sanitizer:
+    """Keyed, consistent pseudonymization of a captured body."""
+
+    def __init__(self, key: str = SYNC_CAPTURE_KEY):
+        self.key = key.encode()
+
+    def pseudonym(self, value: str) -> str:
+        digest = hmac.new(self.key, value.lower().encode(), hashlib.sha256).digest()
+        return str(UUID(bytes=digest[:16], version=4))
+
+    def _is_uuid(self, value: str) -> bool:
+        try:
+            UUID(value)
+        except ValueError:
+            return False
+        return len(value) == 36
+
+    def clean(self, data: Any, field: Optional[str] = None) -> Any:
+        if isinstance(data, dict):
+            return {k: self.clean(v, k) for k, v in data.items()}
+        if isinstance(data, list):
+            return [self.clean(v, field) for v in data]
+        if field in REDACTED_FIELDS or field == "operation_hash":
+            return None
+        if field in PLACEHOLDER_FIELDS:
+            return PLACEHOLDER_FIELDS[field]
+        if field == "sku" and isinstance(data, str):
+            return self.pseudonym(data)[:12]
+        if isinstance(data, str) and self._is_uuid(data):
+            return self.pseudonym(data)
+        return data
+
+    def headers(self, headers: Dict[str, str]) -> Dict[str, str]:
+        cleaned = {}
+        for name in CAPTURED_HEADERS:
+            if name in headers:
+                value = headers[name]
+                if name == "x-tenant-id" and self._is_uuid(value):
+                    value = self.pseudonym(value)
+                elif name == "idempotency-key":
+                    value = self.pseudonym(value)
+                cleaned[name] = value
+        return cleaned
+
+
+class TrafficRecorder:
+    """
+    ASGI middleware appending sanitized sync requests to a JSONL capture.
+    The body is copied as the application reads it, so the request is not
+    buffered or delayed.
+    """
+
+    def __init__(self, app, path: str, sanitizer: Optional[Sanitizer] = None):
+        self.app = app
+        self.path = path
+        self.sanitizer = sanitizer or Sanitizer()
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in CAPTURED_PATHS:
+            return await self.app(scope, receive, send)
+
+        chunks = []
+        status_code = []
+        arrived = time.monotonic()
+
+        async def tee_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def tee_send(message):
+            if message["type"] == "http.response.start":
+                status_code.append(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, tee_receive, tee_send)
+        finally:
+            headers = {k.decode().lower(): v.decode() for k, v in scope["headers"]}
+            self._record(scope, headers, b"".join(chunks), status_code, arrived)
+
+    def _record(self, scope, headers: Dict[str, str], body: bytes, status_code, arrived: float) -> None:
+        try:
+            data = decode(headers.get("content-type"), body) if body else None
+        except ValueError:
+            return
+
+        record = {
+            "t": round(arrived - self.started, 4),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode(),
+            "headers": self.sanitizer.headers(headers),
+            "body": self.sanitizer.clean(data),
+            "status": status_code[0] if status_code else None,
+            "latency_ms": round((time.monotonic() - arrived) * 1000, 2),
+        }
+        # JSON bodies are replayed as JSON whatever the original format
+        record["headers"]["content-type"] = "application/json"
+
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            with open(self.path, "a") as capture:
+                capture.write(line)
+
+
+def virtual_device(record: Dict, copy: int) -> Dict:
+    """
+    A captured request as sent by the copy-th simulated clone of its device.
+    Device, user and item ids are remapped so every clone's writes are new
+    operations; tenant and product ids are kept, so clones contend on the same
+    products like devices at the same market stall.
+    """
+    if copy == 0:
+        return record
+
+    def remap(value: str) -> str:
+        return str(uuid5(UUID(value), str(copy)))
+
+    def walk(item: Dict, fields) -> Dict:
+        return {k: remap(v) if k in fields and isinstance(v, str) else v for k, v in item.items()}
+
+    body = dict(record["body"] or {})
+    if "device_id" in body and body["device_id"]:
+        body["device_id"] = remap(body["device_id"])
+    for section, items in body.items():
+        if isinstance(items, list):
+            # A product's id is the product itself: clones update the same rows
+            fields = CLONED_FIELDS - {"id"} if section == "products" else CLONED_FIELDS
+            body[section] = [walk(item, fields) for item in items]
+
+    clone = dict(record)
+    clone["body"] = body
+    clone["headers"] = dict(record["headers"])
+    if "idempotency-key" in clone["headers"]:
+        clone["headers"]["idempotency-key"] = remap(clone["headers"]["idempotency-key"])
+    return clone
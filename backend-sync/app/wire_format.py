@@ -0,0 +1,184 @@
+"""
+Content-negotiated wire formats for /sync/push and /sync/pull.
+JSON stays the default. Clients on slow links can send MessagePack
+(application/msgpack) or CBOR (application/cbor) bodies, and ask for either
+through the Accept header. Pull can additionally return a columnar page, in
+which the fields repeated on every event (tenant, device, author...) are
+dictionary-encoded.
+
+msgpack and cbor2 are optional: without them only JSON is offered.
+"""
+
+from typing import Any, Dict, List, Optional, Type
+import json
+
+from fastapi import HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response
+from pydantic import BaseModel, ValidationError
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # optional dependency
+    cbor2 = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+_ALIASES = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+# Event fields with few distinct values per page
+DICTIONARY_FIELDS = (
+    "tenant_id", "product_id", "device_id", "device_type",
+    "operation", "payment_status", "created_by", "updated_by",
+)
+
+
+class UnsupportedMediaType(ValueError):
+    """Raised for a body format the server cannot decode."""
+
+
+def available_formats() -> List[str]:
+    """Media types this process can encode and decode."""
+    formats = [JSON]
+    if msgpack is not None:
+        formats.append(MSGPACK)
+    if cbor2 is not None:
+        formats.append(CBOR)
+    return formats
+
+
+def _media_type(value: str) -> str:
+    media = value.split(";", 1)[0].strip().lower()
+    return _ALIASES.get(media, media)
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Response format for an Accept header (q-values honoured, JSON by default)."""
+    if not accept:
+        return JSON
+
+    ranges = []
+    for position, entry in enumerate(accept.split(",")):
+        quality = 1.0
+        for param in entry.split(";")[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((-quality, position, _media_type(entry)))
+
+    formats = available_formats()
+    for quality, _, media in sorted(ranges):
+        if quality == 0:
+            break
+        if media in ("*/*", "application/*"):
+            return JSON
+        if media in formats:
+            return media
+
+    return JSON
+
+
+def decode(content_type: Optional[str], body: bytes) -> Any:
+    """Decode a request body according to its Content-Type."""
+    media = _media_type(content_type) if content_type else JSON
+
+    if media == JSON or media.endswith("+json"):
+        return json.loads(body)
+    if media == MSGPACK and msgpack is not None:
+        return msgpack.unpackb(body, raw=False)
+    if media == CBOR and cbor2 is not None:
+        return cbor2.loads(body)
+
+    raise UnsupportedMediaType(media)
+
+
+def encode(media: str, data: Any) -> bytes:
+    """Encode JSON-compatible data (e.g. model_dump(mode="json")) as media."""
+    if media == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    if media == CBOR:
+        return cbor2.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def respond(media: str, data: Any, status_code: int = 200) -> Response:
+    """Response carrying data encoded in the negotiated format."""
+    return Response(content=encode(media, data), media_type=media, status_code=status_code)
+
+
+def body(model: Type[BaseModel]):
+    """
+    FastAPI dependency returning the request body as model, whatever the
+    supported Content-Type it was sent in.
+    """
+    async def dependency(request: Request) -> BaseModel:
+        try:
+            data = decode(request.headers.get("content-type"), await request.body())
+        except UnsupportedMediaType as e:
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail=f"Unsupported body format: {e}"
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Malformed request body"
+            )
+
+        try:
+            return model.model_validate(data)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+
+    return dependency
+
+
+def to_columnar(operations: List[Dict]) -> Dict:
+    """
+    Columnar layout of a page of operations:
+        {"count": n,
+         "columns": {"lamport_ts": [5, 6], "device_id": [0, 0], ...},
+         "dictionaries": {"device_id": ["9f1c..."], ...}}
+    Columns named in dictionaries hold indexes into their dictionary.
+    """
+    columns: Dict[str, List] = {}
+    dictionaries: Dict[str, List] = {}
+
+    if operations:
+        for field in operations[0]:
+            values = [op.get(field) for op in operations]
+
+            if field in DICTIONARY_FIELDS:
+                codes: Dict[Any, int] = {}
+                columns[field] = [codes.setdefault(v, len(codes)) for v in values]
+                dictionaries[field] = list(codes)
+            else:
+                columns[field] = values
+
+    return {"count": len(operations), "columns": columns, "dictionaries": dictionaries}
+
+
+def from_columnar(page: Dict) -> List[Dict]:
+    """Rebuild the row layout of a columnar page."""
+    columns = {}
+    for field, values in page["columns"].items():
+        dictionary = page["dictionaries"].get(field)
+        columns[field] = [dictionary[code] for code in values] if dictionary is not None else values
+
+    return [
+        {field: values[i] for field, values in columns.items()}
+        for i in range(page["count"])
+    ]
@@ -0,0 +1 @@
+"""Benchmarks for the Agrotour Sync Engine."""
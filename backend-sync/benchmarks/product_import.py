@@ -0,0 +1,61 @@
+"""
+Benchmark: loading a product catalog, bulk import vs one /sync/push per product.
+
+Usage:
+    python -m benchmarks.product_import [--database-url URL] [--products 50000] [--pushed 2000]
+"""
+
+from uuid import uuid4
+import argparse
+import time
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.product_import import JSONL, ProductImporter, parse_lines
+from app.schemas import ProductSync, SyncPushRequest
+from app.sync_engine import AgrotourSyncEngine
+
+
+def catalog(count: int):
+    for i in range(count):
+        yield f'{{"sku": "780{i:010d}", "name": "Producto {i}", "price": {1000 + i % 500}, "category": "C{i % 40}"}}\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", default="sqlite:///product_import.db")
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--pushed", type=int, default=2_000, help="Products timed through push (extrapolated)")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    SQLModel.metadata.create_all(engine)
+    user_id, device_id = uuid4(), uuid4()
+
+    print(f"products: {args.products}")
+
+    tenant_id = uuid4()
+    with Session(engine) as session:
+        summary = ProductImporter(session, tenant_id, user_id, device_id).run(parse_lines(catalog(args.products), JSONL))
+    print(f"  bulk import   {summary['seconds']:8.2f} s  ({summary['created']} created)")
+
+    tenant_id = uuid4()
+    with Session(engine) as session:
+        start = time.perf_counter()
+        for i in range(args.pushed):
+            request = SyncPushRequest(
+                products=[ProductSync(
+                    id=uuid4(), tenant_id=tenant_id, name=f"Producto {i}", price=1000.0, sku=f"780{i:010d}",
+                    current_stock=0, device_id=device_id, device_type="WEB", created_by=user_id, updated_by=user_id
+                )],
+                client_lamport=0,
+                device_id=device_id
+            )
+            AgrotourSyncEngine(session).apply_push(request)
+            session.commit()
+        seconds = time.perf_counter() - start
+    print(f"  /sync/push    {seconds / args.pushed * args.products:8.2f} s  (extrapolated from {args.pushed})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark: database round trips of a push batch, per-event lookups vs the
+batch prefetch of AgrotourSyncEngine.apply_push, under network latency.
+
+Usage:
+    python -m benchmarks.push_round_trips [--database-url URL] [--events 200]
+        [--batch 50] [--latency-ms 2]
+
+--latency-ms sleeps before every statement and commit to emulate the round
+trip to a remote database. For a real network delay on a local Postgres, run
+with --latency-ms 0 and shape the loopback instead:
+    sudo tc qdisc add dev lo root netem delay 1ms   # removed with: tc qdisc del dev lo root
+"""
+
+from uuid import uuid4
+import argparse
+import time
+
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.models import StockEvent
+from app.schemas import SyncPushRequest
+from app.sync_engine import AgrotourSyncEngine
+
+
+def _batch(size: int, lamport: int) -> SyncPushRequest:
+    tenant_id, device_id, user_id = uuid4(), uuid4(), uuid4()
+    return SyncPushRequest(
+        operations=[{
+            "tenant_id": tenant_id, "product_id": uuid4(), "device_id": device_id,
+            "device_type": "MOBILE", "operation": "DECREMENT", "delta": 1, "reason": "SALE",
+            "lamport_ts": lamport, "created_by": user_id, "updated_by": user_id
+        } for _ in range(size)],
+        client_lamport=lamport,
+        device_id=device_id
+    )
+
+
+def per_event(session: Session, request: SyncPushRequest) -> None:
+    """The previous hot path: every event runs its own lookups."""
+    engine = AgrotourSyncEngine(session)
+    for operation_data in request.operations:
+        operation = StockEvent(**operation_data.model_dump())
+        operation.operation_hash = operation.compute_operation_hash()
+        engine.accept_operation(operation)
+
+
+def batched(session: Session, request: SyncPushRequest) -> None:
+    AgrotourSyncEngine(session).apply_push(request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", default="sqlite:///push_round_trips.db")
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    SQLModel.metadata.create_all(engine)
+
+    round_trips = [0]
+    delay = args.latency_ms / 1000
+
+    def round_trip(*_):
+        round_trips[0] += 1
+        if delay:
+            time.sleep(delay)
+
+    event.listen(engine, "before_cursor_execute", round_trip)
+    event.listen(engine, "commit", round_trip)
+
+    print(f"events: {args.events} in batches of {args.batch}, {args.latency_ms} ms per round trip")
+    timings = {}
+    for label, apply in [("per-event lookups", per_event), ("batch prefetch", batched)]:
+        round_trips[0] = 0
+        start = time.perf_counter()
+        with Session(engine) as session:
+            for lamport in range(0, args.events, args.batch):
+                apply(session, _batch(min(args.batch, args.events - lamport), lamport + 1))
+        seconds = timings[label] = time.perf_counter() - start
+        print(f"  {label:<20} {seconds:7.2f} s  {args.events / seconds:8,.0f} events/s  "
+              f"{round_trips[0] / args.events:5.2f} round trips/event")
+
+    print(f"  speedup: {timings['per-event lookups'] / timings['batch prefetch']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
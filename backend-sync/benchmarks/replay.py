@@ -0,0 +1,157 @@
+"""
+Replay a sanitized traffic capture against a running sync service.
+
+Capture production-like traffic first by starting the service with
+SYNC_CAPTURE_PATH=capture.jsonl (see app/traffic.py), then:
+
+Usage:
+    python -m benchmarks.replay capture.jsonl [--url http://localhost:8001]
+        [--speed 10] [--devices 20] [--concurrency 200]
+
+Each captured device is replayed as --devices simulated devices contending on
+the same tenants and products; --speed compresses the captured timeline.
+"""
+
+from collections import Counter, defaultdict
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import math
+import time
+
+import httpx
+
+from app.traffic import virtual_device
+
+
+def load_capture(path: str, limit: int = 0) -> List[Dict]:
+    records = []
+    with open(path) as capture:
+        for line in capture:
+            if line.strip():
+                records.append(json.loads(line))
+                if limit and len(records) == limit:
+                    break
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class ReplayStats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Counter = Counter()
+        self.results: Counter = Counter()
+        self.operations = 0
+        self.errors = 0
+        self.max_lag = 0.0
+
+    def record(self, path: str, latency_ms: float, response: httpx.Response) -> None:
+        self.latencies[path].append(latency_ms)
+        self.statuses[response.status_code] += 1
+
+        if path == "/sync/push" and response.status_code == 200:
+            results = response.json().get("results", [])
+            self.operations += len(results)
+            self.results.update(r.get("status", "unknown") for r in results)
+
+    def report(self, elapsed: float, args) -> str:
+        requests = sum(len(v) for v in self.latencies.values())
+        lines = [
+            f"replayed {requests} requests in {elapsed:.1f} s "
+            f"(speed {args.speed}x, {args.devices} devices per captured device)",
+            f"  throughput: {requests / elapsed:,.1f} req/s, {self.operations / elapsed:,.1f} pushed items/s",
+            f"  max dispatch lag: {self.max_lag * 1000:.0f} ms",
+        ]
+        for path, values in sorted(self.latencies.items()):
+            values.sort()
+            lines.append(
+                f"  {path:<12} n={len(values):<7} p50={percentile(values, 50):7.1f} ms  "
+                f"p90={percentile(values, 90):7.1f} ms  p99={percentile(values, 99):7.1f} ms  "
+                f"max={values[-1]:7.1f} ms"
+            )
+        lines.append(f"  status codes: {dict(sorted(self.statuses.items()))}  transport errors: {self.errors}")
+        if self.operations:
+            shares = "  ".join(
+                f"{status} {count / self.operations:.1%}" for status, count in self.results.most_common()
+            )
+            lines.append(f"  push results: {shares}")
+            lines.append(f"  conflict rate: {self.results['conflict'] / self.operations:.2%}")
+        return "\n".join(lines)
+
+
+async def _send(client: httpx.AsyncClient, record: Dict, stats: ReplayStats, slots: asyncio.Semaphore):
+    path = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    try:
+        start = time.perf_counter()
+        response = await client.request(
+            record["method"], path,
+            content=json.dumps(record["body"]).encode(),
+            headers=record["headers"]
+        )
+        stats.record(record["path"], (time.perf_counter() - start) * 1000, response)
+    except httpx.HTTPError as e:
+        stats.errors += 1
+        print(f"[WARN] {record['path']}: {e!r}")
+    finally:
+        slots.release()
+
+
+async def replay(records: List[Dict], args, transport=None) -> ReplayStats:
+    """Send every record (times --devices clones) on the compressed timeline."""
+    stats = ReplayStats()
+    slots = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=args.url, timeout=args.timeout, limits=limits, transport=transport
+    ) as client:
+        tasks = []
+        origin = records[0]["t"] if records else 0
+        start = time.perf_counter()
+
+        for record in records:
+            due = (record["t"] - origin) / args.speed
+            delay = due - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                stats.max_lag = max(stats.max_lag, -delay)
+
+            for copy in range(args.devices):
+                await slots.acquire()
+                tasks.append(asyncio.create_task(_send(client, virtual_device(record, copy), stats, slots)))
+
+        await asyncio.gather(*tasks)
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a sanitized sync traffic capture")
+    parser.add_argument("capture", help="JSONL capture written with SYNC_CAPTURE_PATH")
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--speed", type=float, default=1.0, help="Timeline compression factor")
+    parser.add_argument("--devices", type=int, default=1, help="Simulated devices per captured device")
+    parser.add_argument("--concurrency", type=int, default=100, help="Max requests in flight")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--limit", type=int, default=0, help="Only replay the first N captured requests")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture, args.limit)
+    print(f"[INFO] Replaying {len(records)} captured requests against {args.url}")
+
+    start = time.perf_counter()
+    stats = asyncio.run(replay(records, args))
+    print(stats.report(time.perf_counter() - start, args))
+
+
+if __name__ == "__main__":
+    main()
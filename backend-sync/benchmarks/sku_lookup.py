@@ -0,0 +1,58 @@
+"""
+Benchmark: scan-to-product latency, (tenant_id, sku) index vs the SKU cache.
+
+Usage:
+    python -m benchmarks.sku_lookup [--database-url URL] [--products 20000] [--scans 5000]
+"""
+
+from uuid import uuid4
+import argparse
+import random
+import time
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from app import catalog
+from app.catalog import lookup_skus
+from app.models import Product
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", default="sqlite:///sku_lookup.db")
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--scans", type=int, default=5_000)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    SQLModel.metadata.create_all(engine)
+    tenant_id, user_id, device_id = uuid4(), uuid4(), uuid4()
+    skus = [f"780{i:010d}" for i in range(args.products)]
+
+    with Session(engine) as session:
+        session.add_all(
+            Product(
+                tenant_id=tenant_id, name=f"Product {sku}", price=1000.0, sku=sku,
+                device_id=device_id, device_type="WEB", created_by=user_id, updated_by=user_id
+            )
+            for sku in skus
+        )
+        session.commit()
+
+    # A counter sells the same few hundred products all day
+    scans = random.choices(skus[:500], k=args.scans)
+
+    print(f"products: {args.products}, scans: {args.scans}")
+    for label, size in [("index only", 0), ("SKU cache", catalog.SKU_CACHE_SIZE)]:
+        catalog.SKU_CACHE_SIZE, catalog._cache = size, None
+        with Session(engine) as session:
+            lookup_skus(session, tenant_id, set(scans))  # Warm up
+            start = time.perf_counter()
+            for sku in scans:
+                lookup_skus(session, tenant_id, [sku])
+            seconds = time.perf_counter() - start
+        print(f"  {label:<12} {seconds / args.scans * 1000:8.3f} ms/scan")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Tests for the cold-storage archive of stock events.
+"""
+
+import pytest
+from datetime import datetime, timedelta
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app.archive import ArchiveStore, Archiver
+from app.database import get_session
+from app.main import app
+from app.models import StockEvent, StockRollup, SyncDevice
+from app.rebuild import rebuild
+import app.rebuild as rebuild_module
+from app.rollups import RollupStore
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def _seed(session, tenant_id, product_id, ages_days, pulled=None):
+    """One event per age (oldest first) and a device that pulled up to `pulled`."""
+    user_id = uuid4()
+    now = datetime.utcnow()
+    events = [StockEvent(
+        tenant_id=tenant_id, product_id=product_id, device_id=uuid4(), device_type="MOBILE",
+        operation="INCREMENT" if i == 0 else "DECREMENT", delta=100 if i == 0 else -i,
+        reason="RESTOCK" if i == 0 else "SALE", amount=None if i == 0 else 500.0 * i,
+        lamport_ts=i + 1, created_at=now - timedelta(days=age), operation_hash=uuid4().hex,
+        created_by=user_id, updated_by=user_id
+    ) for i, age in enumerate(ages_days)]
+    session.add_all(events)
+    RollupStore(session).add(events)
+    session.add(SyncDevice(tenant_id=tenant_id, device_id=uuid4(), last_pulled_lamport=pulled or len(events)))
+    session.commit()
+    return events
+
+
+def test_archive_moves_cold_events(session, tmp_path):
+    tenant_id, product_id = uuid4(), uuid4()
+    events = _seed(session, tenant_id, product_id, [500, 450, 400, 10, 400], pulled=5)
+    store = ArchiveStore(str(tmp_path))
+
+    result = Archiver(session, store, after_days=365, batch_size=2).archive(tenant_id)
+
+    # The newest event (lamport 5) stays even though it is old
+    assert result["events"] == 3
+    hot = session.exec(select(StockEvent.lamport_ts).order_by(StockEvent.lamport_ts)).all()
+    assert hot == [4, 5]
+
+    archived = store.events(tenant_id)
+    assert [e.lamport_ts for e in archived] == [1, 2, 3]
+    assert archived[0].id == events[0].id
+    assert archived[1].created_at == events[1].created_at
+    assert store.events(tenant_id, [uuid4()]) == []
+    assert store.tenants() == [tenant_id]
+
+
+def test_archive_respects_safe_horizon(session, tmp_path):
+    tenant_id = uuid4()
+    _seed(session, tenant_id, uuid4(), [500, 480, 460, 440], pulled=1)
+
+    result = Archiver(session, ArchiveStore(str(tmp_path))).archive(tenant_id)
+
+    assert result["events"] == 1
+
+
+def test_rebuild_replays_archived_events(tmp_path):
+    url = f"sqlite:///{tmp_path / 'sync.db'}"
+    engine = create_engine(url)
+    SQLModel.metadata.create_all(engine)
+    tenant_id, product_id = uuid4(), uuid4()
+    archive = tmp_path / "archive"
+
+    with Session(engine) as session:
+        _seed(session, tenant_id, product_id, [500, 450, 400, 10])
+        before = sorted((r.granularity, r.bucket_start, r.net_delta) for r in session.exec(select(StockRollup)))
+        Archiver(session, ArchiveStore(str(archive))).archive(tenant_id)
+
+    totals = rebuild(url, workers=1, archive_path=str(archive))
+
+    assert totals["events"] == 4
+    with Session(engine) as session:
+        after = sorted((r.granularity, r.bucket_start, r.net_delta) for r in session.exec(select(StockRollup)))
+    assert after == before
+
+
+def test_audit_history_spans_both_tiers(session, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tenant_id, product_id = uuid4(), uuid4()
+    _seed(session, tenant_id, product_id, [500, 450, 10])
+    Archiver(session, ArchiveStore()).archive(tenant_id)
+
+    app.dependency_overrides[get_session] = lambda: session
+    try:
+        response = TestClient(app).get(
+            f"/audit/products/{product_id}/events", headers={"X-Tenant-ID": str(tenant_id)}
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+    body = response.json()
+    assert body["archived"] == 2
+    assert [e["lamport_ts"] for e in body["events"]] == [1, 2, 3]
+
+
+def test_rebuild_reads_the_archive_in_bounded_groups(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'sync.db'}"
+    engine = create_engine(url)
+    SQLModel.metadata.create_all(engine)
+    tenant_id = uuid4()
+    archive = tmp_path / "archive"
+    products = [uuid4() for _ in range(3)]
+
+    with Session(engine) as session:
+        for product_id in products:
+            _seed(session, tenant_id, product_id, [500, 450, 10])
+        before = sorted((str(r.product_id), r.granularity, r.bucket_start, r.net_delta)
+                        for r in session.exec(select(StockRollup)))
+        Archiver(session, ArchiveStore(str(archive))).archive(tenant_id)
+
+    reads = []
+    events = ArchiveStore.events
+    monkeypatch.setattr(rebuild_module, "ARCHIVE_GROUP_EVENTS", 2)
+    monkeypatch.setattr(ArchiveStore, "events", lambda self, tid, product_ids=None, *args: (
+        reads.append(len(product_ids)) or events(self, tid, product_ids, *args)
+    ))
+
+    totals = rebuild(url, workers=1, archive_path=str(archive))
+
+    # At most one product's archived events (2 each) in memory at a time
+    assert reads == [1, 1, 1]
+    assert totals["events"] == 9
+    with Session(engine) as session:
+        after = sorted((str(r.product_id), r.granularity, r.bucket_start, r.net_delta)
+                       for r in session.exec(select(StockRollup)))
+    assert after == before
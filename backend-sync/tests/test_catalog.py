@@ -0,0 +1,104 @@
+"""
+Tests for SKU lookups and the per-tenant SKU cache.
+"""
+
+import pytest
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel
+from sqlmodel.pool import StaticPool
+
+from app import catalog
+from app.main import app
+from app.database import get_session
+from app.catalog import SkuCache
+from app.models import Product
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session, monkeypatch):
+    """Test client bound to the in-memory session, with a fresh SKU cache."""
+    monkeypatch.setattr(catalog, "_cache", None)
+    app.dependency_overrides[get_session] = lambda: session
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def _product(session, tenant_id, sku, price=1000.0):
+    user_id = uuid4()
+    product = Product(
+        tenant_id=tenant_id, name=f"Producto {sku}", price=price, sku=sku, current_stock=5,
+        device_id=uuid4(), device_type="WEB", created_by=user_id, updated_by=user_id
+    )
+    session.add(product)
+    session.commit()
+    session.refresh(product)
+    return product
+
+
+def test_sku_is_unique_per_tenant(client: TestClient, session: Session):
+    tenant_a, tenant_b = uuid4(), uuid4()
+    _product(session, tenant_a, "7801234567890", price=3500.0)
+    _product(session, tenant_b, "7801234567890", price=4200.0)
+
+    response = client.get("/products/by-sku/7801234567890%0A", headers={"X-Tenant-ID": str(tenant_b)})
+    assert response.status_code == 200
+    assert response.json()["price"] == 4200.0
+
+    assert client.get("/products/by-sku/000", headers={"X-Tenant-ID": str(tenant_a)}).status_code == 404
+
+
+def test_batch_lookup_is_cached_until_state_sync(client: TestClient, session: Session):
+    tenant_id = uuid4()
+    headers = {"X-Tenant-ID": str(tenant_id)}
+    honey = _product(session, tenant_id, "MIEL-500")
+    _product(session, tenant_id, "MERKEN-100")
+
+    body = client.post("/products/lookup", json={"skus": ["MIEL-500", "MERKEN-100", "NOPE"]}, headers=headers).json()
+    assert sorted(body["products"]) == ["MERKEN-100", "MIEL-500"]
+    assert body["missing"] == ["NOPE"]
+
+    client.post("/products/lookup", json={"skus": ["MIEL-500", "NOPE"]}, headers=headers)
+    cache = catalog.get_sku_cache()
+    assert (cache.hits, cache.misses) == (2, 3)
+
+    # A pushed price change drops the tenant's cached products
+    user_id = str(uuid4())
+    client.post("/sync/push", json={
+        "products": [{
+            "id": str(honey.id), "tenant_id": str(tenant_id), "name": honey.name, "price": 5500.0,
+            "sku": "MIEL-500", "current_stock": 5, "device_id": str(uuid4()), "device_type": "WEB",
+            "lamport_ts": honey.lamport_ts + 10, "created_by": user_id, "updated_by": user_id
+        }],
+        "client_lamport": honey.lamport_ts + 10, "device_id": str(uuid4())
+    }, headers=headers)
+    assert client.get("/products/by-sku/MIEL-500", headers=headers).json()["price"] == 5500.0
+
+
+def test_lru_eviction():
+    cache = SkuCache(size=2, tenants=1, ttl=60)
+    tenant_a, tenant_b = uuid4(), uuid4()
+    cache.put_many(tenant_a, {"A": {"sku": "A"}, "B": {"sku": "B"}})
+    cache.get_many(tenant_a, ["A"])
+    cache.put_many(tenant_a, {"C": {"sku": "C"}})
+
+    found, missing = cache.get_many(tenant_a, ["A", "B", "C"])
+    assert sorted(found) == ["A", "C"] and missing == ["B"]
+
+    # One tenant slot: tenant_b evicts tenant_a
+    cache.put_many(tenant_b, {"A": None})
+    assert cache.get_many(tenant_a, ["A"]) == ({}, ["A"])
+    assert cache.get_many(tenant_b, ["A"]) == ({"A": None}, [])
@@ -0,0 +1,228 @@
+"""
+Tests for the compiled conflict resolution rule table.
+"""
+
+import itertools
+import pytest
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app import conflict_rules
+from app.conflict_rules import DEFAULT_RULES, CompiledRuleTable, InvalidRuleTable, compile_rules
+from app.database import get_session
+from app.main import app
+from app.models import ConflictRuleSet, StockEvent, SyncConflict
+from app.schemas import SyncPushRequest
+from app.sync_engine import AgrotourSyncEngine
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def _op(operation="DECREMENT", payment_status=None, lamport_ts=1, tenant_id=None):
+    user_id = uuid4()
+    return StockEvent(
+        tenant_id=tenant_id or uuid4(), product_id=uuid4(), device_id=uuid4(),
+        device_type="MOBILE", operation=operation, delta=1, reason="SALE",
+        payment_status=payment_status, lamport_ts=lamport_ts, operation_hash="",
+        created_by=user_id, updated_by=user_id
+    )
+
+
+def test_default_rules():
+    """The default table keeps the three-tier behaviour."""
+    table = compile_rules(DEFAULT_RULES)
+    
+    paid, pending = _op(payment_status="PAID"), _op(payment_status="PENDING")
+    resolution = table.resolve(paid, pending)
+    assert (resolution.winner_id, resolution.method) == (paid.id, "HARDCODED")
+    assert table.resolve(pending, paid).winner_id == paid.id
+    
+    sale, restock = _op("DECREMENT", lamport_ts=5), _op("INCREMENT", lamport_ts=2)
+    assert table.resolve(sale, restock).confidence == 0.95
+    
+    early, late = _op("INCREMENT", lamport_ts=1), _op("INCREMENT", lamport_ts=2)
+    resolution = table.resolve(early, late)
+    assert (resolution.winner_id, resolution.method) == (early.id, "HEURISTIC")
+    
+    resolution = table.resolve(late, early)
+    assert resolution.method == "MANUAL"
+    assert resolution.requires_approval
+
+
+def test_batch_matches_single_pair():
+    """Scoring a batch gives the same answers as pair by pair."""
+    table = compile_rules(DEFAULT_RULES)
+    ops = [
+        _op(operation, status, lamport)
+        for operation, status, lamport in itertools.product(
+            ["INCREMENT", "DECREMENT", "SET"], ["PAID", "PENDING", None], [1, 2]
+        )
+    ]
+    pairs = list(itertools.product(ops, ops))
+    
+    batch = table.resolve_batch(pairs)
+    single = [table.resolve(a, b) for a, b in pairs]
+    
+    assert [(r.winner_id, r.method) for r in batch] == [(r.winner_id, r.method) for r in single]
+
+
+def test_tenant_rule_table(session: Session):
+    """A tenant table overrides the defaults; unmatched pairs fall back to MANUAL."""
+    tenant_id = uuid4()
+    session.add(ConflictRuleSet(tenant_id=tenant_id, rules=[{
+        "name": "restock_wins",
+        "when": [["new.operation", "in", ["INCREMENT"]]],
+        "winner": "new",
+        "method": "HARDCODED",
+        "reason": "Restocks first at this cooperative"
+    }]))
+    session.commit()
+    
+    engine = AgrotourSyncEngine(session)
+    restock = _op("INCREMENT", tenant_id=tenant_id)
+    paid_sale = _op("DECREMENT", "PAID", tenant_id=tenant_id)
+    
+    resolutions = engine.resolve_conflicts(tenant_id, [(restock, paid_sale), (paid_sale, restock)])
+    assert resolutions[0].winner_id == restock.id
+    assert resolutions[1].method == "MANUAL"
+
+
+def _new_session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    return Session(engine)
+
+
+def test_push_resolves_conflicts_in_one_pass(monkeypatch):
+    """A push scores its conflicts in one batch and answers as if applied event by event."""
+    tenant_id, product_id, user_id = uuid4(), uuid4(), uuid4()
+    device_a, device_b, device_c = uuid4(), uuid4(), uuid4()
+
+    def event(device_id, operation, payment_status=None):
+        return {
+            "tenant_id": tenant_id, "product_id": product_id, "device_id": device_id,
+            "device_type": "MOBILE", "operation": operation, "delta": 1, "reason": "SALE",
+            "payment_status": payment_status, "created_by": user_id, "updated_by": user_id,
+            "operation_hash": uuid4().hex
+        }
+
+    restock = event(device_a, "INCREMENT")
+    batch = [
+        event(device_b, "DECREMENT", "PAID"),  # Paid sale wins over the restock
+        event(device_b, "INCREMENT"),          # Held for approval
+        event(device_c, "DECREMENT"),          # Conflicts with the paid sale, not the held restock
+    ]
+
+    def outcomes(session):
+        conflicts = session.exec(select(SyncConflict).order_by(SyncConflict.detected_at)).all()
+        return [(c.resolution_method, c.resolution_reason, c.status) for c in conflicts]
+
+    # Reference: the same events accepted one by one
+    with _new_session() as session:
+        engine = AgrotourSyncEngine(session)
+        expected = [engine.accept_operation(StockEvent(**data))["status"] for data in [restock, *batch]]
+        expected_conflicts = outcomes(session)
+
+    calls = []
+    resolve_batch = CompiledRuleTable.resolve_batch
+    monkeypatch.setattr(
+        CompiledRuleTable, "resolve_batch",
+        lambda self, pairs: calls.append(len(pairs)) or resolve_batch(self, pairs)
+    )
+
+    with _new_session() as session:
+        statuses = [AgrotourSyncEngine(session).accept_operation(StockEvent(**restock))["status"]]
+        results = AgrotourSyncEngine(session).apply_push(
+            SyncPushRequest(operations=batch, client_lamport=1, device_id=device_b)
+        )
+        statuses += [r["status"] for r in results]
+
+        assert statuses == expected == ["accepted", "accepted", "conflict", "accepted"]
+        assert outcomes(session) == expected_conflicts
+        assert expected_conflicts[-1][1] == "Existing operation is a paid sale"
+        assert calls == [3]
+
+
+@pytest.mark.parametrize("rules", [
+    [{"when": [["new.__class__", "eq", 1]], "winner": "new"}],
+    [{"when": [["new.operation", "eq", {"x": 1}]], "winner": "new"}],
+    [{"when": [["new.operation", "matches", "SALE"]], "winner": "new"}],
+    [{"when": [["new.operation", "eq", "SALE"]], "winner": "nobody"}],
+    [{"when": [["new.operation", "in", "DECREMENT"]], "winner": "new"}],
+    [{"when": [["new.delta", "not_in", 1]], "winner": "new"}],
+    [{"when": [["new.operation", "eq", ["SALE"]]], "winner": "new"}],
+    [{"when": [["new.amount", "gt", float("nan")]], "winner": "new"}],
+    [{"when": [["new.amount", "in", [float("inf")]]], "winner": "new"}],
+    [{"when": [["new.amount", "lt", None]], "winner": "new"}],
+    [{"when": [["new.operation", "lt", 5]], "winner": "new"}],
+    [{"when": [["new.amount", "ge", {"field": "existing.operation"}]], "winner": "new"}],
+    ["not a rule"],
+    [{"when": 5, "winner": "new"}],
+    [{"when": {"new.operation": "SALE"}, "winner": "new"}],
+    [{"when": [], "winner": "new", "confidence": "high"}],
+    [{"when": [], "winner": "new", "confidence": 1.5}],
+    [{"when": [], "winner": "new", "confidence": True}],
+    [{"when": [], "winner": "new", "requires_approval": "yes"}],
+])
+def test_invalid_rules_are_rejected(rules):
+    """Only known fields, operators suited to their operand and finite literals compile."""
+    with pytest.raises(InvalidRuleTable):
+        compile_rules(rules)
+
+
+def test_malformed_rule_table_is_a_client_error(session: Session):
+    app.dependency_overrides[get_session] = lambda: session
+    try:
+        response = TestClient(app).put(
+            "/sync/conflict-rules", json={"rules": [{"when": 5, "winner": "new"}]},
+            headers={"X-Tenant-ID": str(uuid4())}
+        )
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Rule 0: when must be a list of conditions"
+
+
+def test_ordered_comparison_skips_null_fields():
+    """lt/gt on a nullable field do not match (nor raise) when it is null."""
+    table = compile_rules([{
+        "when": [["new.amount", "gt", 1000], ["new.device_seq", "gt", {"field": "existing.device_seq"}]],
+        "winner": "new",
+        "method": "HEURISTIC"
+    }])
+    new_op, existing_op = _op(), _op()
+    
+    assert table.resolve(new_op, existing_op).method == "MANUAL"
+    assert table.resolve_batch([(new_op, existing_op)])[0].method == "MANUAL"
+    
+    new_op.amount, new_op.device_seq, existing_op.device_seq = 5000.0, 2, 1
+    assert table.resolve(new_op, existing_op).method == "HEURISTIC"
+    assert table.resolve_batch([(new_op, existing_op)])[0].method == "HEURISTIC"
+
+
+def test_compiled_tables_are_bounded(monkeypatch):
+    """Only the most recently used distinct tables stay compiled."""
+    monkeypatch.setattr(conflict_rules, "COMPILED_TABLES_LIMIT", 2)
+    monkeypatch.setattr(conflict_rules, "_compiled_tables", conflict_rules.OrderedDict())
+    tables = [[{"when": [["new.delta", "eq", delta]], "winner": "new"}] for delta in range(3)]
+    
+    first = compile_rules(tables[0])
+    compile_rules(tables[1])
+    assert compile_rules(tables[0]) is first
+    compile_rules(tables[2])
+    
+    assert len(conflict_rules._compiled_tables) == 2
+    assert compile_rules(tables[0]) is first
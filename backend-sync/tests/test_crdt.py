@@ -0,0 +1,98 @@
+"""
+Tests for the PN-counter CRDT stock mode.
+"""
+
+import pytest
+from uuid import uuid4
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app.crdt import StockCounterStore
+from app.models import Product, StockEvent, SyncConflict
+from app.schemas import StockCounterSync, SyncPushRequest
+from app.sync_engine import AgrotourSyncEngine
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def _product(session, tenant_id):
+    product = Product(
+        tenant_id=tenant_id, name="Miel", price=4500.0, sku=f"SKU-{uuid4().hex[:8]}",
+        device_id=uuid4(), device_type="WEB", created_by=uuid4(), updated_by=uuid4()
+    )
+    session.add(product)
+    session.commit()
+    return product.id
+
+
+def test_merge_is_idempotent_and_order_independent(session: Session):
+    """Per-device max merge: stale or repeated states change nothing."""
+    tenant_id = uuid4()
+    product_id = _product(session, tenant_id)
+    store = StockCounterStore(session)
+    pos, warehouse = uuid4(), uuid4()
+    
+    def counter(device_id, p, n):
+        return StockCounterSync(
+            tenant_id=tenant_id, product_id=product_id, device_id=device_id,
+            increments=p, decrements=n
+        )
+    
+    store.merge([counter(warehouse, 50, 0), counter(pos, 0, 7)])
+    store.merge([counter(pos, 0, 12)])
+    results = store.merge([counter(pos, 0, 9), counter(warehouse, 50, 0)])
+    
+    assert results[0] == {"status": "merged", "product_id": str(product_id), "stock": 38}
+    assert store.stock(tenant_id, product_id) == 38
+    assert session.get(Product, product_id).current_stock == 38
+
+
+def test_crdt_mode_skips_conflict_detection(session: Session):
+    """Concurrent stock deltas never produce conflicts in CRDT mode."""
+    tenant_id = uuid4()
+    product_id = _product(session, tenant_id)
+    user_id = uuid4()
+    engine = AgrotourSyncEngine(session, stock_mode="CRDT")
+    
+    for operation, lamport in [("INCREMENT", 1), ("DECREMENT", 2), ("DECREMENT", 2)]:
+        event = StockEvent(
+            tenant_id=tenant_id, product_id=product_id, device_id=uuid4(),
+            device_type="MOBILE", operation=operation, delta=3, reason="SALE",
+            lamport_ts=lamport, created_by=user_id, updated_by=user_id, operation_hash=""
+        )
+        event.operation_hash = event.compute_operation_hash()
+        assert engine.accept_operation(event)["status"] == "accepted"
+    
+    assert session.exec(select(SyncConflict)).all() == []
+
+
+@pytest.mark.parametrize("mode, status, stock", [("EVENTS", "rejected", 0), ("CRDT", "merged", 5)])
+def test_counters_only_merge_in_crdt_mode(session: Session, mode, status, stock):
+    """In EVENTS mode a pushed counter must not overwrite the product's stock."""
+    tenant_id = uuid4()
+    product_id = _product(session, tenant_id)
+    request = SyncPushRequest(
+        counters=[StockCounterSync(
+            tenant_id=tenant_id, product_id=product_id, device_id=uuid4(), increments=5, decrements=0
+        )],
+        client_lamport=0,
+        device_id=uuid4()
+    )
+    
+    results = AgrotourSyncEngine(session, stock_mode=mode).apply_push(request)
+    
+    assert results[0]["status"] == status
+    session.expire_all()
+    assert session.get(Product, product_id).current_stock == stock
+    assert StockCounterStore(session).stock(tenant_id, product_id) == stock
@@ -0,0 +1,172 @@
+"""
+Tests for the device registry: cursors, echo suppression and lag metrics.
+"""
+
+import pytest
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel
+from sqlmodel.pool import StaticPool
+
+from app.main import app
+from app.database import get_session
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    """Test client bound to the in-memory session (no startup hooks)."""
+    app.dependency_overrides[get_session] = lambda: session
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def _push(client, tenant_id, device_id, count):
+    user_id = str(uuid4())
+    operations = [{
+        "tenant_id": tenant_id,
+        "product_id": str(uuid4()),
+        "device_id": device_id,
+        "device_type": "MOBILE",
+        "operation": "INCREMENT",
+        "delta": 1,
+        "reason": "RESTOCK",
+        "lamport_ts": i + 1,
+        "created_by": user_id,
+        "updated_by": user_id
+    } for i in range(count)]
+    response = client.post(
+        "/sync/push",
+        json={"operations": operations, "client_lamport": count, "device_id": device_id},
+        headers={"X-Tenant-ID": tenant_id}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def _pull(client, tenant_id, device_id, last_lamport):
+    response = client.post(
+        "/sync/pull",
+        json={"tenant_id": tenant_id, "last_lamport": last_lamport, "device_id": device_id},
+        headers={"X-Tenant-ID": tenant_id}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_pull_skips_own_operations(client: TestClient):
+    """A device never gets its own ops back, but its cursor still advances."""
+    tenant_id = str(uuid4())
+    device_a, device_b = str(uuid4()), str(uuid4())
+    
+    pushed = _push(client, tenant_id, device_a, 3)
+    
+    own = _pull(client, tenant_id, device_a, 0)
+    assert own["operations"] == []
+    assert own["next_lamport"] == pushed["server_lamport"]
+    
+    other = _pull(client, tenant_id, device_b, 0)
+    assert len(other["operations"]) == 3
+    assert other["next_lamport"] == pushed["server_lamport"]
+
+
+def test_device_lag_metrics(client: TestClient):
+    """Lag and backlog are reported per device."""
+    tenant_id = str(uuid4())
+    device_a, device_b = str(uuid4()), str(uuid4())
+    
+    pushed = _push(client, tenant_id, device_a, 4)
+    _pull(client, tenant_id, device_b, 0)
+    
+    response = client.get("/sync/devices", headers={"X-Tenant-ID": tenant_id})
+    assert response.status_code == 200
+    devices = {d["device_id"]: d for d in response.json()["devices"]}
+    
+    assert devices[device_a]["last_pushed_lamport"] == pushed["server_lamport"]
+    assert devices[device_a]["backlog"] == 0
+    assert devices[device_b]["lag"] == pushed["server_lamport"]
+    assert devices[device_b]["backlog"] == 4
+    
+    metrics = client.get("/sync/devices/metrics", headers={"X-Tenant-ID": tenant_id}).text
+    assert f'agrotour_sync_device_backlog{{tenant_id="{tenant_id}",device_id="{device_b}"}} 4' in metrics
+
+
+def _chained(tenant_id, device_id, seqs):
+    """Events 1..n of a device's hash chain, keyed by device_seq."""
+    user_id = str(uuid4())
+    events, prev_hash = {}, None
+    for seq in seqs:
+        operation_hash = uuid4().hex
+        events[seq] = {
+            "tenant_id": tenant_id, "product_id": str(uuid4()), "device_id": device_id,
+            "device_type": "MOBILE", "operation": "INCREMENT", "delta": 1, "reason": "RESTOCK",
+            "lamport_ts": seq, "operation_hash": operation_hash, "device_seq": seq, "prev_hash": prev_hash,
+            "created_by": user_id, "updated_by": user_id
+        }
+        prev_hash = operation_hash
+    return events
+
+
+def _push_events(client, tenant_id, device_id, events):
+    response = client.post(
+        "/sync/push",
+        json={"operations": events, "client_lamport": 1, "device_id": device_id},
+        headers={"X-Tenant-ID": tenant_id}
+    )
+    assert response.status_code == 200
+    return [r["status"] for r in response.json()["results"]], response.json()["results"]
+
+
+def test_hash_chain_gap_is_resent(client: TestClient):
+    """A push missing earlier events gets exactly the missing range back."""
+    tenant_id, device_id = str(uuid4()), str(uuid4())
+    events = _chained(tenant_id, device_id, range(1, 6))
+    
+    statuses, _ = _push_events(client, tenant_id, device_id, [events[1], events[2]])
+    assert statuses == ["accepted", "accepted"]
+    
+    # Events 3 and 4 were lost on the device
+    statuses, results = _push_events(client, tenant_id, device_id, [events[5]])
+    assert statuses == ["gap"]
+    assert results[0]["missing"] == {"from_seq": 3, "to_seq": 4}
+    assert results[0]["chain_hash"] == events[2]["operation_hash"]
+    
+    statuses, _ = _push_events(client, tenant_id, device_id, [events[3], events[4], events[5]])
+    assert statuses == ["accepted"] * 3
+    
+    devices = client.get("/sync/devices", headers={"X-Tenant-ID": tenant_id}).json()["devices"]
+    assert devices[0]["chain_seq"] == 5
+
+
+def test_hash_chain_fork(client: TestClient):
+    """An event that does not link to the server's head is a fork; unchained events skip the check."""
+    tenant_id, device_id = str(uuid4()), str(uuid4())
+    events = _chained(tenant_id, device_id, range(1, 3))
+    _push_events(client, tenant_id, device_id, [events[1], events[2]])
+    
+    # A restored backup rewrote event 2
+    restored = _chained(tenant_id, device_id, range(1, 4))
+    restored[3]["prev_hash"] = uuid4().hex
+    statuses, results = _push_events(client, tenant_id, device_id, [restored[3]])
+    assert statuses == ["fork"]
+    assert results[0]["chain_seq"] == 2
+    
+    # Replayed events are duplicates, not forks
+    statuses, _ = _push_events(client, tenant_id, device_id, [events[2]])
+    assert statuses == ["duplicate"]
+    
+    unchained = dict(events[1], operation_hash=uuid4().hex, device_seq=None, prev_hash=None)
+    statuses, _ = _push_events(client, tenant_id, device_id, [unchained])
+    assert statuses == ["accepted"]
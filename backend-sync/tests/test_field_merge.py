@@ -0,0 +1,84 @@
+"""
+Tests for field-level Last-Write-Wins on Product state sync.
+"""
+
+import pytest
+from uuid import uuid4
+from sqlmodel import Session, create_engine, SQLModel
+from sqlmodel.pool import StaticPool
+
+from app.models import Product
+from app.schemas import ProductSync, SyncPushRequest
+from app.sync_engine import AgrotourSyncEngine
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="product")
+def product_fixture(session: Session):
+    user_id = uuid4()
+    product = Product(
+        tenant_id=uuid4(), name="Queso de cabra", description="Fresco", price=5000.0,
+        sku=f"SKU-{uuid4().hex[:8]}", current_stock=10, lamport_ts=3,
+        device_id=uuid4(), device_type="WEB", created_by=user_id, updated_by=user_id
+    )
+    session.add(product)
+    session.commit()
+    session.refresh(product)
+    return product
+
+
+def _push_product(session, product, field_lamports=None, lamport_ts=0, **changes):
+    session.refresh(product)
+    data = product.model_dump(include=set(ProductSync.model_fields))
+    data.update(changes, lamport_ts=lamport_ts, field_lamports=field_lamports, device_id=uuid4())
+    request = SyncPushRequest(products=[ProductSync(**data)], client_lamport=lamport_ts, device_id=uuid4())
+    return AgrotourSyncEngine(session).apply_push(request)[0]
+
+
+def test_concurrent_edits_of_different_fields_both_apply(session: Session, product: Product):
+    """Price from web and description from mobile survive each other."""
+    web = _push_product(session, product, {"price": 4}, lamport_ts=4, price=5500.0, description="stale")
+    mobile = _push_product(session, product, {"description": 4}, lamport_ts=4, description="Madurado 3 meses")
+    
+    assert web["applied_fields"] == ["price"]
+    assert mobile["applied_fields"] == ["description"]
+    
+    session.refresh(product)
+    assert product.price == 5500.0
+    assert product.description == "Madurado 3 meses"
+    assert product.field_lamports["description"] == product.lamport_ts
+    assert product.field_lamports["name"] == 3
+
+
+def test_stale_field_is_ignored(session: Session, product: Product):
+    """A field edit older than the field's last write is dropped."""
+    _push_product(session, product, {"price": 10}, lamport_ts=10, price=6000.0)
+    
+    result = _push_product(session, product, {"price": 5, "name": 5}, lamport_ts=5, price=1.0, name="Queso")
+    assert result["applied_fields"] == ["name"]
+    assert result["stale_fields"] == ["price"]
+    
+    session.refresh(product)
+    assert (product.price, product.name) == (6000.0, "Queso")
+
+
+def test_whole_row_sync_still_works(session: Session, product: Product):
+    """Without field stamps, the row-level LWW is unchanged."""
+    assert _push_product(session, product, lamport_ts=2, name="Old")["status"] == "ignored"
+    assert _push_product(session, product, lamport_ts=9, name="New")["status"] == "accepted"
+    
+    session.refresh(product)
+    assert product.name == "New"
+    assert product.field_lamports == {}
@@ -0,0 +1,103 @@
+"""
+Tests for group commit of concurrent pushes.
+"""
+
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from sqlalchemy import event
+from sqlmodel import Session, create_engine, SQLModel, select
+
+from app import group_commit
+from app.group_commit import GroupCommitter
+from app.models import StockEvent
+from app.schemas import SyncPushRequest
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(tmp_path):
+    """File database shared by the writer thread, with working SAVEPOINTs."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'sync.db'}", connect_args={"check_same_thread": False})
+
+    # pysqlite begins transactions lazily, which breaks nested savepoints
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def _push(tenant_id, device_id=None) -> SyncPushRequest:
+    user_id = uuid4()
+    device_id = device_id or uuid4()
+    return SyncPushRequest(
+        operations=[{
+            "tenant_id": tenant_id,
+            "product_id": uuid4(),
+            "device_id": device_id,
+            "device_type": "MOBILE",
+            "operation": "DECREMENT",
+            "delta": 1,
+            "reason": "SALE",
+            "lamport_ts": 1,
+            "created_by": user_id,
+            "updated_by": user_id
+        }],
+        client_lamport=1,
+        device_id=device_id
+    )
+
+
+def test_concurrent_pushes_share_commits(engine):
+    tenant_id = uuid4()
+    committer = GroupCommitter(bind=engine, window_ms=100, max_batch=64)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        responses = list(pool.map(lambda _: committer.submit(tenant_id, _push(tenant_id)), range(16)))
+    committer.close()
+
+    assert all(r.results[0]["status"] == "accepted" for r in responses)
+    assert committer.requests == 16
+    assert committer.groups < 16
+
+    with Session(engine) as session:
+        events = session.exec(select(StockEvent)).all()
+    assert len(events) == 16
+    # One writer: Lamport timestamps stay unique across the group
+    assert len({e.lamport_ts for e in events}) == 16
+
+
+def test_failing_request_is_rolled_back_alone(engine, monkeypatch):
+    tenant_id = uuid4()
+    broken_device = uuid4()
+    apply = group_commit.process_push
+
+    def process_push(session, tenant_id, request, *args, **kwargs):
+        response = apply(session, tenant_id, request, *args, **kwargs)
+        if request.device_id == broken_device:
+            raise RuntimeError("device failed after writing")
+        return response
+
+    monkeypatch.setattr(group_commit, "process_push", process_push)
+    committer = GroupCommitter(bind=engine, window_ms=100)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [
+            pool.submit(committer.submit, tenant_id, _push(tenant_id, device))
+            for device in (uuid4(), broken_device, uuid4())
+        ]
+    committer.close()
+
+    assert isinstance(futures[1].exception(), RuntimeError)
+    assert futures[0].result().results[0]["status"] == "accepted"
+    assert futures[2].result().results[0]["status"] == "accepted"
+
+    with Session(engine) as session:
+        devices = {e.device_id for e in session.exec(select(StockEvent)).all()}
+    assert broken_device not in devices
+    assert len(devices) == 2
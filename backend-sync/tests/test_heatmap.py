@@ -0,0 +1,145 @@
+"""
+Tests for the geohash sales heatmap.
+"""
+
+import math
+import pytest
+from datetime import datetime
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app.main import app
+from app.database import get_session
+from app.heatmap import HeatmapStore, bounds, encode, precision_for_zoom, tile_bounds
+from app.models import Product, SalesHeatmapCell, StockEvent
+from app.schemas import StockEventCreate, SyncPushRequest
+from app.sync_engine import AgrotourSyncEngine
+
+# Two stalls of the Temuco feria, ~100 m apart, and one in Villarrica
+FERIA = (-38.7359, -72.5904)
+FERIA_NEXT_STALL = (-38.7362, -72.5912)
+VILLARRICA = (-39.2820, -72.2270)
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="product")
+def product_fixture(session: Session):
+    user_id = uuid4()
+    product = Product(
+        tenant_id=uuid4(), name="Merkén", price=3000.0, sku=f"SKU-{uuid4().hex[:8]}",
+        current_stock=50, device_id=uuid4(), device_type="WEB", created_by=user_id, updated_by=user_id
+    )
+    session.add(product)
+    session.commit()
+    session.refresh(product)
+    return product
+
+
+def _event(product, location, delta=-1, reason="SALE", amount=3000.0, created_at=datetime(2026, 10, 10, 11, 0)):
+    user_id = uuid4()
+    lat, lng = location or (None, None)
+    return StockEvent(
+        tenant_id=product.tenant_id, product_id=product.id, device_id=uuid4(), device_type="MOBILE",
+        operation="DECREMENT" if delta < 0 else "INCREMENT", delta=delta, reason=reason, amount=amount,
+        location_lat=lat, location_lng=lng, created_at=created_at,
+        operation_hash=uuid4().hex, created_by=user_id, updated_by=user_id
+    )
+
+
+def _tile(lat, lng, z):
+    n = 2 ** z
+    x = int((lng + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return z, x, y
+
+
+def test_geohash_encoding():
+    assert encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    lat_min, lng_min, lat_max, lng_max = bounds("u4pruydqqvj")
+    assert lat_min <= 57.64911 < lat_max and lng_min <= 10.40744 < lng_max
+
+    # Tiles contain their points and cells get finer with the zoom
+    lat_min, lng_min, lat_max, lng_max = tile_bounds(*_tile(*FERIA, 12))
+    assert lat_min <= FERIA[0] < lat_max and lng_min <= FERIA[1] < lng_max
+    assert precision_for_zoom(0) < precision_for_zoom(8) < precision_for_zoom(14)
+
+
+def test_accepted_sales_update_cells(session: Session, product: Product):
+    """Only located SALE events reach the heatmap."""
+    user_id, device_id = uuid4(), uuid4()
+    operations = [
+        StockEventCreate(
+            tenant_id=product.tenant_id, product_id=product.id, device_id=device_id, device_type="MOBILE",
+            operation=operation, delta=delta, reason=reason, amount=3000.0, lamport_ts=i + 1,
+            location_lat=FERIA[0] if located else None, location_lng=FERIA[1] if located else None,
+            created_by=user_id, updated_by=user_id
+        )
+        for i, (operation, delta, reason, located) in enumerate([
+            ("DECREMENT", -2, "SALE", True),
+            ("DECREMENT", -1, "SALE", False),
+            ("INCREMENT", 5, "RESTOCK", True),
+        ])
+    ]
+    results = AgrotourSyncEngine(session).apply_push(SyncPushRequest(operations=operations, client_lamport=3, device_id=device_id))
+    assert [r["status"] for r in results] == ["accepted"] * 3, results
+
+    cells = session.exec(select(SalesHeatmapCell)).all()
+    assert len(cells) == 1
+    assert cells[0].geohash == encode(*FERIA)
+    assert (cells[0].sales_units, cells[0].sales_amount, cells[0].event_count) == (2, 3000.0, 1)
+
+
+def test_tile_endpoint(session: Session, product: Product):
+    """Nearby stalls merge into one cell at city zoom; the other town is outside the tile."""
+    HeatmapStore(session).add([
+        _event(product, FERIA, -3, amount=9000.0),
+        _event(product, FERIA_NEXT_STALL, -1),
+        _event(product, VILLARRICA, -4, amount=12000.0),
+        _event(product, FERIA, -5, created_at=datetime(2026, 8, 1)),  # Outside the period
+    ])
+    session.commit()
+    app.dependency_overrides[get_session] = lambda: session
+    client = TestClient(app)
+    headers = {"X-Tenant-ID": str(product.tenant_id)}
+    period = {"since": "2026-10-01T00:00:00", "until": "2026-10-19T00:00:00"}
+
+    try:
+        z, x, y = _tile(*FERIA, 10)
+        response = client.get(f"/analytics/heatmap/{z}/{x}/{y}", params=period, headers=headers)
+        assert response.status_code == 200
+        body = response.json()
+
+        assert body["type"] == "FeatureCollection"
+        assert body["precision"] == precision_for_zoom(10)
+        assert len(body["features"]) == 1
+        feature = body["features"][0]
+        assert feature["id"] == encode(*FERIA, body["precision"])
+        assert (feature["properties"]["sales_units"], feature["properties"]["sales_amount"]) == (4, 12000.0)
+        assert len(feature["geometry"]["coordinates"][0]) == 5
+
+        # The whole region at a low zoom sees both towns
+        z, x, y = _tile(*FERIA, 5)
+        features = client.get(f"/analytics/heatmap/{z}/{x}/{y}", params=period, headers=headers).json()["features"]
+        assert sum(f["properties"]["sales_units"] for f in features) == 8
+
+        # Another tenant sees nothing
+        response = client.get(f"/analytics/heatmap/{z}/{x}/{y}", params=period, headers={"X-Tenant-ID": str(uuid4())})
+        assert response.json()["features"] == []
+
+        assert client.get("/analytics/heatmap/3/8/0", headers=headers).status_code == 400
+    finally:
+        app.dependency_overrides.clear()
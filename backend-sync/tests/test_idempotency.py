@@ -0,0 +1,102 @@
+"""
+Tests for batch-level push idempotency.
+"""
+
+import pytest
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app.main import app
+from app.database import get_session
+from app.models import StockEvent
+from app.idempotency import BatchIdempotencyStore, IdempotencyKeyReused
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    """Test client bound to the in-memory session (no startup hooks)."""
+    app.dependency_overrides[get_session] = lambda: session
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def _push_payload(tenant_id: str, device_id: str) -> dict:
+    user_id = str(uuid4())
+    return {
+        "operations": [{
+            "tenant_id": tenant_id,
+            "product_id": str(uuid4()),
+            "device_id": device_id,
+            "device_type": "MOBILE",
+            "operation": "DECREMENT",
+            "delta": 2,
+            "reason": "SALE",
+            "lamport_ts": 1,
+            "created_by": user_id,
+            "updated_by": user_id
+        }],
+        "client_lamport": 1,
+        "device_id": device_id
+    }
+
+
+def test_store_roundtrip(session: Session):
+    """A stored response is returned for the same key and hash."""
+    store = BatchIdempotencyStore(session)
+    tenant_id = uuid4()
+    
+    assert store.lookup(tenant_id, "batch-1", "a" * 64) is None
+    store.store(tenant_id, "batch-1", "a" * 64, {"results": [], "server_lamport": 3})
+    
+    assert store.lookup(tenant_id, "batch-1", "a" * 64)["server_lamport"] == 3
+    # Keys are scoped per tenant
+    assert store.lookup(uuid4(), "batch-1", "a" * 64) is None
+    
+    with pytest.raises(IdempotencyKeyReused):
+        store.lookup(tenant_id, "batch-1", "b" * 64)
+
+
+def test_expired_receipt_is_ignored(session: Session):
+    """Receipts older than the TTL are dropped."""
+    store = BatchIdempotencyStore(session, ttl_seconds=-1)
+    tenant_id = uuid4()
+    
+    store.store(tenant_id, "batch-1", "a" * 64, {"results": []})
+    assert store.lookup(tenant_id, "batch-1", "a" * 64) is None
+
+
+def test_retransmitted_push_returns_stored_response(client: TestClient, session: Session):
+    """Resending a batch with the same key replays the first response."""
+    tenant_id = str(uuid4())
+    device_id = str(uuid4())
+    payload = _push_payload(tenant_id, device_id)
+    headers = {"X-Tenant-ID": tenant_id, "Idempotency-Key": "batch-42"}
+    
+    first = client.post("/sync/push", json=payload, headers=headers)
+    assert first.status_code == 200
+    assert first.json()["results"][0]["status"] == "accepted"
+    
+    second = client.post("/sync/push", json=payload, headers=headers)
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert len(session.exec(select(StockEvent)).all()) == 1
+    
+    # Same key, different batch
+    other = _push_payload(tenant_id, device_id)
+    response = client.post("/sync/push", json=other, headers=headers)
+    assert response.status_code == 422
@@ -0,0 +1,164 @@
+"""
+Tests for the bulk product catalog import.
+"""
+
+import pytest
+from contextlib import nullcontext
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app import catalog
+from app.main import app
+from app.database import get_session, get_session_factory
+from app.models import Product
+from app.product_import import CSV, JSONL, ProductImporter, parse_lines
+from app.schemas import ProductSync, SyncPushRequest
+from app.sync_engine import AgrotourSyncEngine
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session, monkeypatch):
+    """Test client bound to the in-memory session, with a fresh SKU cache."""
+    monkeypatch.setattr(catalog, "_cache", None)
+    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_session_factory] = lambda: (lambda tenant_id: nullcontext(session))
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+CATALOG = """sku,name,price,category,current_stock
+MIEL-500,Miel de ulmo 500g,4500,Mieles,12
+MERKEN-100,Merkén 100g,2500,,
+QUESO-1K,Queso de cabra 1kg,-10,Quesos,3
+MIEL-500,Miel repetida,4000,Mieles,1
+CHICHA-1L,Chicha de manzana 1L,3000,Bebidas,20
+"""
+
+
+def test_csv_import_validates_and_assigns_lamport_range(session: Session):
+    tenant_id = uuid4()
+
+    summary = ProductImporter(session, tenant_id, uuid4(), chunk_size=2).run(
+        parse_lines(CATALOG.splitlines(keepends=True), CSV)
+    )
+
+    assert summary["rows"] == 5
+    assert summary["created"] == 3
+    assert summary["invalid"] == 2
+    assert [error["line"] for error in summary["errors"]] == [4, 5]
+    assert "price" in summary["errors"][0]["detail"]
+    assert "Duplicate SKU" in summary["errors"][1]["detail"]
+
+    products = session.exec(select(Product).where(Product.tenant_id == tenant_id).order_by(Product.lamport_ts)).all()
+    assert [p.sku for p in products] == ["MIEL-500", "MERKEN-100", "CHICHA-1L"]
+    assert [p.lamport_ts for p in products] == [1, 2, 3]
+    assert summary["lamport_range"] == [1, 3]
+
+    merken = products[1]
+    assert merken.category is None and merken.current_stock == 0
+    assert merken.content_hash == merken.compute_hash()
+
+
+def test_jsonl_import_skips_existing_skus(session: Session):
+    tenant_id, user_id = uuid4(), uuid4()
+    lines = [
+        '{"sku": "MIEL-500", "name": "Miel de ulmo 500g", "price": 4500}\n',
+        "not json\n",
+        "\n",
+        '{"sku": " MERKEN-100 ", "name": "Merkén 100g", "price": 2500}\n',
+    ]
+
+    first = ProductImporter(session, tenant_id, user_id).run(parse_lines(lines[:1], JSONL))
+    assert first["created"] == 1
+
+    # Running the whole catalog again only adds what is missing
+    second = ProductImporter(session, tenant_id, user_id).run(parse_lines(lines, JSONL))
+    assert (second["created"], second["existing"], second["invalid"]) == (1, 1, 1)
+    assert second["errors"][0]["line"] == 2
+    assert second["lamport_range"] == [2, 2]
+
+    skus = session.exec(select(Product.sku).where(Product.tenant_id == tenant_id)).all()
+    assert sorted(skus) == ["MERKEN-100", "MIEL-500"]
+
+
+def test_import_endpoint_refreshes_sku_cache(client: TestClient):
+    tenant_id = uuid4()
+    headers = {"X-Tenant-ID": str(tenant_id)}
+
+    # An unknown SKU is cached as such...
+    assert client.get("/products/by-sku/CHICHA-1L", headers=headers).status_code == 404
+
+    response = client.post(
+        f"/products/import?created_by={uuid4()}",
+        content=CATALOG.encode(),
+        headers={**headers, "Content-Type": "text/csv"}
+    )
+    assert response.status_code == 200
+    assert response.json()["created"] == 3
+
+    # ...until the import drops the tenant's cached lookups
+    assert client.get("/products/by-sku/CHICHA-1L", headers=headers).json()["price"] == 3000.0
+
+
+def test_import_endpoint_streams_the_body(client: TestClient, session: Session):
+    tenant_id = uuid4()
+    body = ("\ufeff" + CATALOG.replace("\n", "\r\n")).encode()
+
+    def chunks():
+        # Chunk boundaries inside "é" (2 bytes) and inside the line endings
+        for start in range(0, len(body), 7):
+            yield body[start:start + 7]
+
+    response = client.post(
+        f"/products/import?created_by={uuid4()}&chunk_size=2",
+        content=chunks(),
+        headers={"X-Tenant-ID": str(tenant_id), "Content-Type": "text/csv"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["created"] == 3
+    assert session.exec(select(Product.name).where(Product.sku == "MERKEN-100")).one() == "Merkén 100g"
+
+    response = client.post(
+        f"/products/import?created_by={uuid4()}",
+        content=b'{"sku": "X-1", "name": "\xff", "price": 1}\n',
+        headers={"X-Tenant-ID": str(tenant_id), "Content-Type": JSONL}
+    )
+    assert response.status_code == 400
+
+
+def test_device_edits_of_imported_products_are_not_stale(session: Session):
+    tenant_id, user_id, device_id = uuid4(), uuid4(), uuid4()
+    lines = [f'{{"sku": "P-{i}", "name": "Producto {i}", "price": 100}}' for i in range(50)]
+    summary = ProductImporter(session, tenant_id, user_id).run(parse_lines(lines, JSONL))
+
+    # The clock a device learns from any response covers the imported stamps
+    sync_engine = AgrotourSyncEngine(session)
+    assert sync_engine.server_lamport == summary["lamport_range"][1]
+
+    product = session.exec(select(Product).where(Product.sku == "P-49")).one()
+    edit = ProductSync(
+        **product.model_dump(exclude={"lamport_ts", "price"}),
+        price=120.0,
+        lamport_ts=sync_engine.server_lamport + 1
+    )
+    results = sync_engine.apply_push(SyncPushRequest(products=[edit], client_lamport=0, device_id=device_id))
+
+    assert results[0]["status"] == "accepted"
+    session.refresh(product)
+    assert product.price == 120.0
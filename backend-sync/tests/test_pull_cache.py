@@ -0,0 +1,99 @@
+"""
+Tests for the Redis-backed pull page cache.
+"""
+
+import threading
+import time
+from uuid import uuid4
+
+from app.pull_cache import PullPageCache
+
+
+class FakeRedis:
+    """Minimal in-memory stand-in for the Redis commands the cache uses."""
+    
+    def __init__(self):
+        self.data = {}
+        self.zsets = {}
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        return self.data.get(key)
+    
+    def set(self, key, value, ex=None, px=None, nx=False):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            return True
+    
+    def delete(self, key):
+        self.data.pop(key, None)
+    
+    def zscore(self, name, member):
+        return self.zsets.get(name, {}).get(member)
+    
+    def zadd(self, name, mapping, gt=False):
+        zset = self.zsets.setdefault(name, {})
+        for member, score in mapping.items():
+            if not gt or member not in zset or score > zset[member]:
+                zset[member] = float(score)
+
+
+def test_page_is_cached_until_head_advances():
+    """A page is served from cache until the tenant clock moves."""
+    cache = PullPageCache(FakeRedis())
+    tenant_id = uuid4()
+    loads = []
+    
+    def load_page():
+        loads.append(1)
+        return f"page-{len(loads)}".encode()
+    
+    def get(cursor=0):
+        return cache.get_or_load(tenant_id, cursor, 100, load_page, load_head=lambda: 10)
+    
+    assert get() == b"page-1"
+    assert get() == b"page-1"
+    assert len(loads) == 1
+    
+    # Different cursor is a different page
+    assert get(cursor=5) == b"page-2"
+    
+    cache.advance(tenant_id, 11)
+    assert get() == b"page-3"
+    
+    # Head never moves backwards
+    cache.advance(tenant_id, 3)
+    assert cache.get_head(tenant_id) == 11
+    assert get() == b"page-3"
+
+
+def test_concurrent_misses_collapse_into_one_load():
+    """Concurrent misses for the same page run the loader once."""
+    cache = PullPageCache(FakeRedis())
+    tenant_id = uuid4()
+    cache.advance(tenant_id, 1)
+    loads = []
+    
+    def load_page():
+        loads.append(1)
+        time.sleep(0.05)
+        return b"page"
+    
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(
+                cache.get_or_load(tenant_id, 0, 100, load_page, load_head=lambda: 1)
+            )
+        )
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert results == [b"page"] * 8
+    assert len(loads) == 1
@@ -0,0 +1,179 @@
+"""
+Tests for the write-ahead ingestion queue (asynchronous push).
+"""
+
+import pytest
+from uuid import UUID, uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app import push_queue
+from app.main import app
+from app.database import get_session
+from app.models import StockEvent, SyncPushTicket
+from app.push_queue import PushQueue, wants_async
+from app.schemas import SyncPushRequest
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    """Test client bound to the in-memory session (no startup hooks)."""
+    app.dependency_overrides[get_session] = lambda: session
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def _push_payload(tenant_id: str, device_id: str, lamport: int = 1) -> dict:
+    user_id = str(uuid4())
+    return {
+        "operations": [{
+            "tenant_id": tenant_id,
+            "product_id": str(uuid4()),
+            "device_id": device_id,
+            "device_type": "MOBILE",
+            "operation": "DECREMENT",
+            "delta": 2,
+            "reason": "SALE",
+            "lamport_ts": lamport,
+            "created_by": user_id,
+            "updated_by": user_id
+        }],
+        "client_lamport": lamport,
+        "device_id": device_id
+    }
+
+
+def test_wants_async():
+    assert wants_async("respond-async")
+    assert wants_async("return=minimal, respond-async")
+    assert not wants_async("wait=5")
+    assert not wants_async(None)
+
+
+def test_async_push_is_applied_by_the_worker(client: TestClient, session: Session):
+    """A queued batch is acknowledged with a ticket and applied on drain."""
+    tenant_id = str(uuid4())
+    device_id = str(uuid4())
+    headers = {"X-Tenant-ID": tenant_id, "Prefer": "respond-async"}
+
+    response = client.post("/sync/push", json=_push_payload(tenant_id, device_id), headers=headers)
+    assert response.status_code == 202
+    ticket = response.json()
+    assert ticket["status"] == "PENDING"
+    assert session.exec(select(StockEvent)).all() == []
+
+    polled = client.get(f"/sync/push/tickets/{ticket['ticket']}", headers={"X-Tenant-ID": tenant_id})
+    assert polled.json()["status"] == "PENDING"
+
+    assert PushQueue(session).drain_tenant(UUID(tenant_id)) == 1
+    assert len(session.exec(select(StockEvent)).all()) == 1
+
+    polled = client.get(f"/sync/push/tickets/{ticket['ticket']}", headers={"X-Tenant-ID": tenant_id})
+    assert polled.json()["status"] == "DONE"
+    assert polled.json()["response"]["results"][0]["status"] == "accepted"
+
+    # Other tenants cannot see the ticket
+    other = client.get(f"/sync/push/tickets/{ticket['ticket']}", headers={"X-Tenant-ID": str(uuid4())})
+    assert other.status_code == 404
+
+
+def test_results_are_delivered_once_on_pull(client: TestClient, session: Session):
+    tenant_id = str(uuid4())
+    device_id = str(uuid4())
+    headers = {"X-Tenant-ID": tenant_id, "Prefer": "respond-async"}
+
+    ticket = client.post("/sync/push", json=_push_payload(tenant_id, device_id), headers=headers).json()
+    PushQueue(session).drain_tenant(UUID(tenant_id))
+
+    pull = {"tenant_id": tenant_id, "last_lamport": 0, "device_id": device_id}
+    first = client.post("/sync/pull", json=pull, headers={"X-Tenant-ID": tenant_id}).json()
+    assert [r["ticket"] for r in first["push_results"]] == [ticket["ticket"]]
+
+    second = client.post("/sync/pull", json=pull, headers={"X-Tenant-ID": tenant_id}).json()
+    assert second["push_results"] == []
+
+
+def test_enqueue_is_idempotent(client: TestClient, session: Session):
+    tenant_id = str(uuid4())
+    device_id = str(uuid4())
+    payload = _push_payload(tenant_id, device_id)
+    headers = {"X-Tenant-ID": tenant_id, "Prefer": "respond-async", "Idempotency-Key": "batch-7"}
+
+    first = client.post("/sync/push", json=payload, headers=headers).json()
+    second = client.post("/sync/push", json=payload, headers=headers).json()
+    assert first["ticket"] == second["ticket"]
+    assert len(session.exec(select(SyncPushTicket)).all()) == 1
+
+    reused = client.post("/sync/push", json=_push_payload(tenant_id, device_id), headers=headers)
+    assert reused.status_code == 422
+
+    # Once applied, a synchronous retransmission gets the stored receipt
+    PushQueue(session).drain_tenant(UUID(tenant_id))
+    replay = client.post("/sync/push", json=payload, headers={"X-Tenant-ID": tenant_id, "Idempotency-Key": "batch-7"})
+    assert replay.status_code == 200
+    assert len(session.exec(select(StockEvent)).all()) == 1
+
+
+def test_failing_ticket_blocks_then_fails(session: Session):
+    """A failing ticket holds back later ones until its attempts are used up."""
+    tenant_id = uuid4()
+    device_id = str(uuid4())
+    queue = PushQueue(session, max_attempts=2)
+
+    broken = queue.enqueue(tenant_id, SyncPushRequest(**_push_payload(str(tenant_id), device_id)))
+    broken.payload = {"operations": "not a list"}
+    session.add(broken)
+    session.commit()
+    later = queue.enqueue(tenant_id, SyncPushRequest(**_push_payload(str(tenant_id), device_id, lamport=2)))
+
+    assert queue.drain_tenant(tenant_id) == 0
+    session.refresh(later)
+    assert later.status == "PENDING"
+
+    assert queue.drain_tenant(tenant_id) == 1
+    session.refresh(broken)
+    session.refresh(later)
+    assert broken.status == "FAILED"
+    assert broken.attempts == 2
+    assert later.status == "DONE"
+
+
+def test_worker_session_commits_each_ticket(session: Session, monkeypatch):
+    """A ticket applied before a failing one stays committed, even when taking the lock opened a transaction."""
+    engine = session.get_bind()
+    monkeypatch.setattr(push_queue, "engine_for_tenant", lambda tenant_id: engine)
+    monkeypatch.setattr(
+        push_queue, "_advisory_lock",
+        lambda connection, tenant_id: connection.exec_driver_sql("SELECT 1").scalar() == 1
+    )
+    tenant_id = uuid4()
+    device_id = str(uuid4())
+    queue = PushQueue(session)
+
+    applied = queue.enqueue(tenant_id, SyncPushRequest(**_push_payload(str(tenant_id), device_id)))
+    broken = queue.enqueue(tenant_id, SyncPushRequest(**_push_payload(str(tenant_id), device_id, lamport=2)))
+    broken.payload = {"operations": "not a list"}
+    session.add(broken)
+    session.commit()
+
+    with push_queue._tenant_worker_session(tenant_id) as worker:
+        assert PushQueue(worker).drain_tenant(tenant_id) == 1
+
+    session.expire_all()
+    assert session.get(SyncPushTicket, applied.id).status == "DONE"
+    assert session.get(SyncPushTicket, broken.id).attempts == 1
+    assert len(session.exec(select(StockEvent)).all()) == 1
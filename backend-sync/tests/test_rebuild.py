@@ -0,0 +1,137 @@
+"""
+Tests for the parallel projection rebuild.
+"""
+
+import pytest
+from datetime import datetime, timedelta
+from uuid import uuid4
+from sqlmodel import Session, create_engine, SQLModel, select
+
+from app.heatmap import HeatmapStore
+from app.models import Product, SalesHeatmapCell, StockEvent, StockRollup
+from app.rebuild import plan_partitions, rebuild
+from app.rollups import RollupStore, stock_lamport
+
+
+@pytest.fixture(name="database_url")
+def database_fixture(tmp_path):
+    """File database, so worker processes see the same data."""
+    url = f"sqlite:///{tmp_path / 'sync.db'}"
+    SQLModel.metadata.create_all(create_engine(url))
+    return url
+
+
+def _seed(session, tenant_id, products=3, events=5):
+    """Products with a restock and sales; rollups maintained incrementally."""
+    user_id = uuid4()
+    start = datetime(2026, 10, 1, 9, 0)
+    seeded = []
+    for p in range(products):
+        product = Product(
+            tenant_id=tenant_id, name=f"Prod {p}", price=1000.0, sku=f"SKU-{uuid4().hex[:8]}",
+            current_stock=0, device_id=uuid4(), device_type="WEB", created_by=user_id, updated_by=user_id
+        )
+        session.add(product)
+        batch = [StockEvent(
+            tenant_id=tenant_id, product_id=product.id, device_id=uuid4(), device_type="MOBILE",
+            operation="INCREMENT" if i == 0 else "DECREMENT", delta=50 if i == 0 else -(i + p),
+            reason="RESTOCK" if i == 0 else "SALE", amount=None if i == 0 else 1000.0 * (i + p),
+            lamport_ts=i + 1, created_at=start + timedelta(hours=7 * i), operation_hash=uuid4().hex,
+            created_by=user_id, updated_by=user_id
+        ) for i in range(events)]
+        session.add_all(batch)
+        RollupStore(session).add(batch)
+        seeded.append(product.id)
+    session.commit()
+    return seeded
+
+
+def _rollups(session):
+    return sorted(
+        (str(r.product_id), r.granularity, r.bucket_start, r.units_in, r.units_out, r.net_delta,
+         r.sales_units, r.sales_amount, r.event_count)
+        for r in session.exec(select(StockRollup)).all()
+    )
+
+
+def test_plan_partitions(database_url):
+    with Session(create_engine(database_url)) as session:
+        tenant_a, tenant_b = uuid4(), uuid4()
+        _seed(session, tenant_a, products=3)
+        _seed(session, tenant_b, products=1)
+        
+        partitions = plan_partitions(session, partition_events=10)
+    
+    assert sorted((str(t), len(p), n) for t, p, n in partitions) == sorted([
+        (str(tenant_a), 2, 10), (str(tenant_a), 1, 5), (str(tenant_b), 1, 5)
+    ])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_rebuild_restores_drifted_projections(database_url, workers):
+    """A rebuild reproduces the incremental rollups and replays stock."""
+    engine = create_engine(database_url)
+    with Session(engine) as session:
+        tenant_id = uuid4()
+        product_ids = _seed(session, tenant_id)
+        expected = _rollups(session)
+        
+        # Drift: corrupt one bucket, drop another
+        rollups = session.exec(select(StockRollup)).all()
+        rollups[0].sales_units += 99
+        session.add(rollups[0])
+        session.delete(rollups[1])
+        session.commit()
+        assert _rollups(session) != expected
+    
+    totals = rebuild(database_url, workers=workers, partition_events=5, chunk_size=3, stock=True)
+    assert totals["partitions"] == 3
+    assert totals["events"] == 15
+    
+    with Session(engine) as session:
+        assert _rollups(session) == expected
+        products = {p.id: p for p in session.exec(select(Product)).all()}
+        # 50 restocked, then sales of (1..4) + p units
+        assert [products[pid].current_stock for pid in product_ids] == [40, 36, 32]
+        # The replayed stock is stamped with the last event, so curves do not apply the log again
+        assert all(stock_lamport(products[pid]) == 5 for pid in product_ids)
+
+
+def _cells(session):
+    return sorted(
+        (str(c.product_id), c.geohash, c.bucket_start, c.sales_units, c.sales_amount, c.event_count)
+        for c in session.exec(select(SalesHeatmapCell)).all()
+    )
+
+
+def test_rebuild_restores_heatmap_cells(database_url):
+    engine = create_engine(database_url)
+    with Session(engine) as session:
+        tenant_id, user_id = uuid4(), uuid4()
+        product_ids = _seed(session, tenant_id, products=2)
+        # Located sales: two stalls of a market, on two days
+        located = [StockEvent(
+            tenant_id=tenant_id, product_id=product_ids[i % 2], device_id=uuid4(), device_type="MOBILE",
+            operation="DECREMENT", delta=-(i + 1), reason="SALE", amount=500.0 * (i + 1),
+            location_lat=-39.8142 + 0.01 * (i % 3), location_lng=-73.2459,
+            lamport_ts=100 + i, created_at=datetime(2026, 10, 5 + i % 2, 11, 0), operation_hash=uuid4().hex,
+            created_by=user_id, updated_by=user_id
+        ) for i in range(6)]
+        session.add_all(located)
+        HeatmapStore(session).add(located)
+        session.commit()
+        expected = _cells(session)
+        assert expected
+
+        # Drift: corrupt one cell, drop another
+        cells = session.exec(select(SalesHeatmapCell)).all()
+        cells[0].sales_units += 7
+        session.add(cells[0])
+        session.delete(cells[1])
+        session.commit()
+
+    totals = rebuild(database_url, workers=1, archive_path=None)
+
+    assert totals["cells"] == len(expected)
+    with Session(engine) as session:
+        assert _cells(session) == expected
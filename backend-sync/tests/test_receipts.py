@@ -0,0 +1,166 @@
+"""
+Tests for resumable chunked receipt photo uploads.
+"""
+
+import pytest
+from hashlib import sha256
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel
+from sqlmodel.pool import StaticPool
+
+from app import receipts
+from app.main import app
+from app.database import get_session
+from app.models import PendingPayment
+
+PHOTO = bytes(range(256)) * 40  # 10 KiB
+CHUNK = 4096
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session, tmp_path, monkeypatch):
+    """Test client bound to the in-memory session, storing photos under tmp_path."""
+    monkeypatch.setattr(receipts, "RECEIPT_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr(receipts, "RECEIPT_CHUNK_SIZE", CHUNK)
+    app.dependency_overrides[get_session] = lambda: session
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def _start(client, headers, photo=PHOTO):
+    response = client.post(
+        "/receipts/uploads", json={"sha256": sha256(photo).hexdigest(), "size": len(photo)}, headers=headers
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def _put(client, headers, upload_id, index, photo=PHOTO):
+    return client.put(
+        f"/receipts/uploads/{upload_id}/chunks/{index}",
+        content=photo[index * CHUNK:(index + 1) * CHUNK],
+        headers={**headers, "Content-Type": "application/octet-stream"}
+    )
+
+
+def test_interrupted_upload_resumes(client: TestClient, tmp_path):
+    headers = {"X-Tenant-ID": str(uuid4())}
+    upload = _start(client, headers)
+    assert (upload["status"], upload["chunk_size"], upload["next_chunk"]) == ("UPLOADING", CHUNK, 0)
+
+    assert _put(client, headers, upload["upload_id"], 0).json()["next_chunk"] == 1
+    # The link drops; the device asks where to resume
+    resumed = _start(client, headers)
+    assert (resumed["upload_id"], resumed["next_chunk"]) == (upload["upload_id"], 1)
+
+    # A lost ack: chunk 0 is sent again and acknowledged; skipping ahead is refused
+    assert _put(client, headers, upload["upload_id"], 0).status_code == 200
+    skipped = _put(client, headers, upload["upload_id"], 2)
+    assert (skipped.status_code, skipped.json()["next_chunk"]) == (409, 1)
+
+    _put(client, headers, upload["upload_id"], 1)
+    _put(client, headers, upload["upload_id"], 2)
+    done = client.post(f"/receipts/uploads/{upload['upload_id']}/complete", headers=headers).json()
+    assert done["status"] == "COMPLETE"
+    assert done["receipt_photo"] == f"sha256:{sha256(PHOTO).hexdigest()}"
+
+    photo = client.get(f"/receipts/{sha256(PHOTO).hexdigest()}", headers=headers)
+    assert photo.content == PHOTO
+    # Chunks are dropped once the photo is assembled
+    assert not list(tmp_path.glob("tenant=*/chunks/*/*"))
+
+
+def test_corrupted_chunk_and_photo(client: TestClient):
+    headers = {"X-Tenant-ID": str(uuid4())}
+    upload = _start(client, headers)
+
+    corrupted = client.put(
+        f"/receipts/uploads/{upload['upload_id']}/chunks/0", content=b"x" * 10,
+        headers={**headers, "X-Chunk-SHA256": sha256(b"y").hexdigest(), "Content-Type": "application/octet-stream"}
+    )
+    assert (corrupted.status_code, corrupted.json()["next_chunk"]) == (409, 0)
+
+    # Chunks that do not add up to the declared photo restart the upload
+    for index in range(3):
+        client.put(
+            f"/receipts/uploads/{upload['upload_id']}/chunks/{index}", content=b"z" * (CHUNK if index < 2 else 2048),
+            headers={**headers, "Content-Type": "application/octet-stream"}
+        )
+    response = client.post(f"/receipts/uploads/{upload['upload_id']}/complete", headers=headers)
+    assert (response.status_code, response.json()["next_chunk"]) == (409, 0)
+
+
+def test_failed_photo_keeps_chunks_of_other_uploads(client: TestClient, tmp_path):
+    """A restarted upload leaves shared chunks alone; a chunk that went missing restarts, not 500."""
+    tenant_id = uuid4()
+    headers = {"X-Tenant-ID": str(tenant_id)}
+    other_photo = PHOTO[:CHUNK] + b"x" * 100
+    other = _start(client, headers, other_photo)
+    assert _put(client, headers, other["upload_id"], 0, other_photo).status_code == 200
+
+    # Same first chunk, but the photo does not match what was declared
+    failing = _start(client, headers, bytes(reversed(PHOTO)))
+    for index in range(3):
+        _put(client, headers, failing["upload_id"], index)
+    response = client.post(f"/receipts/uploads/{failing['upload_id']}/complete", headers=headers)
+    assert (response.status_code, response.json()["next_chunk"]) == (409, 0)
+
+    _put(client, headers, other["upload_id"], 1, other_photo)
+    done = client.post(f"/receipts/uploads/{other['upload_id']}/complete", headers=headers)
+    assert done.json()["status"] == "COMPLETE"
+
+    upload = _start(client, headers)
+    for index in range(3):
+        _put(client, headers, upload["upload_id"], index)
+    receipts.ReceiptStore(str(tmp_path)).chunk_path(tenant_id, sha256(PHOTO[CHUNK:2 * CHUNK]).hexdigest()).unlink()
+    response = client.post(f"/receipts/uploads/{upload['upload_id']}/complete", headers=headers)
+    assert (response.status_code, response.json()["next_chunk"]) == (409, 0)
+
+
+def test_payments_only_reference_finished_photos(client: TestClient, session: Session):
+    tenant_id, device_id, user_id = str(uuid4()), str(uuid4()), str(uuid4())
+    headers = {"X-Tenant-ID": tenant_id}
+    upload = _start(client, headers)
+
+    def push(payment_id, lamport):
+        payment = {
+            "id": payment_id, "tenant_id": tenant_id, "sale_id": str(uuid4()), "amount": 6000.0,
+            "payment_method": "POS_OFFLINE", "receipt_photo": f"sha256:{upload['sha256']}",
+            "device_id": device_id, "device_type": "MOBILE", "lamport_ts": lamport,
+            "created_by": user_id, "updated_by": user_id
+        }
+        response = client.post(
+            "/sync/push", json={"payments": [payment], "client_lamport": lamport, "device_id": device_id}, headers=headers
+        )
+        return response.json()["results"][0]
+
+    payment_id = str(uuid4())
+    result = push(payment_id, 1)
+    assert result["receipt_photo"] == "not_uploaded"
+    assert session.get(PendingPayment, payment_id).receipt_photo is None
+
+    for index in range(3):
+        _put(client, headers, upload["upload_id"], index)
+    client.post(f"/receipts/uploads/{upload['upload_id']}/complete", headers=headers)
+
+    result = push(payment_id, 5)
+    assert "receipt_photo" not in result
+    session.expire_all()
+    assert session.get(PendingPayment, payment_id).receipt_photo == f"sha256:{upload['sha256']}"
+
+    # Another device of the tenant sending the same photo skips the upload
+    assert _start(client, headers)["status"] == "COMPLETE"
@@ -0,0 +1,145 @@
+"""
+Tests for offline payment reconciliation against settlement files.
+"""
+
+import json
+import pytest
+from datetime import datetime
+from uuid import uuid4
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app.models import PendingPayment
+from app.reconciliation import PaymentReconciler, read_settlements
+from app.schemas import PendingPaymentSync, SyncPushRequest
+from app.sync_engine import AgrotourSyncEngine
+
+SALE_TIME = datetime(2026, 10, 10, 12, 0)
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def _payment(session, tenant_id, amount, pos_transaction_id=None, method="POS_OFFLINE", created_at=SALE_TIME):
+    user_id = uuid4()
+    payment = PendingPayment(
+        tenant_id=tenant_id, sale_id=uuid4(), amount=amount, payment_method=method,
+        pos_transaction_id=pos_transaction_id, device_id=uuid4(), device_type="MOBILE",
+        created_at=created_at, created_by=user_id, updated_by=user_id
+    )
+    session.add(payment)
+    session.commit()
+    return payment.id
+
+
+def _statuses(session):
+    return {p.id: p.reconciliation_status for p in session.exec(select(PendingPayment)).all()}
+
+
+def test_reconcile_csv_settlement(session: Session, tmp_path):
+    tenant_id = uuid4()
+    paid = _payment(session, tenant_id, 6000.0, "MP-1001")
+    wrong_amount = _payment(session, tenant_id, 4500.0, "MP-1002")
+    declined = _payment(session, tenant_id, 3000.0, "MP-1003")
+    never_settled = _payment(session, tenant_id, 9000.0, "MP-1004")
+    transfer = _payment(session, tenant_id, 12000.0, method="TRANSFER")
+    other_tenant = _payment(session, uuid4(), 6000.0, "MP-1001")
+
+    settlement = tmp_path / "settlement.csv"
+    settlement.write_text(
+        "operation_id,transaction_amount,date_approved,status\n"
+        "MP-1001,6000.00,2026-10-11T09:30:00Z,approved\n"
+        "MP-1002,4000.00,2026-10-11T09:31:00Z,approved\n"
+        "MP-1003,3000.00,2026-10-11T09:32:00Z,declined\n"
+        "MP-9999,1000.00,2026-10-11T09:33:00Z,approved\n"
+        ",12000,2026-10-10T18:00:00,approved\n"
+    )
+
+    result = PaymentReconciler(session).reconcile(tenant_id, read_settlements(settlement))
+
+    assert (result["confirmed"], result["failed"], result["unmatched_settlements"], result["still_pending"]) == (2, 2, 1, 1)
+    statuses = _statuses(session)
+    assert statuses[paid] == statuses[transfer] == "CONFIRMED"
+    assert statuses[wrong_amount] == statuses[declined] == "FAILED"
+    assert statuses[never_settled] == statuses[other_tenant] == "PENDING"
+    confirmed = session.get(PendingPayment, paid)
+    assert confirmed.reconciled and confirmed.reconciled_at and confirmed.version == 2
+
+
+def test_time_window_and_dry_run(session: Session, tmp_path):
+    """A transfer settled outside the window stays pending; a dry run writes nothing."""
+    tenant_id = uuid4()
+    transfer = _payment(session, tenant_id, 5000.0, method="TRANSFER")
+    paid = _payment(session, tenant_id, 2500.0, "SU-77")
+
+    settlement = tmp_path / "settlement.json"
+    settlement.write_text(json.dumps({"results": [
+        {"amount": 5000, "date": "2026-10-20T10:00:00"},
+        {"transaction_id": "SU-77", "amount": 2500, "date": "2026-10-10T13:00:00"},
+    ]}))
+
+    result = PaymentReconciler(session, window_hours=72).reconcile(tenant_id, read_settlements(settlement), dry_run=True)
+
+    assert (result["status"], result["confirmed"], result["unmatched_settlements"]) == ("dry_run", 1, 1)
+    assert _statuses(session) == {transfer: "PENDING", paid: "PENDING"}
+
+
+def test_cash_payments_are_not_matched(session: Session, tmp_path):
+    """A bank transfer of the same amount must not confirm a cash sale."""
+    tenant_id = uuid4()
+    cash = _payment(session, tenant_id, 7000.0, method="CASH")
+
+    settlement = tmp_path / "settlement.json"
+    settlement.write_text(json.dumps([{"amount": 7000, "date": "2026-10-10T13:00:00", "status": "approved"}]))
+
+    result = PaymentReconciler(session).reconcile(tenant_id, read_settlements(settlement))
+
+    assert (result["confirmed"], result["unmatched_settlements"], result["still_pending"]) == (0, 1, 0)
+    assert _statuses(session)[cash] == "PENDING"
+
+
+def test_reconciled_status_survives_a_stale_device_push(session: Session, tmp_path):
+    tenant_id = uuid4()
+    paid = _payment(session, tenant_id, 6000.0, "MP-1001")
+    # The device's copy of the payment, as it was before the settlement
+    device_copy = PendingPaymentSync(**session.get(PendingPayment, paid).model_dump())
+
+    settlement = tmp_path / "settlement.json"
+    settlement.write_text(json.dumps([{"operation_id": "MP-1001", "amount": 6000, "date": "2026-10-11T09:30:00"}]))
+    PaymentReconciler(session).reconcile(tenant_id, read_settlements(settlement))
+
+    payment = session.get(PendingPayment, paid)
+    assert payment.lamport_ts > device_copy.lamport_ts
+    assert payment.content_hash == payment.compute_hash()
+
+    # A device edit re-sending the old row loses LWW; the clock covers the new stamp
+    device_copy.lamport_ts += 1
+    sync_engine = AgrotourSyncEngine(session)
+    results = sync_engine.apply_push(SyncPushRequest(payments=[device_copy], client_lamport=0, device_id=uuid4()))
+    assert results[0]["status"] == "ignored"
+    assert sync_engine.server_lamport >= payment.lamport_ts
+    session.expire_all()
+    assert session.get(PendingPayment, paid).reconciliation_status == "CONFIRMED"
+
+
+def test_row_numbers_are_not_transaction_ids(session: Session, tmp_path):
+    tenant_id = uuid4()
+    transfer = _payment(session, tenant_id, 8000.0, method="TRANSFER")
+
+    settlement = tmp_path / "settlement.json"
+    settlement.write_text(json.dumps({"results": [{"id": 1, "amount": 8000, "date": "2026-10-10T15:00:00"}]}))
+
+    result = PaymentReconciler(session).reconcile(tenant_id, read_settlements(settlement))
+
+    assert result["confirmed"] == 1
+    assert _statuses(session)[transfer] == "CONFIRMED"
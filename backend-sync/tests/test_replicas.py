@@ -0,0 +1,99 @@
+"""
+Tests for lag-aware read-replica routing.
+"""
+
+import pytest
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel
+from sqlmodel.pool import StaticPool
+
+from app import replicas
+from app.main import app
+from app.database import get_session
+from app.models import StockEvent
+from app.replicas import ReplicaRouter
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def _events(session, tenant_id, lamports):
+    user_id, product_id, device_id = uuid4(), uuid4(), uuid4()
+    for lamport in lamports:
+        session.add(StockEvent(
+            tenant_id=tenant_id, product_id=product_id, device_id=device_id, device_type="WEB",
+            operation="INCREMENT", delta=1, reason="RESTOCK", lamport_ts=lamport,
+            operation_hash=uuid4().hex, created_by=user_id, updated_by=user_id
+        ))
+    session.commit()
+
+
+@pytest.fixture(name="tenant_id")
+def tenant_fixture():
+    return uuid4()
+
+
+@pytest.fixture(name="session")
+def session_fixture(tenant_id):
+    """Primary session with the tenant up to Lamport 5."""
+    with Session(_engine()) as session:
+        _events(session, tenant_id, [1, 2, 3, 4, 5])
+        yield session
+
+
+@pytest.fixture(name="router")
+def router_fixture(tenant_id, monkeypatch):
+    """One replica that has only replayed up to Lamport 3."""
+    replica = _engine()
+    with Session(replica) as session:
+        _events(session, tenant_id, [1, 2, 3])
+    
+    router = ReplicaRouter([replica], head_ttl=0)
+    monkeypatch.setattr(replicas, "_router", router)
+    return router
+
+
+def test_routes_to_caught_up_replica(router: ReplicaRouter, session: Session, tenant_id):
+    with router.read_session(session, tenant_id, min_lamport=3) as reader:
+        assert reader is not session
+    
+    with router.read_session(session, tenant_id, min_lamport=4) as reader:
+        assert reader is session
+
+
+def test_unreachable_replica_falls_back(session: Session, tenant_id):
+    broken = create_engine("sqlite:////nonexistent/dir/replica.db")
+    router = ReplicaRouter([broken])
+    
+    with router.read_session(session, tenant_id, min_lamport=0) as reader:
+        assert reader is session
+
+
+def test_pull_is_lag_aware(router: ReplicaRouter, session: Session, tenant_id):
+    """Pulls read the replica unless it is behind the client's cursor."""
+    app.dependency_overrides[get_session] = lambda: session
+    client = TestClient(app)
+    
+    def pull(last_lamport):
+        response = client.post(
+            "/sync/pull",
+            json={"tenant_id": str(tenant_id), "last_lamport": last_lamport},
+            headers={"X-Tenant-ID": str(tenant_id)}
+        )
+        assert response.status_code == 200
+        return [op["lamport_ts"] for op in response.json()["operations"]]
+    
+    try:
+        assert pull(0) == [1, 2, 3]     # replica
+        assert pull(3) == []            # replica: nothing new there yet
+        assert pull(4) == [5]           # replica behind the client: primary
+    finally:
+        app.dependency_overrides.clear()
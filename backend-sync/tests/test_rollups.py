@@ -0,0 +1,167 @@
+"""
+Tests for time-bucketed stock and sales rollups.
+"""
+
+import pytest
+from datetime import datetime
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app.main import app
+from app.database import get_session
+from app.models import Product, StockEvent, StockRollup
+from app import rollups
+from app.rollups import RollupStore
+from app.schemas import StockEventCreate, SyncPushRequest
+from app.sync_engine import AgrotourSyncEngine
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="product")
+def product_fixture(session: Session):
+    user_id = uuid4()
+    product = Product(
+        tenant_id=uuid4(), name="Miel de ulmo", price=6000.0, sku=f"SKU-{uuid4().hex[:8]}",
+        current_stock=20, device_id=uuid4(), device_type="WEB", created_by=user_id, updated_by=user_id
+    )
+    session.add(product)
+    session.commit()
+    session.refresh(product)
+    return product
+
+
+def _event(product, created_at, delta, reason, amount=None, lamport_ts=0, operation=None):
+    user_id = uuid4()
+    return StockEvent(
+        tenant_id=product.tenant_id, product_id=product.id, device_id=uuid4(), device_type="MOBILE",
+        operation=operation or ("INCREMENT" if delta > 0 else "DECREMENT"), delta=delta, reason=reason,
+        amount=amount, lamport_ts=lamport_ts, created_at=created_at, operation_hash=uuid4().hex,
+        created_by=user_id, updated_by=user_id
+    )
+
+
+def _seed(session, product):
+    """Restock 30 on Monday, sell 4 + 6 on Tuesday and 2 the next Monday."""
+    RollupStore(session).add([
+        _event(product, datetime(2026, 10, 5, 8, 0), 30, "RESTOCK"),
+        _event(product, datetime(2026, 10, 6, 10, 15), -4, "SALE", 24000.0),
+        _event(product, datetime(2026, 10, 6, 10, 45), -6, "SALE", 36000.0),
+        _event(product, datetime(2026, 10, 12, 9, 0), -2, "SALE", 12000.0),
+    ])
+    session.commit()
+
+
+def test_accepted_events_update_rollups(session: Session, product: Product):
+    """The engine folds each accepted event into its hour and day buckets."""
+    user_id = uuid4()
+    operations = [StockEventCreate(
+        tenant_id=product.tenant_id, product_id=product.id, device_id=uuid4(), device_type="MOBILE",
+        operation="DECREMENT", delta=-1, reason="SALE", amount=6000.0, lamport_ts=1,
+        created_by=user_id, updated_by=user_id
+    )]
+    results = AgrotourSyncEngine(session).apply_push(SyncPushRequest(operations=operations, client_lamport=1, device_id=uuid4()))
+    assert results[0]["status"] == "accepted"
+    
+    rollups = session.exec(select(StockRollup)).all()
+    assert sorted(r.granularity for r in rollups) == ["DAY", "HOUR"]
+    assert all((r.sales_units, r.sales_amount, r.units_out, r.event_count) == (1, 6000.0, 1, 1) for r in rollups)
+
+
+def test_buckets_accumulate(session: Session, product: Product):
+    _seed(session, product)
+    
+    hours = RollupStore(session).series(
+        product.tenant_id, product.id, "HOUR", datetime(2026, 10, 6), datetime(2026, 10, 7)
+    )
+    assert len(hours) == 1
+    assert hours[0]["bucket_start"] == "2026-10-06T10:00:00"
+    assert (hours[0]["sales_units"], hours[0]["sales_amount"], hours[0]["event_count"]) == (10, 60000.0, 2)
+
+
+def test_series_endpoint(session: Session, product: Product):
+    """Weekly buckets and a stock curve anchored on the current stock."""
+    _seed(session, product)
+    app.dependency_overrides[get_session] = lambda: session
+    client = TestClient(app)
+    
+    try:
+        response = client.get(
+            f"/analytics/products/{product.id}",
+            params={"granularity": "week", "since": "2026-10-05T00:00:00Z", "until": "2026-10-19T00:00:00Z"},
+            headers={"X-Tenant-ID": str(product.tenant_id)}
+        )
+        assert response.status_code == 200
+        body = response.json()
+        
+        assert [b["bucket_start"] for b in body["buckets"]] == ["2026-10-05T00:00:00", "2026-10-12T00:00:00"]
+        assert [b["net_delta"] for b in body["buckets"]] == [20, -2]
+        assert [b["stock"] for b in body["buckets"]] == [22, 20]
+        # EVENTS mode: the curve hangs off the product's last written stock
+        assert body["stock_source"] == "snapshot"
+        assert body["stock_lamport"] == product.lamport_ts
+        assert body["sales_units"] == 12
+        assert body["sales_per_day"] == round(12 / 14, 3)
+        
+        response = client.get(
+            "/analytics/products",
+            params={"since": "2026-10-01T00:00:00", "until": "2026-10-19T00:00:00"},
+            headers={"X-Tenant-ID": str(product.tenant_id)}
+        )
+        assert response.json()["products"][0]["sales_amount"] == 72000.0
+        
+        response = client.get(
+            f"/analytics/products/{product.id}", params={"granularity": "month"},
+            headers={"X-Tenant-ID": str(product.tenant_id)}
+        )
+        assert response.status_code == 400
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_stock_curve_applies_events_after_the_snapshot(session: Session, product: Product):
+    """Events logged after the last product sync move the curve; earlier ones are in the snapshot."""
+    _seed(session, product)
+    product.lamport_ts = 10
+    session.add(product)
+    later = [
+        _event(product, datetime(2026, 10, 8, 9, 0), -5, "SALE", lamport_ts=9),
+        _event(product, datetime(2026, 10, 13, 9, 0), -3, "SALE", 18000.0, lamport_ts=11),
+    ]
+    session.add_all(later)
+    RollupStore(session).add(later)
+    session.commit()
+    store = RollupStore(session)
+    
+    weeks = store.series(product.tenant_id, product.id, "WEEK", datetime(2026, 10, 5), datetime(2026, 10, 19))
+    assert [b["net_delta"] for b in weeks] == [15, -5]
+    assert [b["stock"] for b in weeks] == [22, 17]
+    
+    # A SET after the snapshot replaces it
+    reset = [
+        _event(product, datetime(2026, 10, 14, 9, 0), 50, "RESTOCK", lamport_ts=12, operation="SET"),
+        _event(product, datetime(2026, 10, 14, 10, 0), -1, "SALE", lamport_ts=13),
+    ]
+    session.add_all(reset)
+    session.commit()
+    assert store.current_stock(product.tenant_id, product.id) == 49
+
+
+def test_stock_anchor_in_crdt_mode(session: Session, product: Product, monkeypatch):
+    monkeypatch.setattr(rollups, "SYNC_STOCK_MODE", "CRDT")
+    assert RollupStore(session).stock_anchor(product.tenant_id, product.id) == {
+        "stock_source": "counters", "stock_lamport": None
+    }
@@ -0,0 +1,226 @@
+"""
+Tests for tenant sharding and online tenant moves.
+"""
+
+import asyncio
+import json
+import pytest
+from datetime import datetime
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlalchemy import func
+from sqlmodel import Session, create_engine, SQLModel, select
+
+from app import shards
+from app.archive import archive_all
+from app.main import app
+from app.models import Product, StockEvent, StockRollup, SyncDevice
+from app.product_import import JSONL, ProductImporter, parse_lines
+from app.rebuild import rebuild
+from app.stream_ingest import StreamIngestor
+from app.schemas import SyncPushRequest
+from app.shards import ShardRouter, TenantMoving, _sync_pass, move_tenant
+from app.sync_engine import AgrotourSyncEngine
+
+
+@pytest.fixture(name="router")
+def router_fixture(tmp_path, monkeypatch):
+    """Two file databases; the first one holds the directory."""
+    engines = {}
+    for name in ("default", "eu2"):
+        engines[name] = create_engine(f"sqlite:///{tmp_path / name}.db", connect_args={"check_same_thread": False})
+        SQLModel.metadata.create_all(engines[name])
+
+    router = ShardRouter(engines, engines["default"], ttl=0)
+    monkeypatch.setattr(shards, "DATABASE_SHARD_URLS", {"eu2": "sqlite://"})
+    monkeypatch.setattr(shards, "_router", router)
+    return router
+
+
+def _push(session, tenant_id, events=3):
+    user_id, device_id = uuid4(), uuid4()
+    product_id = uuid4()
+    AgrotourSyncEngine(session).apply_push(SyncPushRequest(
+        operations=[{
+            "tenant_id": tenant_id, "product_id": product_id, "device_id": device_id,
+            "device_type": "MOBILE", "operation": "DECREMENT", "delta": 1, "reason": "SALE",
+            "lamport_ts": i + 1, "operation_hash": uuid4().hex,
+            "created_by": user_id, "updated_by": user_id
+        } for i in range(events)],
+        client_lamport=events,
+        device_id=device_id
+    ))
+    session.add(SyncDevice(tenant_id=tenant_id, device_id=device_id))
+    session.commit()
+
+
+def _count(engine, model, tenant_id):
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(model).where(model.tenant_id == tenant_id)).one()
+
+
+def test_unplaced_tenants_stay_on_default(router):
+    tenant_id = uuid4()
+    assert router.shard_of(tenant_id) == "default"
+    router.assign(tenant_id, "eu2")
+    assert router.engine_for(tenant_id) is router.engines["eu2"]
+    with pytest.raises(ValueError):
+        router.assign(tenant_id, "nowhere")
+
+
+def test_move_tenant(router):
+    tenant_id, other = uuid4(), uuid4()
+    source, target = router.engines["default"], router.engines["eu2"]
+    with Session(source) as session:
+        _push(session, tenant_id)
+        _push(session, other)
+
+    result = move_tenant(router, tenant_id, "eu2", grace=0, purge=True)
+
+    assert result["status"] == "moved"
+    assert router.shard_of(tenant_id) == "eu2"
+    assert shards.engine_for_tenant(tenant_id) is target
+    for model, rows in ((StockEvent, 3), (StockRollup, 2), (SyncDevice, 1)):
+        assert _count(target, model, tenant_id) == rows
+        assert _count(source, model, tenant_id) == 0
+    # Other tenants are untouched
+    assert _count(source, StockEvent, other) == 3
+    assert _count(target, StockEvent, other) == 0
+
+
+def test_catch_up_pass_copies_changes_and_deletions(router):
+    tenant_id = uuid4()
+    source, target = router.engines["default"], router.engines["eu2"]
+    with Session(source) as session:
+        _push(session, tenant_id)
+
+    with Session(source) as from_session, Session(target) as to_session:
+        _sync_pass(from_session, to_session, tenant_id, None, 100)
+        copied = datetime.utcnow()
+
+        with Session(source) as session:
+            _push(session, tenant_id, events=1)
+            session.delete(session.exec(select(SyncDevice)).first())
+            session.commit()
+
+        result = _sync_pass(from_session, to_session, tenant_id, copied, 100)
+
+    assert result["deleted"] == 1
+    assert result["tables"]["stock_events"] == 1
+    assert _count(target, StockEvent, tenant_id) == 4
+    assert _count(target, SyncDevice, tenant_id) == 1
+
+
+def test_moving_tenant_gets_503(router):
+    tenant_id = uuid4()
+    router.assign(tenant_id, "default", status="MOVING")
+    with pytest.raises(TenantMoving):
+        router.shard_of(tenant_id)
+
+    response = TestClient(app).get("/sync/devices", headers={"X-Tenant-ID": str(tenant_id)})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+
+def test_rebuild_runs_each_tenant_on_its_shard(router):
+    staying, moved = uuid4(), uuid4()
+    source, target = router.engines["default"], router.engines["eu2"]
+    with Session(source) as session:
+        _push(session, staying)
+        _push(session, moved)
+    # Without --purge the source keeps a stale copy of the moved tenant
+    move_tenant(router, moved, "eu2", grace=0)
+
+    with Session(target) as session:
+        session.delete(session.exec(select(StockRollup)).first())
+        session.commit()
+    assert _count(target, StockRollup, moved) == 1
+
+    totals = rebuild(workers=1, archive_path=None)
+
+    assert totals["partitions"] == 2
+    assert totals["events"] == 6
+    assert _count(target, StockRollup, moved) == 2
+    assert _count(target, StockRollup, staying) == 0
+
+
+def _operations(tenant_id, count):
+    device_id, user_id, product_id = str(uuid4()), str(uuid4()), str(uuid4())
+    yield json.dumps({"device_id": device_id, "client_lamport": count}).encode() + b"\n"
+    for i in range(count):
+        yield json.dumps({
+            "kind": "operation", "tenant_id": str(tenant_id), "product_id": product_id, "device_id": device_id,
+            "device_type": "MOBILE", "operation": "DECREMENT", "delta": -1, "reason": "SALE",
+            "lamport_ts": i + 1, "created_by": user_id, "updated_by": user_id
+        }).encode() + b"\n"
+
+
+def test_stream_stops_at_the_chunk_after_a_freeze(router):
+    tenant_id = uuid4()
+    source = router.engines["default"]
+
+    async def body():
+        for number, line in enumerate(_operations(tenant_id, 4)):
+            if number == 3:
+                # Frozen while the upload is in flight (after the first chunk of 2)
+                router.assign(tenant_id, "default", status="MOVING")
+            yield line
+
+    async def consume(ingestor):
+        return [json.loads(line) async for line in ingestor.run(body())]
+
+    with Session(source) as session:
+        lines = asyncio.run(consume(StreamIngestor(session, tenant_id, chunk_size=2)))
+
+    assert lines[0]["items"] == 2
+    assert lines[-1]["status"] == "moving"
+    assert lines[-1]["items"] == 2
+    assert _count(source, StockEvent, tenant_id) == 2
+
+
+def test_long_uploads_of_a_moving_tenant_get_503(router):
+    tenant_id = uuid4()
+    router.assign(tenant_id, "default", status="MOVING")
+    client = TestClient(app)
+    headers = {"X-Tenant-ID": str(tenant_id)}
+
+    response = client.post("/sync/push/stream", content=b"".join(_operations(tenant_id, 2)), headers=headers)
+    assert response.status_code == 503
+
+    response = client.post(
+        f"/products/import?created_by={uuid4()}",
+        content=b'{"sku": "A-1", "name": "Queso", "price": 1000}\n',
+        headers={**headers, "Content-Type": JSONL}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+
+def test_import_stops_once_the_tenant_is_switched(router):
+    tenant_id = uuid4()
+    source = router.engines["default"]
+    lines = [f'{{"sku": "A-{i}", "name": "Queso {i}", "price": 1000}}\n' for i in range(4)]
+
+    def catalog():
+        for number, line in enumerate(lines):
+            if number == 2:
+                router.assign(tenant_id, "eu2")
+            yield line
+
+    with Session(source) as session:
+        with pytest.raises(TenantMoving):
+            ProductImporter(session, tenant_id, uuid4(), chunk_size=2).run(parse_lines(catalog(), JSONL))
+
+    assert _count(source, Product, tenant_id) == 2
+
+
+def test_archive_skips_a_moving_tenant(router, tmp_path, capsys):
+    tenant_id = uuid4()
+    with Session(router.engines["default"]) as session:
+        _push(session, tenant_id)
+    router.assign(tenant_id, "default", status="MOVING")
+
+    archive_all(tenant_id, after_days=0, root=str(tmp_path))
+
+    assert "skipped (moving shards)" in capsys.readouterr().out
+    assert _count(router.engines["default"], StockEvent, tenant_id) == 3
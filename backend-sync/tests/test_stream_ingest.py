@@ -0,0 +1,153 @@
+"""
+Tests for streaming NDJSON ingestion.
+"""
+
+import json
+import pytest
+from contextlib import nullcontext
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app import catalog
+from app.main import app
+from app.database import get_session, get_session_factory
+from app.models import Product, StockEvent, SyncDevice
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    """Test client bound to the in-memory session (no startup hooks)."""
+    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_session_factory] = lambda: (lambda tenant_id: nullcontext(session))
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def _body(tenant_id, device_id, count, bad_line=None):
+    user_id = str(uuid4())
+    product_id = str(uuid4())
+    lines = [json.dumps({"device_id": device_id, "client_lamport": count})]
+    for i in range(count):
+        lines.append(json.dumps({
+            "kind": "operation",
+            "tenant_id": tenant_id,
+            "product_id": product_id,
+            "device_id": device_id,
+            "device_type": "MOBILE",
+            "operation": "DECREMENT",
+            "delta": -1,
+            "reason": "SALE",
+            "lamport_ts": i + 1,
+            "created_by": user_id,
+            "updated_by": user_id
+        }))
+    if bad_line is not None:
+        lines.insert(bad_line, '{"kind": "operation", "delta": "many"}')
+    return ("\n".join(lines) + "\n").encode()
+
+
+def _stream(client, tenant_id, body, chunk_size, idempotency_key=None):
+    headers = {"X-Tenant-ID": tenant_id, "Content-Type": "application/x-ndjson"}
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+    response = client.post(f"/sync/push/stream?chunk_size={chunk_size}", content=body, headers=headers)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_stream_applies_in_chunks(client: TestClient, session: Session):
+    """Every op is applied, one result line per chunk plus a summary."""
+    tenant_id, device_id = str(uuid4()), str(uuid4())
+    
+    lines = _stream(client, tenant_id, _body(tenant_id, device_id, 25), chunk_size=10)
+    
+    assert [line["items"] for line in lines[:-1]] == [10, 10, 5]
+    assert all(r["status"] == "accepted" for line in lines[:-1] for r in line["results"])
+    assert lines[-1]["status"] == "complete"
+    assert lines[-1]["items"] == 25
+    
+    assert len(session.exec(select(StockEvent)).all()) == 25
+    device = session.exec(select(SyncDevice)).one()
+    assert str(device.device_id) == device_id
+    assert device.last_pushed_lamport == lines[-1]["server_lamport"]
+
+
+def test_malformed_line_stops_the_stream(client: TestClient, session: Session):
+    """Chunks before a bad line stay applied; the error names the line."""
+    tenant_id, device_id = str(uuid4()), str(uuid4())
+    
+    lines = _stream(client, tenant_id, _body(tenant_id, device_id, 10, bad_line=7), chunk_size=4)
+    
+    assert lines[-1]["status"] == "error"
+    assert lines[-1]["line"] == 8
+    assert lines[-1]["items"] == 4
+    assert len(session.exec(select(StockEvent)).all()) == 4
+
+
+def test_resent_stream_replays_stored_chunks(client: TestClient, session: Session):
+    """With an Idempotency-Key, chunks applied before a cut are answered from their receipts."""
+    tenant_id, device_id = str(uuid4()), str(uuid4())
+    body = _body(tenant_id, device_id, 10)
+    lines = body.decode().splitlines()
+    cut = ("\n".join(lines[:9] + ['{"kind": "operation", "delta": "many"}']) + "\n").encode()
+    
+    first = _stream(client, tenant_id, cut, chunk_size=4, idempotency_key="backlog-1")
+    assert first[-1]["status"] == "error"
+    
+    resent = _stream(client, tenant_id, body, chunk_size=4, idempotency_key="backlog-1")
+    assert resent[:2] == first[:2]
+    assert [r["status"] for r in resent[2]["results"]] == ["accepted", "accepted"]
+    assert resent[-1]["status"] == "complete"
+    assert len(session.exec(select(StockEvent)).all()) == 10
+    
+    other = _stream(client, tenant_id, _body(tenant_id, device_id, 4), chunk_size=4, idempotency_key="backlog-1")
+    assert other == [{"status": "error", "chunk": 0, "detail": other[0]["detail"], "items": 0}]
+
+
+def test_missing_header(client: TestClient):
+    tenant_id = str(uuid4())
+    
+    lines = _stream(client, tenant_id, b'{"kind": "operation"}\n', chunk_size=10)
+    assert lines == [{"status": "error", "line": 1, "detail": lines[0]["detail"], "items": 0}]
+    assert lines[0]["detail"].startswith("Invalid header")
+
+
+def test_stream_refreshes_sku_cache(client: TestClient, session: Session, monkeypatch):
+    """Products changed by a streamed chunk are not served stale from the SKU cache."""
+    monkeypatch.setattr(catalog, "_cache", None)
+    tenant_id, device_id, user_id = uuid4(), uuid4(), uuid4()
+    product = Product(
+        tenant_id=tenant_id, name="Miel", price=4500.0, sku="MIEL-500", lamport_ts=1,
+        device_id=device_id, device_type="WEB", created_by=user_id, updated_by=user_id
+    )
+    session.add(product)
+    session.commit()
+    headers = {"X-Tenant-ID": str(tenant_id)}
+    assert client.get("/products/by-sku/MIEL-500", headers=headers).json()["price"] == 4500.0
+    
+    update = product.model_dump(mode="json", include={
+        "id", "tenant_id", "name", "sku", "current_stock", "device_id", "device_type", "created_by", "updated_by"
+    })
+    body = "\n".join([
+        json.dumps({"device_id": str(device_id), "client_lamport": 5}),
+        json.dumps({"kind": "product", **update, "price": 5000.0, "lamport_ts": 5}),
+    ]).encode()
+    lines = _stream(client, str(tenant_id), body, chunk_size=10)
+    assert lines[0]["results"][0]["status"] == "accepted"
+    
+    assert client.get("/products/by-sku/MIEL-500", headers=headers).json()["price"] == 5000.0
@@ -0,0 +1,114 @@
+"""
+Tests for subscription filters on selective pull.
+"""
+
+import pytest
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel
+from sqlmodel.pool import StaticPool
+
+from app.main import app
+from app.database import get_session
+from app.models import Product
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    """Test client bound to the in-memory session (no startup hooks)."""
+    app.dependency_overrides[get_session] = lambda: session
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def _seed(client, session, tenant_id):
+    """Three products (one of them a cheese) with one restock event each."""
+    user_id = str(uuid4())
+    device_id = str(uuid4())
+    products = []
+    for i, category in enumerate(["QUESOS", "MIEL", "MIEL"]):
+        product = Product(
+            tenant_id=tenant_id, name=f"Prod {i}", price=1000.0, sku=f"SKU-{uuid4().hex[:8]}",
+            category=category, device_id=uuid4(), device_type="WEB",
+            created_by=uuid4(), updated_by=uuid4()
+        )
+        session.add(product)
+        products.append(product)
+    session.commit()
+    
+    operations = [{
+        "tenant_id": tenant_id,
+        "product_id": str(p.id),
+        "device_id": device_id,
+        "device_type": "WEB",
+        "operation": "INCREMENT",
+        "delta": 10,
+        "reason": "RESTOCK",
+        "lamport_ts": 1,
+        "created_by": user_id,
+        "updated_by": user_id
+    } for p in products]
+    response = client.post(
+        "/sync/push",
+        json={"operations": operations, "client_lamport": 1, "device_id": device_id},
+        headers={"X-Tenant-ID": tenant_id}
+    )
+    assert response.status_code == 200
+    return [str(p.id) for p in products]
+
+
+def _pull(client, tenant_id, device_id, subscription=None):
+    body = {"tenant_id": tenant_id, "last_lamport": 0, "device_id": device_id}
+    if subscription is not None:
+        body["subscription"] = subscription
+    response = client.post("/sync/pull", json=body, headers={"X-Tenant-ID": tenant_id})
+    assert response.status_code == 200
+    return {op["product_id"] for op in response.json()["operations"]}
+
+
+def test_device_subscription_is_stored(client: TestClient, session: Session):
+    """A device only pulls its subscribed products, on later pulls too."""
+    tenant_id = str(uuid4())
+    cheese, honey_a, honey_b = _seed(client, session, tenant_id)
+    device_id = str(uuid4())
+    
+    assert _pull(client, tenant_id, device_id, {"product_ids": [honey_a]}) == {honey_a}
+    assert _pull(client, tenant_id, device_id) == {honey_a}
+    
+    assert _pull(client, tenant_id, device_id, {"categories": ["QUESOS"], "product_ids": [honey_b]}) == {cheese, honey_b}
+    
+    # Empty subscription means everything again
+    assert _pull(client, tenant_id, device_id, {}) == {cheese, honey_a, honey_b}
+
+
+def test_role_subscription(client: TestClient, session: Session):
+    """Devices of a role share the role's subscription."""
+    tenant_id = str(uuid4())
+    cheese, honey_a, honey_b = _seed(client, session, tenant_id)
+    
+    response = client.put(
+        "/sync/subscriptions/MARKET_POS",
+        json={"categories": ["MIEL"]},
+        headers={"X-Tenant-ID": tenant_id}
+    )
+    assert response.status_code == 200
+    
+    pos = str(uuid4())
+    assert _pull(client, tenant_id, pos, {"device_role": "MARKET_POS"}) == {honey_a, honey_b}
+    assert _pull(client, tenant_id, pos) == {honey_a, honey_b}
+    
+    other = str(uuid4())
+    assert _pull(client, tenant_id, other) == {cheese, honey_a, honey_b}
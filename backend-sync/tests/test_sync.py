@@ -5,10 +5,12 @@ Tests for Agrotour Sync Engine.
 import pytest
 from uuid import uuid4
 from datetime import datetime
-from sqlmodel import Session, create_engine, SQLModel
+from sqlalchemy import event
+from sqlmodel import Session, create_engine, SQLModel, select
 from sqlmodel.pool import StaticPool
 
 from app.models import StockEvent, SyncConflict
+from app.schemas import SyncPushRequest
 from app.sync_engine import AgrotourSyncEngine
 
 
@@ -189,3 +191,50 @@ def test_paid_sale_priority(session: Session):
     
     result = sync_engine.accept_operation(op2)
     assert result["status"] in ["accepted", "conflict"]
+
+
+def _batch(tenant_id, product_ids, device_id, user_id, lamport=1):
+    return SyncPushRequest(
+        operations=[{
+            "tenant_id": tenant_id, "product_id": product_id, "device_id": device_id,
+            "device_type": "MOBILE", "operation": "DECREMENT", "delta": 1, "reason": "SALE",
+            "lamport_ts": lamport, "created_by": user_id, "updated_by": user_id
+        } for product_id in product_ids],
+        client_lamport=lamport,
+        device_id=device_id
+    )
+
+
+def test_push_batch_prefetches_lookups(session: Session):
+    """Idempotency and concurrency lookups cost two queries per batch, not per event."""
+    tenant_id, user_id = uuid4(), uuid4()
+    products = [uuid4() for _ in range(20)]
+    AgrotourSyncEngine(session).apply_push(_batch(tenant_id, products[:1], uuid4(), user_id))
+    
+    selects = []
+    listen = lambda conn, cursor, statement, *args: selects.append(statement) if statement.startswith("SELECT") else None
+    event.listen(session.get_bind(), "before_cursor_execute", listen)
+    try:
+        results = AgrotourSyncEngine(session).apply_push(_batch(tenant_id, products, uuid4(), user_id, lamport=500))
+    finally:
+        event.remove(session.get_bind(), "before_cursor_execute", listen)
+    
+    assert [r["status"] for r in results] == ["accepted"] * 20
+    # Max Lamport, known hashes and recent events
+    assert len(selects) == 3
+
+
+def test_push_batch_sees_its_own_events(session: Session):
+    """Duplicates and concurrency inside one batch are detected from the prefetched state."""
+    tenant_id, product_id, user_id = uuid4(), uuid4(), uuid4()
+    first = _batch(tenant_id, [product_id], uuid4(), user_id)
+    first.operations[0].operation_hash = uuid4().hex
+    second = _batch(tenant_id, [product_id], uuid4(), user_id, lamport=2)
+    request = first.model_copy(update={"operations": first.operations * 2 + second.operations})
+    
+    results = AgrotourSyncEngine(session).apply_push(request)
+    
+    assert [r["status"] for r in results[:2]] == ["accepted", "duplicate"]
+    assert results[1]["operation_id"] == results[0]["operation_id"]
+    # The second device's sale is concurrent with the first one of the batch
+    assert len(session.exec(select(SyncConflict)).all()) == 1
@@ -0,0 +1,186 @@
+"""
+Tests for device acknowledgements and tombstone garbage collection.
+"""
+
+import pytest
+from datetime import datetime, timedelta
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app.database import get_session
+from app.devices import DeviceRegistry
+from app.main import app
+from app.models import Product, SalesHeatmapCell, StockCounter, StockEvent, StockRollup, SyncDevice
+from app.tombstone_gc import TombstoneCollector
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="fk_session")
+def fk_session_fixture():
+    """Test database session enforcing foreign keys, as Postgres does."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    event.listen(engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def _product(tenant_id, lamport_ts, is_deleted=False):
+    user_id = uuid4()
+    return Product(
+        tenant_id=tenant_id, name="Queso", price=5000.0, sku=f"SKU-{uuid4().hex[:8]}",
+        lamport_ts=lamport_ts, is_deleted=is_deleted,
+        device_id=uuid4(), device_type="WEB", created_by=user_id, updated_by=user_id
+    )
+
+
+def _event(tenant_id, product_id, lamport_ts, is_deleted=False):
+    user_id = uuid4()
+    return StockEvent(
+        tenant_id=tenant_id, product_id=product_id, operation="DECREMENT", delta=1,
+        reason="SALE", lamport_ts=lamport_ts, is_deleted=is_deleted,
+        operation_hash=uuid4().hex, device_id=uuid4(), device_type="MOBILE",
+        created_by=user_id, updated_by=user_id
+    )
+
+
+def test_safe_horizon_is_min_of_active_devices(session: Session):
+    """The horizon is the lowest cursor among devices seen recently."""
+    registry = DeviceRegistry(session)
+    tenant_id = uuid4()
+    
+    assert registry.safe_horizon(tenant_id) == 0
+    
+    fast, slow, retired = uuid4(), uuid4(), uuid4()
+    registry.record_pull(tenant_id, fast, 50)
+    registry.record_pull(tenant_id, slow, 20)
+    registry.record_pull(tenant_id, retired, 5)
+    registry.record_pull(tenant_id, fast, 60)
+    
+    row = session.exec(select(SyncDevice).where(SyncDevice.device_id == retired)).one()
+    row.last_seen_at = datetime.utcnow() - timedelta(days=365)
+    session.add(row)
+    session.commit()
+    
+    assert registry.safe_horizon(tenant_id) == 20
+    assert registry.safe_horizon(uuid4()) == 0
+
+
+def test_collect_purges_only_below_horizon(session: Session):
+    """Tombstones and events of deleted products below the horizon are purged."""
+    tenant_id = uuid4()
+    
+    live = _product(tenant_id, 1)
+    dead = _product(tenant_id, 5, is_deleted=True)
+    dead_recent = _product(tenant_id, 40, is_deleted=True)
+    session.add_all([live, dead, dead_recent])
+    session.commit()
+    
+    session.add_all([
+        _event(tenant_id, live.id, 2),
+        _event(tenant_id, live.id, 3, is_deleted=True),
+        _event(tenant_id, live.id, 35, is_deleted=True),
+        _event(tenant_id, dead.id, 4),
+        _event(tenant_id, dead_recent.id, 38),
+    ])
+    session.commit()
+    
+    live_id, dead_id, dead_recent_id = live.id, dead.id, dead_recent.id
+    
+    DeviceRegistry(session).record_pull(tenant_id, uuid4(), 30)
+    purged = TombstoneCollector(session, batch_size=1).collect(tenant_id)
+    
+    assert purged == {"horizon": 30, "stock_events": 2, "products": 1, "pending_payments": 0}
+    
+    remaining = {e.lamport_ts for e in session.exec(select(StockEvent)).all()}
+    assert remaining == {2, 35, 38}
+    session.expire_all()
+    assert session.get(Product, dead_id) is None
+    assert session.get(Product, dead_recent_id) is not None
+    assert session.get(Product, live_id) is not None
+
+
+def test_pull_below_collected_horizon_requires_resync(session: Session):
+    """A device retired while tombstones were purged is told to resync, registered or not."""
+    tenant_id = uuid4()
+    product = _product(tenant_id, 1)
+    session.add(product)
+    session.commit()
+    session.add_all([_event(tenant_id, product.id, 2), _event(tenant_id, product.id, 3, is_deleted=True)])
+    session.commit()
+    
+    registry = DeviceRegistry(session)
+    registry.record_pull(tenant_id, uuid4(), 30)
+    TombstoneCollector(session).collect(tenant_id)
+    # A later pass with a lower horizon (a device came back) does not lower it
+    TombstoneCollector(session).collect(tenant_id, horizon=10)
+    assert registry.collected_horizon(tenant_id) == 30
+    
+    app.dependency_overrides[get_session] = lambda: session
+    try:
+        client = TestClient(app)
+        pull = lambda cursor: client.post(
+            "/sync/pull",
+            json={"tenant_id": str(tenant_id), "last_lamport": cursor},
+            headers={"X-Tenant-ID": str(tenant_id)}
+        ).json()
+        stale, current, fresh = pull(1), pull(30), pull(0)
+    finally:
+        app.dependency_overrides.clear()
+    
+    assert stale["resync_required"] and stale["operations"] == [] and stale["next_lamport"] == 0
+    assert not current["resync_required"]
+    # Pulling from 0 is the resync itself
+    assert not fresh["resync_required"]
+    assert [op["lamport_ts"] for op in fresh["operations"]] == [2]
+
+
+def test_collect_purges_projections_of_deleted_products(fk_session: Session):
+    """Rollups, heatmap cells and counters of a purged product do not block it."""
+    session = fk_session
+    tenant_id = uuid4()
+    day = datetime(2026, 10, 1)
+    
+    live = _product(tenant_id, 1)
+    dead = _product(tenant_id, 5, is_deleted=True)
+    session.add_all([live, dead])
+    session.commit()
+    
+    for product_id in (live.id, dead.id):
+        session.add_all([
+            StockRollup(tenant_id=tenant_id, product_id=product_id, granularity="DAY", bucket_start=day, sales_units=1),
+            SalesHeatmapCell(
+                tenant_id=tenant_id, product_id=product_id, geohash="66jc", bucket_start=day,
+                cell_lat=-33.4, cell_lng=-70.6, sales_units=1
+            ),
+            StockCounter(tenant_id=tenant_id, product_id=product_id, device_id=uuid4(), decrements=1),
+        ])
+    session.commit()
+    live_id, dead_id = live.id, dead.id
+    
+    purged = TombstoneCollector(session).collect(tenant_id, horizon=100)
+    
+    assert purged["products"] == 1
+    session.expire_all()
+    assert session.get(Product, dead_id) is None
+    for model in (StockRollup, SalesHeatmapCell, StockCounter):
+        assert {row.product_id for row in session.exec(select(model)).all()} == {live_id}
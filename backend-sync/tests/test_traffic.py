@@ -0,0 +1,110 @@
+"""
+Tests for sanitized traffic capture and replay.
+"""
+
+import argparse
+import asyncio
+import httpx
+import pytest
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlmodel.pool import StaticPool
+
+from app.main import app
+from app.database import get_session
+from app.models import StockEvent
+from app.traffic import Sanitizer, TrafficRecorder, virtual_device
+from benchmarks.replay import load_capture, percentile, replay
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="capture")
+def capture_fixture(session: Session, tmp_path):
+    """Client whose sync traffic is recorded to a capture file."""
+    app.dependency_overrides[get_session] = lambda: session
+    path = tmp_path / "capture.jsonl"
+    yield TestClient(TrafficRecorder(app, str(path), Sanitizer("test-key"))), path
+    app.dependency_overrides.clear()
+
+
+def _push(tenant_id, device_id, product_id, user_id):
+    return {
+        "operations": [{
+            "tenant_id": tenant_id, "product_id": product_id, "device_id": device_id,
+            "device_type": "MOBILE", "operation": "DECREMENT", "delta": -1, "reason": "SALE",
+            "location_lat": -33.45, "location_lng": -70.66,
+            "lamport_ts": 1, "created_by": user_id, "updated_by": user_id
+        }],
+        "client_lamport": 1,
+        "device_id": device_id
+    }
+
+
+def test_sanitizer_is_consistent():
+    sanitizer = Sanitizer("k")
+    tenant = str(uuid4())
+    
+    cleaned = sanitizer.clean({"tenant_id": tenant, "items": [{"tenant_id": tenant.upper(), "notes": "Juan, 555-1234"}]})
+    assert cleaned["tenant_id"] != tenant
+    assert cleaned["items"][0]["tenant_id"] == cleaned["tenant_id"]
+    assert cleaned["items"][0]["notes"] is None
+    assert sanitizer.headers({"x-tenant-id": tenant})["x-tenant-id"] == cleaned["tenant_id"]
+    assert Sanitizer("other").pseudonym(tenant) != cleaned["tenant_id"]
+
+
+def test_capture_and_replay(capture, session: Session):
+    """A captured push replays as new operations from simulated devices."""
+    client, path = capture
+    tenant_id, device_id, product_id, user_id = (str(uuid4()) for _ in range(4))
+    
+    response = client.post("/sync/push", json=_push(tenant_id, device_id, product_id, user_id),
+                           headers={"X-Tenant-ID": tenant_id})
+    assert response.status_code == 200
+    client.post("/sync/pull", json={"tenant_id": tenant_id, "last_lamport": 0},
+                headers={"X-Tenant-ID": tenant_id})
+    
+    records = load_capture(str(path))
+    assert [r["path"] for r in records] == ["/sync/push", "/sync/pull"]
+    push = records[0]
+    assert push["status"] == 200
+    assert tenant_id not in path.read_text()
+    assert push["body"]["operations"][0]["location_lat"] is None
+    assert push["headers"]["x-tenant-id"] == push["body"]["operations"][0]["tenant_id"]
+    
+    # Clones keep the tenant and product but push as other devices
+    clone = virtual_device(push, 1)["body"]
+    assert clone["device_id"] != push["body"]["device_id"]
+    assert clone["operations"][0]["product_id"] == push["body"]["operations"][0]["product_id"]
+    
+    args = argparse.Namespace(url="http://sync", speed=100.0, devices=3, concurrency=1, timeout=10.0)
+    stats = asyncio.run(replay(records, args, transport=httpx.ASGITransport(app=app)))
+    
+    assert stats.statuses[200] == 6
+    assert stats.operations == 3
+    
+    # The clones sell the same product concurrently: the first is stored, the rest conflict
+    replayed_tenant = push["body"]["operations"][0]["tenant_id"]
+    assert len(session.exec(select(StockEvent).where(StockEvent.tenant_id == replayed_tenant)).all()) == 1
+    assert stats.results == {"accepted": 1, "conflict": 2}
+    assert "conflict rate: 66.67%" in stats.report(1.0, args)
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([7.0], 90) == 7.0
+    assert percentile([], 50) == 0.0
@@ -0,0 +1,129 @@
+"""
+Tests for the binary wire formats and the columnar pull layout.
+"""
+
+import pytest
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel
+from sqlmodel.pool import StaticPool
+
+from app.main import app
+from app.database import get_session
+from app.wire_format import CBOR, JSON, MSGPACK, available_formats, from_columnar, negotiate, to_columnar
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a test database session."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    """Test client bound to the in-memory session (no startup hooks)."""
+    app.dependency_overrides[get_session] = lambda: session
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def _push_body(tenant_id, device_id, count=3):
+    user_id = str(uuid4())
+    product_id = str(uuid4())
+    return {
+        "operations": [{
+            "tenant_id": tenant_id,
+            "product_id": product_id,
+            "device_id": device_id,
+            "device_type": "MOBILE",
+            "operation": "DECREMENT",
+            "delta": -1,
+            "reason": "SALE",
+            "lamport_ts": i + 1,
+            "created_by": user_id,
+            "updated_by": user_id
+        } for i in range(count)],
+        "client_lamport": count,
+        "device_id": device_id
+    }
+
+
+def test_columnar_round_trip():
+    """Repeated fields are dictionary-encoded and decode back to the rows."""
+    device, tenant = str(uuid4()), str(uuid4())
+    rows = [
+        {"id": str(uuid4()), "tenant_id": tenant, "device_id": device, "lamport_ts": i}
+        for i in range(4)
+    ]
+    
+    page = to_columnar(rows)
+    assert page["dictionaries"]["device_id"] == [device]
+    assert page["columns"]["device_id"] == [0, 0, 0, 0]
+    assert page["columns"]["lamport_ts"] == [0, 1, 2, 3]
+    assert from_columnar(page) == rows
+    assert from_columnar(to_columnar([])) == []
+
+
+def test_negotiate():
+    assert negotiate(None) == JSON
+    assert negotiate("*/*") == JSON
+    assert negotiate("text/html") == JSON
+    assert negotiate(f"{CBOR};q=0") == JSON
+    
+    preferred = MSGPACK if MSGPACK in available_formats() else JSON
+    assert negotiate(f"{JSON};q=0.5, application/x-msgpack") == preferred
+
+
+def test_msgpack_push(client: TestClient):
+    """A MessagePack push body is applied and answered in MessagePack."""
+    msgpack = pytest.importorskip("msgpack")
+    tenant_id, device_id = str(uuid4()), str(uuid4())
+    
+    response = client.post(
+        "/sync/push",
+        content=msgpack.packb(_push_body(tenant_id, device_id)),
+        headers={"X-Tenant-ID": tenant_id, "Content-Type": MSGPACK, "Accept": MSGPACK}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == MSGPACK
+    
+    results = msgpack.unpackb(response.content)["results"]
+    assert [r["status"] for r in results] == ["accepted"] * 3
+
+
+def test_cbor_columnar_pull(client: TestClient):
+    """A CBOR pull returns the columnar layout."""
+    cbor2 = pytest.importorskip("cbor2")
+    tenant_id, device_id = str(uuid4()), str(uuid4())
+    client.post("/sync/push", json=_push_body(tenant_id, device_id), headers={"X-Tenant-ID": tenant_id})
+    
+    response = client.post(
+        "/sync/pull",
+        content=cbor2.dumps({"tenant_id": tenant_id, "last_lamport": 0, "layout": "columnar"}),
+        headers={"X-Tenant-ID": tenant_id, "Content-Type": CBOR, "Accept": CBOR}
+    )
+    assert response.status_code == 200
+    
+    page = cbor2.loads(response.content)
+    assert page["operations"] == []
+    assert page["columns"]["dictionaries"]["device_id"] == [device_id]
+    
+    operations = from_columnar(page["columns"])
+    assert [op["lamport_ts"] for op in operations] == sorted(op["lamport_ts"] for op in operations)
+    assert len(operations) == 3
+
+
+def test_unsupported_body_format(client: TestClient):
+    response = client.post(
+        "/sync/pull",
+        content=b"<pull/>",
+        headers={"X-Tenant-ID": str(uuid4()), "Content-Type": "application/xml"}
+    )
+    assert response.status_code == 415